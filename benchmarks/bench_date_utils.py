@@ -0,0 +1,109 @@
+"""
+Compare date_utils with the per-call date parsing embed.py used for photoTakenTime
+
+Generates synthetic photoTakenTime records, a mix of Unix timestamps and Google Photos
+'formatted' strings that repeat across albums, and times converting all of them with the
+legacy functions, date_utils.format_date and the date_utils.format_dates batch API.
+
+Usage:
+    python benchmarks/bench_date_utils.py --records 1000000
+"""
+import argparse
+import datetime
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from date_utils import format_date, format_dates
+
+
+def legacy_clean_date_string(date_str):
+    """clean_date_string as embed.py implemented it"""
+    import string
+    printable_chars = set(string.printable)
+    cleaned = ''.join(c for c in date_str if c in printable_chars)
+    cleaned_nbsp = cleaned.replace('\xa0', ' ')
+    return re.sub(r'\s+', ' ', cleaned_nbsp)
+
+
+def legacy_format_date(photo_taken_data):
+    """format_date_for_exiftool as embed.py implemented it, without the debug logging"""
+    if not photo_taken_data:
+        return None
+    timestamp = photo_taken_data.get('timestamp')
+    date_str = legacy_clean_date_string(photo_taken_data.get('formatted', ''))
+    if timestamp and timestamp.isdigit():
+        try:
+            return datetime.datetime.fromtimestamp(int(timestamp)).strftime('%Y:%m:%d %H:%M:%S')
+        except (ValueError, OverflowError):
+            return None
+    elif date_str:
+        cleaned_date_str = legacy_clean_date_string(date_str)
+        utc_match = re.compile(r'([A-Za-z]{3} \d{1,2}, \d{4}, \d{1,2}:\d{2}:\d{2} [AP]M) UTC').search(cleaned_date_str)
+        if utc_match:
+            try:
+                dt = datetime.datetime.strptime(utc_match.group(1), '%b %d, %Y, %I:%M:%S %p')
+                return dt.strftime('%Y:%m:%d %H:%M:%S')
+            except ValueError:
+                pass
+    return None
+
+
+def synthetic_records(count, distinct_dates, formatted_share, seed=0):
+    """Return count photoTakenTime dicts drawn from distinct_dates capture times"""
+    rng = random.Random(seed)
+    base = datetime.datetime(2015, 1, 1)
+    pool = []
+    for _ in range(distinct_dates):
+        dt = base + datetime.timedelta(seconds=rng.randrange(10 * 365 * 86400))
+        pool.append({
+            'timestamp': str(int(dt.replace(tzinfo=datetime.timezone.utc).timestamp())),
+            'formatted': dt.strftime('%b %d, %Y, %I:%M:%S %p UTC').replace(' 0', ' '),
+        })
+    records = []
+    for _ in range(count):
+        record = rng.choice(pool)
+        if rng.random() < formatted_share:
+            records.append({'formatted': record['formatted']})
+        else:
+            records.append(dict(record))
+    return records
+
+
+def timed(label, func, count):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22}: {elapsed:8.3f}s  ({count / elapsed:,.0f} records/s)")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark photoTakenTime date parsing')
+    parser.add_argument('--records', type=int, default=1000000,
+                        help='Number of photoTakenTime records (default: 1000000)')
+    parser.add_argument('--distinct', type=int, default=20000,
+                        help='Number of distinct capture times the records are drawn from (default: 20000)')
+    parser.add_argument('--formatted-share', type=float, default=0.3,
+                        help="Share of records with only a 'formatted' string and no timestamp (default: 0.3)")
+    args = parser.parse_args()
+
+    records = synthetic_records(args.records, args.distinct, args.formatted_share)
+    print(f"{args.records:,} records, {args.distinct:,} distinct dates, {args.formatted_share:.0%} formatted only")
+
+    legacy, legacy_time = timed('legacy', lambda: [legacy_format_date(r) for r in records], args.records)
+    single, single_time = timed('date_utils.format_date', lambda: [format_date(r) for r in records], args.records)
+    batch, batch_time = timed('date_utils.format_dates', lambda: format_dates(records), args.records)
+
+    mismatches = sum(1 for a, b, c in zip(legacy, single, batch) if not a == b == c)
+    print(f"speedup: {legacy_time / single_time:.1f}x single, {legacy_time / batch_time:.1f}x batch, "
+          f"{mismatches} mismatching results")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Time every pipeline stage on a synthetic Takeout export
+
+Generates a corpus with takeout_corpus.py in a temporary directory, then runs the stages
+in order the way the step scripts do: extract.main, scrub_live_files.scrub,
+embed.embed_metadata, the cleanup of embed.py, update_creation_date and
+upload_files.process_files to a local rclone remote (':local:'). For each stage it reports
+the files and bytes it handled, files/s, MB/s and the peak RSS of this process while it ran;
+the --json results also hold the stage's operation timers from metrics.py.
+
+With --stub-exiftool, ExifTool is replaced by benchmarks/stub_exiftool.py, which answers
+without touching the files, so the figures measure the Python side of the pipeline alone.
+The upload stage needs rclone on PATH or --rclone, and is left out otherwise.
+
+Usage:
+    python benchmarks/bench_pipeline.py --files 20000 --fan-out 2000 --jobs 4 --stub-exiftool
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+
+import metrics
+import stub_exiftool
+from takeout_corpus import add_corpus_arguments, corpus_from_args, write_zips
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+RSS_SAMPLE_INTERVAL = 0.01
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where it cannot be read"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakRSS:
+    """Samples the RSS of this process from a background thread and keeps the highest value"""
+
+    def __init__(self):
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            rss = current_rss()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def tree_size(root, extensions=None):
+    """Return (file count, bytes) of the files under root, optionally only those with the given extensions"""
+    count = total = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if extensions is None or name.lower().endswith(extensions):
+                count += 1
+                total += os.path.getsize(os.path.join(directory, name))
+    return count, total
+
+
+def run_cli(entry_point, argv):
+    """Call a stage's command-line entry point with the given arguments"""
+    saved = sys.argv
+    sys.argv = [entry_point.__module__] + [str(arg) for arg in argv]
+    try:
+        return entry_point()
+    finally:
+        sys.argv = saved
+
+
+def timed_stage(results, name, func, files, size):
+    """Run one stage and append its measurements to results"""
+    metrics.reset()
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+    # Writes the summary of a stage run through its command line
+    metrics.finish_metrics()
+    results.append({
+        'stage': name,
+        'files': files,
+        'bytes': size,
+        'seconds': round(elapsed, 3),
+        'files_per_second': round(files / elapsed, 1) if elapsed else 0,
+        'bytes_per_second': round(size / elapsed, 1) if elapsed else 0,
+        'peak_rss': rss.peak,
+        'operations': metrics.snapshot()['timers'],
+    })
+    print(f"{name:<8}: {files:>8,} files {size / (1024 * 1024):>9,.1f} MB in {elapsed:8.3f}s  "
+          f"({files / elapsed if elapsed else 0:>10,.0f} files/s, {size / (1024 * 1024) / elapsed if elapsed else 0:>8,.1f} MB/s)"
+          + (f"  peak RSS {rss.peak / (1024 * 1024):,.0f} MB" if rss.peak else ''))
+
+
+def run(args, work):
+    # The stage modules configure logging and resolve EXIFTOOL_PATH when they are imported
+    import embed
+    import extract
+    import scrub_live_files
+    import update_creation_date
+    import upload_files
+    from date_manifest import DateManifest
+    from state_db import StateDB
+
+    if not args.verbose:
+        import logging
+        for handler in logging.getLogger().handlers:
+            if not isinstance(handler, logging.FileHandler):
+                handler.setLevel(logging.WARNING)
+
+    zips = os.path.join(work, 'zips')
+    extracts = os.path.join(work, 'extracts')
+    livefiles = os.path.join(work, 'livefiles')
+    state_db = os.path.join(work, 'state.sqlite')
+    manifest_path = os.path.join(work, 'dates.bin')
+    photos = os.path.join(extracts, 'Takeout', 'Google Photos')
+    summaries = os.path.join(work, 'metrics')
+
+    start = time.perf_counter()
+    archives, entries, size = write_zips(corpus_from_args(args), zips, args.parts)
+    print(f"Corpus: {entries:,} entries ({size / (1024 * 1024):,.1f} MB) in {len(archives)} archives, "
+          f"generated in {time.perf_counter() - start:.1f}s")
+    print(f"ExifTool: {'stub' if args.stub_exiftool else os.environ.get('EXIFTOOL_PATH', 'exiftool')}, jobs: {args.jobs}")
+
+    results = []
+    timed_stage(results, 'extract', lambda: run_cli(extract.main, ['-s', zips, '-t', extracts, '-j', args.jobs,
+                                                                    '--state-db', state_db, '--metrics',
+                                                                    os.path.join(summaries, 'extract.json')]), entries, size)
+
+    timed_stage(results, 'scrub', lambda: run_cli(scrub_live_files.scrub, ['--source', extracts, '--target', livefiles,
+                                                                          '-j', args.jobs, '--metrics',
+                                                                          os.path.join(summaries, 'scrub.json')]),
+                *tree_size(extracts))
+
+    def embed_stage():
+        manifest = DateManifest(manifest_path)
+        with StateDB(state_db) as state:
+            embed.embed_metadata(extracts, args.jobs, args.batch_size, state, resume=False, engine=args.engine, manifest=manifest)
+        manifest.save()
+    timed_stage(results, 'embed', embed_stage, *tree_size(extracts, embed.MEDIA_EXTENSIONS))
+
+    timed_stage(results, 'cleanup', lambda: embed.cleanup_files(extracts), *tree_size(extracts))
+
+    timed_stage(results, 'dates', lambda: run_cli(update_creation_date.update_creation_date,
+                                                  ['-s', photos, '-j', args.jobs, '--state-db', state_db,
+                                                   '--date-manifest', manifest_path, '--force', '--metrics',
+                                                   os.path.join(summaries, 'dates.json')]), *tree_size(photos))
+
+    rclone = args.rclone or shutil.which('rclone')
+    if rclone:
+        remote = os.path.join(work, 'remote')
+        timed_stage(results, 'upload', lambda: upload_files.process_files(
+            photos, 'onedrive', target_dir=remote, rclone_remote=':local', rclone_path=rclone,
+            run_log=os.path.join(work, 'rclone-runs.jsonl')), *tree_size(photos))
+    else:
+        print("upload  : skipped, rclone not found (use --rclone)")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on a synthetic Takeout export')
+    add_corpus_arguments(parser)
+    parser.add_argument('--jobs', '-j', type=int, default=4,
+                        help='Number of parallel workers passed to every stage (default: 4)')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Files per ExifTool round trip when embedding (default: 32)')
+    parser.add_argument('--engine', choices=('exiftool', 'native'), default='exiftool',
+                        help='Metadata writer used for embedding (default: exiftool)')
+    parser.add_argument('--stub-exiftool', action='store_true',
+                        help='Replace ExifTool with benchmarks/stub_exiftool.py to measure the Python overhead alone')
+    parser.add_argument('--rclone', help='rclone executable for the upload stage (default: rclone on PATH)')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    parser.add_argument('--keep', action='store_true', help='Keep the working directory instead of deleting it')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Show the stages\' own log output')
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='bench-pipeline-')
+    try:
+        if args.stub_exiftool:
+            os.environ['EXIFTOOL_PATH'] = stub_exiftool.make_wrapper(work)
+        results = run(args, work)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'arguments': vars(args), 'stages': results}, f, indent=2)
+    finally:
+        if args.keep:
+            print(f"Working directory kept in {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
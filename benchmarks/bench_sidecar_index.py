@@ -0,0 +1,91 @@
+"""
+Compare SidecarIndex with the linear startswith scan embed.py used to match sidecars
+
+Builds synthetic Takeout album listings (plain, supplemental-metadata, truncated and
+duplicate sidecar names) and times resolving every media file in the directory.
+
+Usage:
+    python benchmarks/bench_sidecar_index.py --sizes 10000 50000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sidecar_index import MAX_TRUNCATED_STEM_LENGTH, SidecarIndex
+
+
+def linear_find(media_file, json_files):
+    """The O(J) scan embed.find_json_file performed for every media file"""
+    for json_file in json_files:
+        if json_file.startswith(media_file) and json_file.endswith('.json'):
+            return json_file
+    return None
+
+
+def synthetic_directory(file_count, seed=0):
+    """Return (media_files, json_files) for a synthetic album with file_count media files"""
+    rng = random.Random(seed)
+    media_files = []
+    json_files = []
+    for i in range(file_count):
+        kind = rng.random()
+        ext = rng.choice(['.jpg', '.heic', '.mp4', '.png'])
+        if kind < 0.05:
+            name = f'Screenshot_2020{i:08d}-123456_Some_Very_Long_Application_Name{ext}'
+            media_files.append(name)
+            json_files.append(name[:MAX_TRUNCATED_STEM_LENGTH] + '.json')
+        elif kind < 0.10:
+            media_files.append(f'IMG_{i:06d}(1){ext}')
+            json_files.append(f'IMG_{i:06d}{ext}.supplemental-metadata(1).json')
+        elif kind < 0.55:
+            name = f'IMG_{i:06d}{ext}'
+            media_files.append(name)
+            json_files.append(f'{name}.supplemental-metadata.json')
+        else:
+            name = f'PXL_{i:08d}{ext}'
+            media_files.append(name)
+            json_files.append(f'{name}.json')
+    rng.shuffle(json_files)
+    return media_files, json_files
+
+
+def bench(file_count, linear_limit):
+    media_files, json_files = synthetic_directory(file_count)
+
+    start = time.perf_counter()
+    index = SidecarIndex(json_files)
+    indexed = [index.find(media_file) for media_file in media_files]
+    index_time = time.perf_counter() - start
+    print(f"{file_count:>7} files  index : {index_time:8.3f}s  ({file_count / index_time:,.0f} files/s)"
+          f"  resolved {sum(1 for j in indexed if j)}/{file_count}")
+
+    # The linear scan is quadratic, so time a sample and extrapolate for large directories
+    sample = media_files[:linear_limit]
+    start = time.perf_counter()
+    linear = [linear_find(media_file, json_files) for media_file in sample]
+    linear_time = (time.perf_counter() - start) * file_count / len(sample)
+    print(f"{file_count:>7} files  linear: {linear_time:8.3f}s  ({file_count / linear_time:,.0f} files/s)"
+          f"  resolved {sum(1 for j in linear if j)}/{len(sample)} sampled"
+          f"{' (extrapolated)' if len(sample) < file_count else ''}")
+    print(f"{file_count:>7} files  speedup: {linear_time / index_time:,.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON sidecar matching')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000],
+                        help='Directory sizes to benchmark (default: 10000 50000)')
+    parser.add_argument('--linear-sample', type=int, default=2000,
+                        help='Number of media files timed with the linear scan (default: 2000)')
+    args = parser.parse_args()
+
+    for file_count in args.sizes:
+        bench(file_count, args.linear_sample)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Compare sidecar.load_sidecars with the json.load + dict lookups embed.py used per file
+
+Writes synthetic Takeout sidecars to a temporary directory and times decoding all of them
+with the standard library, with sidecar.load_sidecar one file at a time, and with
+sidecar.load_sidecars in embed-sized batches.
+
+Usage:
+    python benchmarks/bench_sidecar_loading.py --files 50000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sidecar import BACKEND, SidecarRecord, load_sidecar, load_sidecars
+
+
+def legacy_load(json_path):
+    """json.load followed by the field lookups embed.build_exiftool_args did"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    return SidecarRecord.from_dict(metadata)
+
+
+def synthetic_sidecar(i, rng):
+    """Return a sidecar dict shaped like a Google Takeout export"""
+    timestamp = str(1400000000 + rng.randrange(300000000))
+    geo = {'latitude': rng.uniform(-90, 90), 'longitude': rng.uniform(-180, 180), 'altitude': rng.uniform(0, 500),
+           'latitudeSpan': 0.0, 'longitudeSpan': 0.0}
+    return {
+        'title': f'IMG_{i:06d}.jpg',
+        'description': '' if rng.random() < 0.8 else 'A description',
+        'imageViews': str(rng.randrange(100)),
+        'creationTime': {'timestamp': timestamp, 'formatted': 'Jan 1, 2020, 1:00:00 AM UTC'},
+        'photoTakenTime': {'timestamp': timestamp, 'formatted': 'Jan 1, 2020, 1:00:00 AM UTC'},
+        'geoData': geo,
+        'geoDataExif': geo,
+        'people': [{'name': 'Person A'}] if rng.random() < 0.2 else [],
+        'url': f'https://photos.google.com/photo/{i:020d}',
+        'googlePhotosOrigin': {'mobileUpload': {'deviceFolder': {'localFolderName': ''}, 'deviceType': 'ANDROID_PHONE'}},
+    }
+
+
+def timed(label, func, count):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24}: {elapsed:8.3f}s  ({count / elapsed:,.0f} files/s)")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON sidecar loading')
+    parser.add_argument('--files', type=int, default=50000,
+                        help='Number of sidecar files (default: 50000)')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Sidecars per load_sidecars call, as in an embed batch (default: 32)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp(prefix='bench-sidecars-')
+    try:
+        paths = []
+        for i in range(args.files):
+            path = os.path.join(directory, f'IMG_{i:06d}.jpg.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(synthetic_sidecar(i, rng), f, indent=2)
+            paths.append(path)
+        print(f"{args.files:,} sidecars, backend: {BACKEND}")
+
+        timed('json.load', lambda: [legacy_load(path) for path in paths], args.files)
+        timed('sidecar.load_sidecar', lambda: [load_sidecar(path) for path in paths], args.files)
+        batches = [paths[i:i + args.batch_size] for i in range(0, len(paths), args.batch_size)]
+        timed('sidecar.load_sidecars', lambda: [load_sidecars(batch) for batch in batches], args.files)
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""
+Stand-in for ExifTool that answers the pipeline's commands without touching any file
+
+It speaks the `-stay_open True -@ -` protocol of exiftool_session, including the -echo4
+status markers, and the recursive `-json` scans of exiftool_scan. Write commands only stat
+their target files; date reads answer with a date derived from the file's mtime. With it,
+a benchmark measures the Python side of the pipeline without ExifTool's own cost.
+
+Usage (bench_pipeline.py --stub-exiftool does this):
+    os.environ['EXIFTOOL_PATH'] = stub_exiftool.make_wrapper(temp_dir)
+    # then import the pipeline modules
+"""
+import datetime
+import json
+import os
+import sys
+
+# Options followed by a value, which must not be taken for a file name
+_VALUE_OPTIONS = {'-charset', '-echo4', '-@', '-ext', '--ext', '-stay_open'}
+_READ_TAGS = {'-datetimeoriginal', '-quicktime:createdate', '-createdate', '-contentidentifier'}
+
+
+def _date(path):
+    return datetime.datetime.fromtimestamp(os.stat(path).st_mtime).strftime('%Y:%m:%d %H:%M:%S')
+
+
+def _split(args):
+    """Return (options, files) of one command block"""
+    options, files = [], []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg.lower() in _VALUE_OPTIONS:
+            options.append(arg.lower())
+            skip = True
+        elif arg.startswith('-'):
+            options.append(arg.lower())
+        else:
+            files.append(arg)
+    return options, files
+
+
+def run_block(args):
+    """Answer one -stay_open command block, returning (stdout, stderr, status)"""
+    options, files = _split(args)
+    stdout, stderr = [], []
+    status = 0
+    reads = [option for option in options if option in _READ_TAGS]
+    for path in files:
+        if not os.path.exists(path):
+            stderr.append(f'Error: File not found - {path}')
+            status = 1
+        elif reads:
+            tag = 'CreateDate' if 'createdate' in reads[0] else 'DateTimeOriginal'
+            stdout.append(f'{tag:<32}: {_date(path)}')
+    if not reads:
+        updated = len(files) - status
+        stdout.append(f'    {updated} image files updated')
+    return stdout, stderr, status
+
+
+def stay_open():
+    args = []
+    for line in sys.stdin:
+        line = line.rstrip('\r\n')
+        if line.startswith('-execute'):
+            sequence = line[len('-execute'):]
+            echo = args[args.index('-echo4') + 1] if '-echo4' in args else None
+            stdout, stderr, status = run_block(args)
+            sys.stdout.write(''.join(f'{out}\n' for out in stdout) + f'{{ready{sequence}}}\n')
+            sys.stdout.flush()
+            if echo:
+                stderr.append(echo.replace('${status}', str(status)))
+            if stderr:
+                sys.stderr.write(''.join(f'{err}\n' for err in stderr))
+                sys.stderr.flush()
+            args = []
+        elif line == 'False' and args and args[-1] == '-stay_open':
+            return 0
+        else:
+            args.append(line)
+    return 0
+
+
+def scan(argv):
+    """Answer a `-json -r` scan over the given targets or -@ argument file"""
+    targets = []
+    include, exclude = set(), set()
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == '-@':
+            with open(argv[i + 1], encoding='utf-8') as f:
+                targets += [line.rstrip('\r\n') for line in f if line.strip()]
+            i += 1
+        elif arg in ('-ext', '--ext'):
+            (include if arg == '-ext' else exclude).add('.' + argv[i + 1].lower())
+            i += 1
+        elif arg == '-charset':
+            i += 1
+        elif not arg.startswith('-'):
+            targets.append(arg)
+        i += 1
+
+    def files():
+        for target in targets:
+            if os.path.isfile(target):
+                yield target
+                continue
+            for directory, _, names in os.walk(target):
+                for name in names:
+                    yield os.path.join(directory, name)
+
+    wants_identifier = '-ContentIdentifier' in argv
+    sys.stdout.write('[')
+    first = True
+    for path in files():
+        extension = os.path.splitext(path)[1].lower()
+        if extension in exclude or (include and extension not in include):
+            continue
+        record = {'SourceFile': path.replace(os.sep, '/')}
+        if not wants_identifier:
+            record['CreateDate' if extension == '.mp4' else 'DateTimeOriginal'] = _date(path)
+        sys.stdout.write(('' if first else ',') + '\n' + json.dumps(record))
+        first = False
+    sys.stdout.write(']\n')
+    return 0
+
+
+def make_wrapper(directory):
+    """
+    Write an executable that runs this stub with the current interpreter, and return its path
+
+    EXIFTOOL_PATH must name a single executable, so on Windows this is a .cmd file and
+    elsewhere a shell script.
+    """
+    script = os.path.abspath(__file__)
+    if os.name == 'nt':
+        path = os.path.join(directory, 'exiftool.cmd')
+        with open(path, 'w') as f:
+            f.write(f'@"{sys.executable}" "{script}" %*\n')
+    else:
+        path = os.path.join(directory, 'exiftool')
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+
+def main(argv):
+    if '-stay_open' in argv:
+        return stay_open()
+    if '-json' in argv:
+        return scan(argv)
+    sys.stderr.write(f'stub exiftool: unsupported command {argv}\n')
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,253 @@
+"""
+Generate a synthetic Google Takeout export for the benchmarks
+
+The corpus holds what the pipeline meets in a real export: 'Photos from YYYY' folders and
+albums, JSON sidecars with Takeout's naming quirks (the supplemental-metadata suffix, names
+cut at 51 characters, '(1)' duplicates), live photo movies next to their stills, and the
+album metadata and HTML files cleanup removes. It is written as Takeout ZIP parts, with
+pairs split across part boundaries, or as an already extracted tree.
+
+JPEG, PNG and MP4/MOV files are minimal but well-formed, so ExifTool and the native writer
+can update them. HEIC files only carry an 'ftyp' box, which ExifTool refuses to write, so
+leave them out of --mix unless the stub ExifTool is used.
+
+Usage:
+    python benchmarks/takeout_corpus.py --files 10000 --fan-out 1000 --parts 4 --output /tmp/takeout
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import struct
+import sys
+import zipfile
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sidecar_index import MAX_TRUNCATED_STEM_LENGTH
+
+DEFAULT_MIX = 'jpg=75,png=5,mp4=15,mov=5'
+PHOTOS_ROOT = 'Takeout/Google Photos'
+# Year folders are used first, then albums
+FIRST_YEAR = 1990
+LAST_YEAR = 2024
+
+
+def parse_mix(text):
+    """Parse 'jpg=75,mp4=25' into a list of (extension, weight) pairs"""
+    mix = []
+    for item in text.split(','):
+        extension, _, weight = item.partition('=')
+        mix.append(('.' + extension.strip().lstrip('.').lower(), float(weight or 1)))
+    return mix
+
+
+def _noise(rng, size):
+    # Incompressible like real media data, and free of 0xFF so it cannot fake a JPEG marker
+    return rng.randbytes(size).replace(b'\xff', b'\x00')
+
+
+def _jpeg(rng, size):
+    header = b'\xff\xd8'
+    header += b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    header += b'\xff\xdb' + struct.pack('>H', 67) + b'\x00' + bytes([1] * 64)
+    header += b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, 1, 1, 1) + b'\x01\x11\x00'
+    header += b'\xff\xda' + struct.pack('>HB', 8, 1) + b'\x01\x00\x00\x3f\x00'
+    return header + _noise(rng, max(0, size - len(header) - 2)) + b'\xff\xd9'
+
+
+def _png_chunk(type_, data):
+    return struct.pack('>I', len(data)) + type_ + data + struct.pack('>I', zlib.crc32(type_ + data))
+
+
+def _png(rng, size):
+    width = 256
+    height = max(1, size // (width + 1))
+    rows = b''.join(b'\x00' + rng.randbytes(width) for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + _png_chunk(b'IDAT', zlib.compress(rows, 0)) + _png_chunk(b'IEND', b''))
+
+
+def _atom(type_, payload):
+    return struct.pack('>I', 8 + len(payload)) + type_ + payload
+
+
+def _movie(rng, size, brand=b'isom'):
+    matrix = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mvhd = struct.pack('>IIIII', 0, 0, 0, 1000, 1000) + struct.pack('>IH', 0x10000, 0x100) + bytes(10) + matrix + bytes(24)
+    mvhd += struct.pack('>I', 1)
+    header = _atom(b'ftyp', brand + struct.pack('>I', 0) + brand) + _atom(b'moov', _atom(b'mvhd', mvhd))
+    return header + _atom(b'mdat', _noise(rng, max(0, size - len(header) - 8)))
+
+
+def media_payload(extension, size, rng):
+    """Return the bytes of a synthetic media file of about `size` bytes"""
+    if extension in ('.jpg', '.jpeg'):
+        return _jpeg(rng, size)
+    if extension == '.png':
+        return _png(rng, size)
+    if extension == '.mp4':
+        return _movie(rng, size)
+    if extension == '.mov':
+        return _movie(rng, size, b'qt  ')
+    if extension == '.heic':
+        return _atom(b'ftyp', b'heic' + struct.pack('>I', 0) + b'mif1heic') + _noise(rng, size)
+    return _noise(rng, size)
+
+
+def sidecar(title, timestamp, rng):
+    """Return the JSON text of a Takeout sidecar"""
+    geo = {'latitude': 0.0, 'longitude': 0.0, 'altitude': 0.0, 'latitudeSpan': 0.0, 'longitudeSpan': 0.0}
+    if rng.random() < 0.5:
+        geo.update(latitude=round(rng.uniform(-90, 90), 6), longitude=round(rng.uniform(-180, 180), 6),
+                   altitude=round(rng.uniform(0, 500), 1))
+    formatted = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%b %d, %Y, %I:%M:%S %p UTC')
+    data = {
+        'title': title,
+        'description': '' if rng.random() < 0.8 else 'Synthetic description',
+        'imageViews': str(rng.randrange(100)),
+        'creationTime': {'timestamp': str(timestamp + 3600), 'formatted': formatted},
+        'photoTakenTime': {'timestamp': str(timestamp), 'formatted': formatted},
+        'geoData': geo,
+        'geoDataExif': geo,
+        'people': [{'name': 'Person A'}] if rng.random() < 0.2 else [],
+        'url': f'https://photos.google.com/photo/{rng.getrandbits(64):020d}',
+        'googlePhotosOrigin': {'mobileUpload': {'deviceType': 'IOS_PHONE'}},
+    }
+    return json.dumps(data, indent=2)
+
+
+def directory_name(index):
+    year = FIRST_YEAR + index
+    return f'Photos from {year}' if year <= LAST_YEAR else f'Album {index - (LAST_YEAR - FIRST_YEAR):03d}'
+
+
+def corpus_entries(files=1000, fan_out=500, mix=DEFAULT_MIX, quirk_ratio=0.3, live_ratio=0.1, media_size=64 * 1024, seed=0):
+    """
+    Yield (archive path, bytes) entries of a synthetic Takeout export, directory by directory
+
+    files media files are spread over directories of fan_out files each. A quirk_ratio share of
+    them gets a quirky sidecar name, and a live_ratio share of the JPEG/HEIC stills gets a
+    live photo movie without a sidecar of its own. Entries come shuffled within each
+    directory, like the member order of a Takeout archive.
+    """
+    rng = random.Random(seed)
+    extensions, weights = zip(*parse_mix(mix))
+    directories = max(1, -(-files // max(1, fan_out)))
+    number = 0
+    for index in range(directories):
+        directory = f'{PHOTOS_ROOT}/{directory_name(index)}'
+        entries = []
+        count = min(fan_out, files - number)
+        for _ in range(count):
+            number += 1
+            extension = rng.choices(extensions, weights)[0]
+            year = FIRST_YEAR + index if FIRST_YEAR + index <= LAST_YEAR else rng.randrange(2005, LAST_YEAR + 1)
+            timestamp = int(datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc).timestamp()) + rng.randrange(365 * 86400)
+            quirk = rng.choice(('supplemental', 'truncated', 'duplicate')) if rng.random() < quirk_ratio else None
+
+            if quirk == 'truncated':
+                name = f'Screenshot_{number:08d}-123456_Some_Very_Long_Application_Name{extension}'
+                json_name = f'{name}.supplemental-metadata'[:MAX_TRUNCATED_STEM_LENGTH] + '.json'
+            elif quirk == 'duplicate':
+                name = f'IMG_{number:06d}(1){extension}'
+                json_name = f'IMG_{number:06d}{extension}(1).json'
+            elif quirk == 'supplemental':
+                name = f'IMG_{number:06d}{extension}'
+                json_name = f'{name}.supplemental-metadata.json'
+            else:
+                name = f'IMG_{number:06d}{extension}'
+                json_name = f'{name}.json'
+            entries.append((f'{directory}/{name}', media_payload(extension, media_size, rng)))
+            entries.append((f'{directory}/{json_name}', sidecar(name, timestamp, rng).encode('utf-8')))
+
+            if extension in ('.jpg', '.heic') and quirk != 'duplicate' and rng.random() < live_ratio:
+                movie = os.path.splitext(name)[0] + '.MP4'
+                entries.append((f'{directory}/{movie}', media_payload('.mp4', media_size, rng)))
+
+        if not directory_name(index).startswith('Photos from'):
+            entries.append((f'{directory}/metadata.json', json.dumps({'title': directory_name(index)}).encode('utf-8')))
+        rng.shuffle(entries)
+        yield from entries
+    yield 'Takeout/archive_browser.html', b'<html><body>Synthetic Takeout</body></html>'
+
+
+def write_zips(entries, output, parts=1, entries_per_part=None):
+    """
+    Write entries to Takeout-style ZIP parts in output, splitting them evenly by count
+
+    Returns (list of archive paths, entry count, uncompressed bytes).
+    """
+    entries = list(entries)
+    os.makedirs(output, exist_ok=True)
+    per_part = entries_per_part or -(-len(entries) // max(1, parts))
+    archives = []
+    total = 0
+    for part, start in enumerate(range(0, len(entries), per_part), start=1):
+        path = os.path.join(output, f'takeout-20240101T000000Z-{part:03d}.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name, data in entries[start:start + per_part]:
+                compression = zipfile.ZIP_DEFLATED if name.endswith(('.json', '.html')) else zipfile.ZIP_STORED
+                archive.writestr(name, data, compress_type=compression)
+                total += len(data)
+        archives.append(path)
+    return archives, len(entries), total
+
+
+def write_tree(entries, output):
+    """Write entries as an extracted tree under output. Returns (entry count, bytes)."""
+    count = total = 0
+    for name, data in entries:
+        path = os.path.join(output, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        count += 1
+        total += len(data)
+    return count, total
+
+
+def add_corpus_arguments(parser):
+    """Add the corpus shape options, shared with bench_pipeline.py"""
+    parser.add_argument('--files', type=int, default=1000,
+                        help='Number of media files, not counting live photo movies (default: 1000)')
+    parser.add_argument('--fan-out', type=int, default=500,
+                        help='Media files per directory (default: 500)')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f'Media extensions and their weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--quirks', type=float, default=0.3,
+                        help='Share of sidecars with a supplemental-metadata, truncated or duplicate name (default: 0.3)')
+    parser.add_argument('--live-ratio', type=float, default=0.1,
+                        help='Share of JPEG/HEIC stills that come with a live photo movie (default: 0.1)')
+    parser.add_argument('--media-size', type=int, default=64,
+                        help='Size of each media file in KiB (default: 64)')
+    parser.add_argument('--parts', type=int, default=2,
+                        help='Number of ZIP parts the export is split into (default: 2)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed, for a reproducible corpus (default: 0)')
+
+
+def corpus_from_args(args):
+    return corpus_entries(args.files, args.fan_out, args.mix, args.quirks, args.live_ratio, args.media_size * 1024, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Google Takeout export')
+    parser.add_argument('--output', '-o', required=True, help='Folder to write the ZIP parts or the tree to')
+    parser.add_argument('--tree', action='store_true', help='Write an extracted tree instead of ZIP parts')
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    if args.tree:
+        count, total = write_tree(corpus_from_args(args), args.output)
+        print(f"Wrote {count:,} files ({total / (1024 * 1024):,.1f} MB) to {args.output}")
+    else:
+        archives, count, total = write_zips(corpus_from_args(args), args.output, args.parts)
+        print(f"Wrote {count:,} entries ({total / (1024 * 1024):,.1f} MB) to {len(archives)} archives in {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import datetime
+import logging
+import os
+import struct
+from exiftool_scan import path_key
+from state_db import DEFAULT_STATE_DB
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATE_MANIFEST = os.path.join(os.path.dirname(DEFAULT_STATE_DB), 'date-manifest.bin')
+
+# Version 1 stored epochs through the local time zone; those files are ignored and rebuilt
+_MAGIC = b'EXIFDATE\x02'
+# Per record: seconds from _EPOCH (signed 64-bit), UTF-8 path length, then the path itself
+_RECORD = struct.Struct('<qH')
+# Dates are naive local times, so they are counted from a naive epoch: no time zone, no DST
+# shifts, and dates before 1970 work on Windows too
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class DateManifest:
+    """
+    Compact binary map of media file path -> date taken, in seconds since 1970-01-01
+
+    embed.py records the date it parsed from each sidecar, so update_creation_date.py can
+    apply it without reading the date back out of the media file. Entries from earlier runs
+    are loaded and kept, so the manifest accumulates across runs.
+
+    Usage:
+        manifest = DateManifest()
+        manifest.add(path, '2020:09:13 12:26:40')
+        manifest.save()
+    """
+
+    def __init__(self, path=DEFAULT_DATE_MANIFEST):
+        self.path = path
+        self._dates = {}
+        if os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self._dates)
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(_MAGIC):
+            logger.warning(f"Ignoring unrecognized date manifest {self.path}")
+            return
+        offset = len(_MAGIC)
+        while offset + _RECORD.size <= len(data):
+            epoch, length = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            self._dates[data[offset:offset + length].decode('utf-8')] = epoch
+            offset += length
+        logger.debug(f"Loaded {len(self._dates)} dates from {self.path}")
+
+    def add(self, path, date_string):
+        """Record the 'YYYY:MM:DD HH:MM:SS' local date taken of a file"""
+        date = datetime.datetime.strptime(date_string, '%Y:%m:%d %H:%M:%S')
+        self._dates[path_key(path)] = int((date - _EPOCH).total_seconds())
+
+    def get(self, path):
+        """Return the recorded date of a file as a 'YYYY:MM:DD HH:MM:SS' local date string, or None"""
+        epoch = self._dates.get(path_key(path))
+        if epoch is None:
+            return None
+        return (_EPOCH + datetime.timedelta(seconds=epoch)).strftime('%Y:%m:%d %H:%M:%S')
+
+    def save(self):
+        """Write the manifest atomically, replacing the previous version"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        records = [_MAGIC]
+        for key in sorted(self._dates):
+            encoded = key.encode('utf-8')
+            records.append(_RECORD.pack(self._dates[key], len(encoded)))
+            records.append(encoded)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(b''.join(records))
+        os.replace(temp_path, self.path)
+        logger.debug(f"Saved {len(self._dates)} dates to {self.path}")
@@ -0,0 +1,104 @@
+import datetime
+import functools
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+EXIFTOOL_DATE_FORMAT = '%Y:%m:%d %H:%M:%S'
+FORMATTED_CACHE_SIZE = 65536
+
+# Google Photos format: "Sep 24, 2022, 10:45:55 PM UTC"
+_UTC_PATTERN = re.compile(r'([A-Za-z]{3}) (\d{1,2}), (\d{4}), (\d{1,2}):(\d{2}):(\d{2}) ([AP])M UTC')
+_MONTHS = {name: number for number, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), start=1)}
+_WHITESPACE = re.compile(r'\s+')
+
+# Non-breaking spaces become plain spaces, other control characters are dropped. Anything
+# else outside ASCII is removed by the encode step in clean_date_string.
+_CLEAN_TABLE = {codepoint: None for codepoint in range(32) if chr(codepoint) not in '\t\n\r\x0b\x0c'}
+_CLEAN_TABLE.update({0x7f: None, 0xa0: ' ', 0x2007: ' ', 0x202f: ' '})
+
+
+def clean_date_string(date_str):
+    """Remove special/invisible characters from a date string and collapse whitespace"""
+    cleaned = date_str.translate(_CLEAN_TABLE)
+    if not cleaned.isascii():
+        cleaned = cleaned.encode('ascii', 'ignore').decode('ascii')
+    return _WHITESPACE.sub(' ', cleaned)
+
+
+@functools.lru_cache(maxsize=FORMATTED_CACHE_SIZE)
+def format_formatted_date(formatted):
+    """
+    Convert a Google Photos 'formatted' date string to 'YYYY:MM:DD HH:MM:SS', or None
+
+    Cached, as the same strings repeat across every file of an album or burst.
+    """
+    match = _UTC_PATTERN.search(clean_date_string(formatted))
+    if not match:
+        return None
+    # Same checks as strptime('%b %d, %Y, %I:%M:%S %p'), without its per-call overhead
+    month_name, day, year, hour, minute, second, meridiem = match.groups()
+    month = _MONTHS.get(month_name.lower())
+    hour = int(hour)
+    if month is None or not 1 <= hour <= 12:
+        logger.debug(f"Failed to parse Google Photos date format: {formatted}")
+        return None
+    hour = hour % 12 + (12 if meridiem == 'P' else 0)
+    try:
+        return datetime.datetime(int(year), month, int(day), hour, int(minute), int(second)).strftime(EXIFTOOL_DATE_FORMAT)
+    except ValueError as e:
+        logger.debug(f"Failed to parse Google Photos date format: {formatted} - {e}")
+        return None
+
+
+def format_timestamp(timestamp):
+    """Convert a Unix timestamp string to a local 'YYYY:MM:DD HH:MM:SS' date, or None"""
+    try:
+        return time.strftime(EXIFTOOL_DATE_FORMAT, time.localtime(int(timestamp)))
+    except (ValueError, OverflowError, OSError) as e:
+        logger.warning(f"Failed to convert timestamp {timestamp}: {e}")
+        return None
+
+
+def format_date(photo_taken_data):
+    """
+    Convert a photoTakenTime dict to the 'YYYY:MM:DD HH:MM:SS' format ExifTool expects
+
+    The Unix timestamp is used when present, otherwise the 'formatted' string.
+    Returns None if neither gives a date.
+    """
+    if not photo_taken_data:
+        return None
+    timestamp = photo_taken_data.get('timestamp')
+    if timestamp and timestamp.isdigit():
+        return format_timestamp(timestamp)
+    formatted = photo_taken_data.get('formatted')
+    if formatted:
+        return format_formatted_date(formatted)
+    return None
+
+
+def format_dates(photo_taken_list):
+    """Convert a list of photoTakenTime dicts to a list of ExifTool date strings (or None)"""
+    localtime = time.localtime
+    strftime = time.strftime
+    formatted_date = format_formatted_date
+    dates = []
+    append = dates.append
+    for photo_taken_data in photo_taken_list:
+        if not photo_taken_data:
+            append(None)
+            continue
+        timestamp = photo_taken_data.get('timestamp')
+        if timestamp and timestamp.isdigit():
+            try:
+                append(strftime(EXIFTOOL_DATE_FORMAT, localtime(int(timestamp))))
+            except (ValueError, OverflowError, OSError):
+                append(format_timestamp(timestamp))
+            continue
+        formatted = photo_taken_data.get('formatted')
+        append(formatted_date(formatted) if formatted else None)
+    return dates
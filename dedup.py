@@ -0,0 +1,221 @@
+import argparse
+import csv
+import hashlib
+import os
+import re
+import sys
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from exiftool_scan import path_key
+from inventory import DEFAULT_INVENTORY, load_inventory
+from logger_utils import Colors, setup_logging
+from metrics import add_metrics_arguments, setup_metrics
+from state_db import DEFAULT_STATE_DB, StateDB
+
+logger = setup_logging(script_name='exif-embed-dedup')
+
+DEFAULT_DUPLICATE_REPORT = os.path.join(os.path.dirname(DEFAULT_STATE_DB), 'duplicates.csv')
+# Bytes hashed from the start and from the end of a file by the partial hash
+PARTIAL_HASH_SIZE = 64 * 1024
+HASH_BUFFER_SIZE = 1024 * 1024
+# Takeout's per-year folders hold every photo; album folders hold copies of some of them
+_YEAR_FOLDER = re.compile(r'^Photos from \d{4}$')
+
+
+def partial_hash(path, size):
+    """Hash the size and the first and last PARTIAL_HASH_SIZE bytes of a file"""
+    digest = hashlib.blake2b(str(size).encode('ascii'), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_HASH_SIZE))
+        if size > PARTIAL_HASH_SIZE:
+            f.seek(max(PARTIAL_HASH_SIZE, size - PARTIAL_HASH_SIZE))
+            digest.update(f.read(PARTIAL_HASH_SIZE))
+    return digest.hexdigest()
+
+
+def full_hash(path, size=None):
+    """Hash the whole contents of a file"""
+    digest = hashlib.blake2b(digest_size=20)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+
+def keep_order(entry):
+    """Sort key putting the copy to keep first: one in a 'Photos from YYYY' folder, then the shortest path"""
+    in_year_folder = bool(_YEAR_FOLDER.match(os.path.basename(os.path.dirname(entry.path))))
+    return not in_year_folder, len(entry.path), entry.path
+
+
+def _hash_groups(groups, stage, hash_function, jobs, state=None):
+    """
+    Split groups of candidate FileEntry lists by the digest hash_function gives each file
+
+    Digests recorded in the state database for an unchanged file are reused. Returns the
+    new groups that still hold more than one file, keyed by digest.
+    """
+    digests = {}
+    missing = []
+    for entry in (entry for group in groups for entry in group):
+        recorded = state.get(stage, entry.path) if state else None
+        if recorded and recorded[:2] == (entry.st_size, entry.st_mtime_ns):
+            digests[entry.path] = recorded[2]
+        else:
+            missing.append(entry)
+
+    def compute(entry):
+        try:
+            return hash_function(entry.path, entry.st_size)
+        except OSError as e:
+            logger.warning(f"Unable to hash {entry.path}: {e}")
+            return None
+
+    with metrics.timer(stage, len(missing)):
+        with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix='dedup') as executor:
+            for entry, digest in zip(missing, executor.map(compute, missing)):
+                if digest is None:
+                    continue
+                digests[entry.path] = digest
+                if state:
+                    state.record(stage, entry.path, (entry.st_size, entry.st_mtime_ns, digest))
+    if state:
+        state.commit()
+    logger.debug(f"{stage}: {len(digests) - len(missing)} digests reused, {len(missing)} computed")
+
+    split = {}
+    for group in groups:
+        for entry in group:
+            digest = digests.get(entry.path)
+            if digest is not None:
+                split.setdefault((entry.st_size, digest), []).append(entry)
+    return {key[1]: group for key, group in split.items() if len(group) > 1}
+
+
+def find_duplicates(entries, jobs=8, state=None):
+    """
+    Find files with identical contents among FileEntry items
+
+    Candidates are narrowed down by size first, then by a hash of the first and last 64 KiB,
+    and only the files still matching are hashed in full. With a StateDB, digests are kept
+    across runs for files whose size and mtime did not change.
+    Returns a list of (digest, [FileEntry, ...]) groups, each sorted with the copy to keep first.
+    """
+    by_size = {}
+    for entry in entries:
+        # Empty files are all "identical", but removing them saves nothing
+        if entry.st_size:
+            by_size.setdefault(entry.st_size, []).append(entry)
+    groups = [group for group in by_size.values() if len(group) > 1]
+    logger.info(f"{sum(len(group) for group in groups)} files share their size with another file")
+
+    # Small files are read whole by the partial hash anyway, so they skip straight to the full hash
+    small = [group for group in groups if group[0].st_size <= 2 * PARTIAL_HASH_SIZE]
+    large = [group for group in groups if group[0].st_size > 2 * PARTIAL_HASH_SIZE]
+    candidates = list(_hash_groups(large, 'dedup_partial', partial_hash, jobs, state).values()) + small
+    logger.info(f"{sum(len(group) for group in candidates)} candidate duplicates left to hash in full")
+
+    duplicates = _hash_groups(candidates, 'dedup_full', full_hash, jobs, state)
+    return [(digest, sorted(group, key=keep_order)) for digest, group in duplicates.items()]
+
+
+def hardlink(kept_path, duplicate_path):
+    """
+    Replace a duplicate with a hard link to the kept copy
+
+    Returns False without touching anything if the duplicate already is a link to it.
+    """
+    if os.path.samefile(kept_path, duplicate_path):
+        return False
+    temp_path = duplicate_path + '.dedup-link'
+    os.link(kept_path, temp_path)
+    try:
+        os.replace(temp_path, duplicate_path)
+    finally:
+        # Renaming onto another name of the same file does nothing, leaving the temporary link
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+    return True
+
+
+def write_report(duplicates, path=DEFAULT_DUPLICATE_REPORT):
+    """Write a CSV listing every duplicate next to the copy that is kept"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['digest', 'size', 'kept', 'duplicate'])
+        for digest, group in duplicates:
+            for entry in group[1:]:
+                writer.writerow([digest, entry.st_size, group[0].path, entry.path])
+
+
+def read_report(path=DEFAULT_DUPLICATE_REPORT):
+    """Return the set of duplicate paths (as path_key) listed in a report written by write_report"""
+    with open(path, newline='', encoding='utf-8') as f:
+        return {path_key(row['duplicate']) for row in csv.DictReader(f)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate media files, e.g. the album copies of a Takeout export")
+    parser.add_argument("--source", "-s", default="./extracts/Takeout/Google Photos",
+                        help="Source directory containing files (default: ./extracts/Takeout/Google Photos)")
+    parser.add_argument("--action", "-a", choices=["report", "hardlink"], default="report",
+                        help="Only list the duplicates, or also replace them with hard links to the kept copy (default: report)")
+    parser.add_argument("--report", default=DEFAULT_DUPLICATE_REPORT,
+                        help=f"CSV report of the duplicates, read by upload_files.py --skip-duplicates (default: {DEFAULT_DUPLICATE_REPORT})")
+    parser.add_argument("--jobs", "-j", type=int, default=8,
+                        help="Number of parallel hashing threads (default: 8)")
+    parser.add_argument("--state-db", default=DEFAULT_STATE_DB,
+                        help=f"SQLite database keeping file digests between runs (default: {DEFAULT_STATE_DB})")
+    parser.add_argument("--inventory", nargs="?", const=DEFAULT_INVENTORY,
+                        help=f"Reuse the file inventory saved by an earlier stage and save it back, instead of scanning the whole tree (path defaults to {DEFAULT_INVENTORY})")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    setup_metrics(args, 'dedup')
+    source_dir = args.source
+
+    logger.info(f"{Colors.BOLD}{Colors.BRIGHT_CYAN}Find duplicates in {source_dir}{Colors.RESET}")
+    if not os.path.isdir(source_dir):
+        logger.error(f"{Colors.BRIGHT_RED}Source directory '{source_dir}' does not exist{Colors.RESET}")
+        return 1
+
+    inventory = load_inventory(source_dir, args.inventory)
+    with StateDB(args.state_db) as state:
+        duplicates = find_duplicates(inventory.files(source_dir), args.jobs, state)
+
+    duplicate_count = sum(len(group) - 1 for _, group in duplicates)
+    duplicate_bytes = sum(group[0].st_size * (len(group) - 1) for _, group in duplicates)
+    write_report(duplicates, args.report)
+    logger.info(f"Found {duplicate_count} duplicates of {len(duplicates)} files "
+                f"({duplicate_bytes / (1024 * 1024):.1f} MB), listed in {Colors.CYAN}{args.report}{Colors.RESET}")
+
+    failures = 0
+    if args.action == 'hardlink':
+        linked = 0
+        for _, group in duplicates:
+            for entry in group[1:]:
+                try:
+                    if hardlink(group[0].path, entry.path):
+                        linked += 1
+                        inventory.refresh(entry.path)
+                        logger.debug(f"Hard linked {entry.path} to {group[0].path}")
+                except OSError as e:
+                    logger.error(f"{Colors.RED}Failed to hard link {entry.path}: {e}{Colors.RESET}")
+                    failures += 1
+        logger.info(f"Replaced {linked} duplicates with hard links "
+                    f"({duplicate_count - linked - failures} already linked)")
+
+    if args.inventory:
+        inventory.save(args.inventory)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    if os.name == 'nt':
+        os.system('color')
+    sys.exit(main())
@@ -1,242 +1,414 @@
 import argparse
+import asyncio
+import collections
 import sys
-import os, json, subprocess, re, datetime
+import os, datetime
+import metrics
+from date_manifest import DEFAULT_DATE_MANIFEST, DateManifest
+from date_utils import format_date as format_date_for_exiftool
+from exiftool_batch import batched, group_commands, split_result
+from exiftool_pool import AsyncExifToolPool, ExifToolPool, JobSummary
+from exiftool_session import ExifToolResult
+from file_times import apply_creation_times, creation_time, log_failures
+from inventory import DEFAULT_INVENTORY, load_inventory
+from io_scheduler import add_scheduler_arguments, scheduler_from_args
 from logger_utils import Colors, setup_logging
-import win32file
-import win32con
-import pywintypes
+from metrics import add_metrics_arguments, setup_metrics
+from native_writer import NATIVE_EXTENSIONS, NativeWriteUnsupported, tags_from_args, write_metadata
+from sidecar import load_sidecars
+from sidecar_index import SidecarIndex
+from state_db import DEFAULT_STATE_DB, StateDB, file_fingerprint, sidecar_hash
 
 logger = setup_logging(script_name='exif-embed-embed')
 
-def find_json_file(media_file, json_files):
-    for json_file in json_files:
-        if json_file.startswith(media_file) and json_file.endswith('.json'):
-            logger.debug(f"Found matching JSON file '{json_file}' for media file '{media_file}'")
-            return json_file
-    
-    logger.debug(f"No matching JSON file found for '{media_file}'")
-    return None
+# Media files that get metadata embedded from their JSON sidecar
+MEDIA_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.mp4', '.mov', '.heic')
+# Files cleanup_files keeps: the media files above plus videos and animations without sidecar support
+KEPT_EXTENSIONS = MEDIA_EXTENSIONS + ('.mts', '.wmv', '.avi', '.gif')
 
-def clean_date_string(date_str):
+def file_creation_date(media_path, image_date, stat=None):
     """
-    function to identify/remove any special/invisible characters in date strings
-    """
-    import string
-    printable_chars = set(string.printable)
-    cleaned = ''.join(c for c in date_str if c in printable_chars) # Cleaned version with only printable ASCII
-    cleaned_nbsp = cleaned.replace('\xa0', ' ') # Attempt to clean non-breaking space (common in date formats)
-    normalized = re.sub(r'\s+', ' ', cleaned_nbsp)
-    return normalized
-
-def format_date_for_exiftool(photo_taken_data):
-    """
-    Convert Google Photos date format to the format expected by ExifTool
-    ExifTool expects dates in format: YYYY:MM:DD HH:MM:SS
+    Return the datetime the file's creation date should be set to, or None if it already matches the date taken
 
-    param photo_taken_data: Dictionary containing photo taken time information
+    stat is the file's current stat result, if the caller already has it
     """
-    if not photo_taken_data:
-        return None
+    #remove any timezone or extra characters from the date string
+    image_date = image_date.split('-')[0].split('+')[0].strip()
 
-    timestamp = photo_taken_data.get('timestamp')
-    date_str = clean_date_string(photo_taken_data.get('formatted', ''))
-    logger.debug(f"timestamp:date_str [{timestamp} : {date_str}]")
+    file_date = creation_time(stat if stat is not None else os.stat(media_path))
+    file_date = datetime.datetime.fromtimestamp(file_date).strftime('%Y:%m:%d %H:%M:%S')
+    if image_date.split()[0].strip() == file_date.split()[0].strip():
+        return None
 
-    if timestamp and timestamp.isdigit():
-        # Convert Unix timestamp to datetime
+    for date_format in ('%Y:%m:%d %H:%M:%S', '%Y:%m:%d %H:%M:%S.%f'):
         try:
-            timestamp_value = int(timestamp)
-            dt = datetime.datetime.fromtimestamp(timestamp_value)
-            date_taken = dt.strftime('%Y:%m:%d %H:%M:%S')
-            logger.debug(f"Using timestamp value: {timestamp} -> {date_taken}")
-            return date_taken
-        except (ValueError, OverflowError) as e:
-            logger.warning(f"Failed to convert timestamp {timestamp}: {e}")
-    elif date_str:
-        cleaned_date_str = clean_date_string(date_str)
-        logger.debug(f"Using formatted and cleaned date string: {cleaned_date_str}")
-
-        # Specifically handle Google Photos format: "Sep 24, 2022, 10:45:55 PM UTC"
-        utc_pattern = re.compile(r'([A-Za-z]{3} \d{1,2}, \d{4}, \d{1,2}:\d{2}:\d{2} [AP]M) UTC')
-        utc_match = utc_pattern.search(cleaned_date_str)
-        
-        if utc_match:
-            date_part = utc_match.group(1)  # "Sep 24, 2022, 10:45:55 PM"
-            try:
-                dt = datetime.datetime.strptime(date_part, '%b %d, %Y, %I:%M:%S %p')
-                return dt.strftime('%Y:%m:%d %H:%M:%S')
-            except ValueError as e:
-                logger.debug(f"Failed to parse Google Photos date format: {cleaned_date_str} - {e}")
-        
-    return None #datetime.datetime.now().strftime('%Y:%m:%d %H:%M:%S')
+            return datetime.datetime.strptime(image_date, date_format)
+        except ValueError:
+            pass
+    logger.warning(f"Invalid date format for {os.path.basename(media_path)}: {image_date}, using default date")
+    return datetime.datetime(year=1973, month=12, day=21, hour=0, minute=0, second=0)
 
-def extract_people_tags(metadata):
+def build_exiftool_args(media_path, sidecar):
     """
-    Extract people names from metadata to use as tags
+    Build the ExifTool arguments that embed the sidecar metadata into a media file
+
+    param media_path: Path of the media file to update
+    param sidecar: SidecarRecord loaded from the matching JSON sidecar
+    Returns a tuple of (args, image_date) where args excludes the 'exiftool' executable name
     """
-    people_tags = []
-    if 'people' in metadata and isinstance(metadata['people'], list):
-        for person in metadata['people']:
-            if 'name' in person and person['name']:
-                people_tags.append(person['name'])
-    return people_tags
-
-def set_file_date(subdir, media_file, image_date):
-    try:
-        #remove any timezone or extra characters from the date string
-        image_date = image_date.split('-')[0].split('+')[0].strip()
-
-        file_date = os.path.getctime(os.path.join(subdir, media_file))
-        file_date = datetime.datetime.fromtimestamp(file_date).strftime('%Y:%m:%d %H:%M:%S')
-        if image_date.split()[0].strip() != file_date.split()[0].strip():
-            try :
-                try:
-                    image_date = datetime.datetime.strptime(image_date, '%Y:%m:%d %H:%M:%S.%f')
-                except ValueError:
-                    image_date = datetime.datetime(year=1973, month=12, day=21, hour=0, minute=0, second=0)
-            except ValueError:
-                logger.error(f"Invalid date format for {media_file}: {image_date}")
-                return
-            
-            win_time = pywintypes.Time(image_date)
-            handle = win32file.CreateFile
-            (
-                os.path.join(subdir, media_file),
-                win32con.GENERIC_WRITE,
-                win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
-                None,
-                win32con.OPEN_EXISTING,
-                win32con.FILE_ATTRIBUTE_NORMAL,
-                None
-            )
-            win32file.SetFileTime(handle, win_time, None, None)
-            handle.close()
-    except Exception as e:
-        logger.error(f"Failed to set file date for {media_file}: {e}")
+    media_file = os.path.basename(media_path)
+    title = sidecar.title
+    description = sidecar.description
+    image_date = format_date_for_exiftool(sidecar.photo_taken_time)
+    latitude = sidecar.latitude
+    longitude = sidecar.longitude
+    altitude = sidecar.altitude
+    make = sidecar.make
+    model = sidecar.model
+    software = sidecar.software
+    keywords = list(sidecar.keywords)
+    copyright = sidecar.copyright
+    artist = sidecar.artist
+
+    people_tags = sidecar.people
+    if people_tags:
+        if keywords:
+            keywords.extend(people_tags)
+        else:
+            keywords = people_tags
+        logger.debug(f"Added people tags: {', '.join(people_tags)}")
+
+    # Build the command
+    exiftool_args = [
+        '-overwrite_original',  # Don't create backup files
+        '-preserve',           # Preserve file modification date/time
+        f'-Title={title}' if title else None,
+        f'-ImageDescription={description}' if description and media_file.lower().endswith(MEDIA_EXTENSIONS) else None,
+    ]
+
+    # Handle date fields
+    if image_date:
+        exiftool_args.extend([
+            f'-DateTimeOriginal={image_date}',
+            f'-CreateDate={image_date}',
+            f'-ModifyDate={image_date}'
+        ])
+
+    # Handle GPS data
+    if latitude and longitude:
+        exiftool_args.extend([
+            f'-GPSLatitude={latitude}',
+            f'-GPSLongitude={longitude}',
+        ])
+        # Add GPSLatitudeRef and GPSLongitudeRef
+        if float(latitude) >= 0:
+            exiftool_args.append('-GPSLatitudeRef=N')
+        else:
+            exiftool_args.append('-GPSLatitudeRef=S')
+
+        if float(longitude) >= 0:
+            exiftool_args.append('-GPSLongitudeRef=E')
+        else:
+            exiftool_args.append('-GPSLongitudeRef=W')
+
+        if altitude:
+            exiftool_args.append(f'-GPSAltitude={altitude}')
+
+    # Add remaining metadata
+    if make:
+        exiftool_args.append(f'-Make={make}')
+    if model:
+        exiftool_args.append(f'-Model={model}')
+    if software:
+        exiftool_args.append(f'-Software={software}')
+    if keywords:
+        exiftool_args.append(f'-Keywords={",".join(keywords)}')
+    if copyright:
+        exiftool_args.append(f'-Copyright={copyright}')
+    if artist:
+        exiftool_args.append(f'-Artist={artist}')
+
+    # Add the file path at the end
+    exiftool_args.append(media_path)
 
-def embed_metadata(root_folder):
-    for subdir, _, files in os.walk(root_folder):
-        media_files = [f for f in files if f.lower().endswith(('.jpg', '.jpeg', '.png', '.mp4', '.mov', '.heic'))]
+    # Clean up None values
+    exiftool_args = [arg for arg in exiftool_args if arg is not None]
+    return exiftool_args, image_date
+
+def find_media_pairs(root_folder, inventory=None):
+    """
+    Walk the tree and yield a (media_path, json_path) pair for every media file, with json_path None if it has no sidecar
+
+    The tree is read from the inventory when one is given, otherwise it is scanned once.
+    """
+    if inventory is None:
+        inventory = load_inventory(root_folder)
+    for subdir, entries in inventory.walk(root_folder):
+        files = [entry.name for entry in entries]
+        media_files = [f for f in files if f.lower().endswith(MEDIA_EXTENSIONS)]
         json_files = [f for f in files if f.lower().endswith('.json')]
 
         logger.info(f"Processing directory: {Colors.CYAN}{subdir}{Colors.RESET}")
         logger.debug(f"Found {len(media_files)} media files and {len(json_files)} JSON files")
-        
-        for media_file in media_files:
+
+        with metrics.timer('sidecar_match', len(media_files)):
+            sidecars = SidecarIndex(json_files)
+            matches = [(media_file, sidecars.find(media_file)) for media_file in media_files]
+        for media_file, json_file in matches:
+            yield os.path.join(subdir, media_file), os.path.join(subdir, json_file) if json_file else None
+
+def prepare_tasks(pairs, summary, state=None, resume=True, inventory=None, on_done=None):
+    """
+    Turn (media_path, json_path) pairs into (media_path, json_path, sidecar_digest) embed tasks
+
+    When a state database is given the sidecar is hashed, and with resume enabled files that
+    were already embedded from an unchanged sidecar are skipped. Their fingerprint comes from
+    the inventory's cached stat when there is one. on_done is called with the path of
+    every media file that is skipped.
+    """
+    for media_path, json_path in pairs:
+        if not json_path:
+            logger.warning(f"No metadata JSON found for: {os.path.basename(media_path)}")
+            summary.add_skipped()
+            if on_done:
+                on_done(media_path)
+            continue
+
+        digest = sidecar_hash(json_path) if state else ''
+        stat = inventory.stat(media_path) if inventory else None
+        if state and resume and state.is_current('embed', media_path, file_fingerprint(media_path, digest, stat)):
+            logger.debug(f"Skipping already embedded file: {media_path}")
+            summary.add_skipped()
+            if on_done:
+                on_done(media_path)
+            continue
+        yield media_path, json_path, digest
+
+def write_native(media_path, exiftool_args):
+    """
+    Try to write the metadata with the in-process writer
+
+    Returns an (exiftool_args, ExifToolResult) outcome, or None if the file has to go
+    through ExifTool instead.
+    """
+    if not media_path.lower().endswith(NATIVE_EXTENSIONS):
+        return None
+    try:
+        written = write_metadata(media_path, tags_from_args(exiftool_args[:-1]))
+    except NativeWriteUnsupported as e:
+        logger.debug(f"Falling back to ExifTool for {media_path}: {e}")
+        return None
+    mode = 'patched in place' if written.in_place else 'rewritten'
+    message = f"Native writer {mode} {os.path.basename(media_path)}: {written.bytes_written} of {os.path.getsize(media_path)} bytes written"
+    logger.info(message)
+    return exiftool_args, ExifToolResult(0, message, '')
+
+def prepare_batch(tasks, engine='exiftool'):
+    """
+    Load the sidecars of a batch of (media_path, json_path, sidecar_digest) tasks and build its ExifTool commands
+
+    With the native engine, JPEG and MP4/MOV files are written in-process here and only the
+    files the native writer cannot handle are left for ExifTool. Files whose ExifTool
+    arguments are identical share a single command.
+    Returns (outcomes, blocks): outcomes maps the media files already dealt with to their
+    outcome, and blocks lists the (args, paths) commands still to run.
+    """
+    outcomes = {}
+    commands = []
+    with metrics.timer('json_load', len(tasks)):
+        sidecars = load_sidecars([json_path for _, json_path, _ in tasks])
+    for (media_path, _, _), sidecar in zip(tasks, sidecars):
+        try:
+            if isinstance(sidecar, Exception):
+                raise sidecar
+
+            logger.debug(f"Processing file: {media_path}")
+            with metrics.timer('command_build'):
+                exiftool_args, _ = build_exiftool_args(media_path, sidecar)
+            if engine == 'native':
+                with metrics.timer('native_write'):
+                    outcome = write_native(media_path, exiftool_args)
+                if outcome:
+                    outcomes[media_path] = outcome
+                    continue
+            commands.append((exiftool_args[:-1], media_path))
+        except Exception as e:
+            outcomes[media_path] = e
+
+    blocks = group_commands(commands)
+    for args, paths in blocks:
+        # Log the command for debugging
+        logger.debug(f"Running command: exiftool {' '.join(args + paths)}")
+    return outcomes, blocks
+
+def collect_results(tasks, outcomes, blocks, results):
+    """Merge the ExifTool results of the blocks from prepare_batch into a list of (task, outcome) pairs in task order"""
+    for (args, paths), result in zip(blocks, results):
+        for path, file_result in split_result(result, paths).items():
+            outcomes[path] = (args + [path], file_result)
+    return [(task, outcomes[task[0]]) for task in tasks]
+
+def embed_batch(exiftool, tasks, engine='exiftool'):
+    """
+    Embed the sidecar metadata of a batch of (media_path, json_path, sidecar_digest) tasks using the given ExifTool session
+
+    All commands of the batch are sent to the worker in one -execute chained round trip.
+    Returns a list of (task, outcome) pairs in task order, where outcome is either an
+    (exiftool_args, ExifToolResult) pair or the exception raised while preparing the file.
+    """
+    outcomes, blocks = prepare_batch(tasks, engine)
+    # Run the commands on this worker's persistent ExifTool process
+    results = exiftool.execute_many([args + paths for args, paths in blocks]) if blocks else []
+    return collect_results(tasks, outcomes, blocks, results)
+
+def sort_outcomes(outcomes, summary):
+    """Log the (task, outcome) pairs of a batch and return the (media_path, digest, image_date) of the embedded files"""
+    embedded = []
+    for (media_path, _, digest), outcome in outcomes:
+        media_file = os.path.basename(media_path)
+        if isinstance(outcome, Exception):
+            logger.error(f"Failed to process {media_file}: {str(outcome)}", exc_info=outcome)
+            summary.add_error(media_path, str(outcome))
+            metrics.count('embed_errors')
+            continue
+
+        exiftool_args, result = outcome
+        if result.ok:
+            logger.info(f"Successfully processed: {media_path}")
+            # Log what exiftool actually did
+            if result.stdout:
+                logger.debug(f"Exiftool output: {result.stdout}")
+            summary.add_success()
+            embedded.append((media_path, digest, tags_from_args(exiftool_args).get('DateTimeOriginal')))
+        else:
+            logger.error(f"Error processing {media_file}: {result.stderr}")
+            logger.error(f"Command was: exiftool {' '.join(exiftool_args)}")
+            summary.add_error(media_path, result.stderr)
+            metrics.count('embed_errors')
+    metrics.count('files_embedded', len(embedded))
+    return embedded
+
+def stamp_creation_dates(embedded, inventory=None, jobs=1):
+    """
+    Set the creation dates of embedded files to their date taken
+
+    Returns ({media_path: refreshed FileEntry or None}, timestamp failures)
+    """
+    stats = {media_path: inventory.refresh(media_path) if inventory else None for media_path, _, _ in embedded}
+    creation_dates = [(media_path, file_creation_date(media_path, image_date, stats[media_path]))
+                      for media_path, _, image_date in embedded if image_date]
+    updates = [(path, date) for path, date in creation_dates if date]
+    failures = apply_creation_times(updates, jobs)
+    for path, _ in updates:
+        stats[path] = inventory.refresh(path) if inventory else None
+    return stats, failures
+
+def record_embedded(embedded, stats, state=None, manifest=None):
+    """Record the embedded files in the state database and their dates taken in the date manifest"""
+    for media_path, digest, image_date in embedded:
+        if state:
+            state.record('embed', media_path, file_fingerprint(media_path, digest, stats[media_path]))
+        if manifest is not None and image_date:
+            manifest.add(media_path, image_date)
+    if state:
+        state.commit()
+
+def embed_metadata(root_folder, jobs=1, batch_size=32, state=None, resume=True, engine='exiftool', manifest=None, inventory=None):
+    if inventory is None:
+        inventory = load_inventory(root_folder)
+    return embed_pairs(find_media_pairs(root_folder, inventory), jobs, batch_size, state, resume, engine, manifest, inventory)
+
+def embed_pairs(pairs, jobs=1, batch_size=32, state=None, resume=True, engine='exiftool', manifest=None, inventory=None,
+                on_done=None):
+    """
+    Embed metadata for a stream of (media_path, json_path) pairs and return the JobSummary
+
+    The pairs can come from a directory walk or from any other producer, such as the
+    streaming ZIP extractor, and are consumed lazily. With a DateManifest, the date taken
+    of every successfully embedded file is recorded in it for update_creation_date.py. With
+    an Inventory, the cached stat of every rewritten file is refreshed. on_done is called
+    with the path of every media file once embedding is finished with it, whether it was
+    embedded, skipped or failed, so a later stage can pick it up straight away.
+    """
+    summary = JobSummary()
+    time_failures = []
+    with ExifToolPool(jobs=jobs) as pool:
+        batches = batched(prepare_tasks(pairs, summary, state, resume, inventory, on_done), batch_size)
+        embed = lambda exiftool, batch: embed_batch(exiftool, batch, engine)
+        for batch, outcomes, error in pool.imap(embed, batches):
+            if error:
+                outcomes = [(task, error) for task in batch]
+
+            embedded = sort_outcomes(outcomes, summary)
+            # Stamp the creation dates before fingerprinting, as this can change the file times
+            stats, failures = stamp_creation_dates(embedded, inventory, jobs)
+            time_failures += failures
+            record_embedded(embedded, stats, state, manifest)
+            if on_done:
+                for media_path, _, _ in batch:
+                    on_done(media_path)
+
+    log_failures(time_failures)
+    summary.log('Embedded metadata into')
+    return summary
+
+async def embed_pairs_async(pairs, scheduler, jobs=1, batch_size=32, state=None, resume=True, engine='exiftool', manifest=None,
+                            inventory=None, on_done=None):
+    """
+    asyncio variant of embed_pairs, driving up to `jobs` ExifTool workers from one event loop
+
+    Each batch moves through the IOScheduler's resource classes: its sidecars are loaded
+    on the disk threads, ExifTool writes it while holding a CPU slot, and its creation
+    dates are stamped on the disk threads again, so batches at different steps overlap.
+    Tasks are prepared and outcomes recorded on the event loop itself, in submission
+    order, as the state database connection belongs to its thread.
+    """
+    summary = JobSummary()
+    time_failures = []
+
+    async with AsyncExifToolPool(jobs=jobs) as pool:
+        async def embed(batch):
             try:
-                json_file = find_json_file(media_file, json_files)
-                if json_file:
-                    with open(os.path.join(subdir, json_file), 'r', encoding='utf-8') as f:
-                        metadata = json.load(f)
-
-                    title = metadata.get('title', '')
-                    description = metadata.get('description', '')
-                    image_date = format_date_for_exiftool(metadata.get('photoTakenTime', {}))
-                    location = metadata.get('geoData', {})
-                    latitude = location.get('latitude')
-                    longitude = location.get('longitude')
-                    altitude = location.get('altitude')
-                    make = metadata.get('cameraMake', '')
-                    model = metadata.get('cameraModel', '')
-                    software = metadata.get('software', '')
-                    keywords = metadata.get('keywords', [])
-                    copyright = metadata.get('copyright', '')
-                    artist = metadata.get('artist', '')
-                    
-                    people_tags = extract_people_tags(metadata)
-                    if people_tags:
-                        if keywords:
-                            keywords.extend(people_tags)
-                        else:
-                            keywords = people_tags
-                        logger.debug(f"Added people tags: {', '.join(people_tags)}")
-
-                    logger.debug(f"Processing file: {media_file}")
-                    
-                    # Build the command
-                    exiftool_cmd = [
-                        'exiftool',
-                        '-overwrite_original',  # Don't create backup files
-                        '-preserve',           # Preserve file modification date/time
-                        f'-Title={title}' if title else None,
-                        f'-ImageDescription={description}' if description and media_file.lower().endswith(('.jpg', '.jpeg', '.png', '.mp4', '.mov', '.heic')) else None,
-                    ]
-                    
-                    # Handle date fields
-                    if image_date:
-                        exiftool_cmd.extend([
-                            f'-DateTimeOriginal={image_date}',
-                            f'-CreateDate={image_date}', 
-                            f'-ModifyDate={image_date}'
-                        ])                        
-                        set_file_date(subdir, media_file, image_date)
-                    
-                    # Handle GPS data
-                    if latitude and longitude:
-                        exiftool_cmd.extend([
-                            f'-GPSLatitude={latitude}',
-                            f'-GPSLongitude={longitude}',
-                        ])
-                        # Add GPSLatitudeRef and GPSLongitudeRef
-                        if float(latitude) >= 0:
-                            exiftool_cmd.append('-GPSLatitudeRef=N')
-                        else:
-                            exiftool_cmd.append('-GPSLatitudeRef=S')
-                            
-                        if float(longitude) >= 0:
-                            exiftool_cmd.append('-GPSLongitudeRef=E')
-                        else:
-                            exiftool_cmd.append('-GPSLongitudeRef=W')
-                            
-                        if altitude:
-                            exiftool_cmd.append(f'-GPSAltitude={altitude}')
-                    
-                    # Add remaining metadata
-                    if make:
-                        exiftool_cmd.append(f'-Make={make}')
-                    if model:
-                        exiftool_cmd.append(f'-Model={model}')
-                    if software:
-                        exiftool_cmd.append(f'-Software={software}')
-                    if keywords:
-                        exiftool_cmd.append(f'-Keywords={",".join(keywords)}')
-                    if copyright:
-                        exiftool_cmd.append(f'-Copyright={copyright}')
-                    if artist:
-                        exiftool_cmd.append(f'-Artist={artist}')
-                    
-                    # Add the file path at the end
-                    exiftool_cmd.append(os.path.join(subdir, media_file))
-                    
-                    # Clean up None values
-                    exiftool_cmd = [arg for arg in exiftool_cmd if arg is not None]
-                    
-                    # Log the command for debugging
-                    logger.debug(f"Running command: {' '.join(exiftool_cmd)}")
-                    
-                    # Run the command
-                    result = subprocess.run(exiftool_cmd, capture_output=True, text=True)
-                    
-                    if result.returncode == 0:
-                        logger.info(f"Successfully processed: {os.path.join(subdir, media_file)}")
-                        # Log what exiftool actually did
-                        if result.stdout:
-                            logger.debug(f"Exiftool output: {result.stdout}")                        
-                    else:
-                        logger.error(f"Error processing {media_file}: {result.stderr}")
-                        logger.error(f"Command was: {' '.join(exiftool_cmd)}")
-                else:
-                    logger.warning(f"No metadata JSON found for: {media_file}")
+                outcomes, blocks = await scheduler.run('disk', prepare_batch, batch, engine)
+                results = []
+                if blocks:
+                    async with scheduler.limit('cpu'), pool.session() as exiftool:
+                        results = await exiftool.execute_many([args + paths for args, paths in blocks])
+                outcomes = collect_results(batch, outcomes, blocks, results)
             except Exception as e:
-                logger.exception(f"Failed to process {media_file}: {str(e)}")
+                outcomes = [(task, e) for task in batch]
+            embedded = sort_outcomes(outcomes, summary)
+            stats, failures = await scheduler.run('disk', stamp_creation_dates, embedded, inventory)
+            return batch, embedded, stats, failures
+
+        def record(batch, embedded, stats, failures):
+            time_failures.extend(failures)
+            record_embedded(embedded, stats, state, manifest)
+            if on_done:
+                for media_path, _, _ in batch:
+                    on_done(media_path)
+
+        pending = collections.deque()
+        for batch in batched(prepare_tasks(pairs, summary, state, resume, inventory, on_done), batch_size):
+            pending.append(asyncio.ensure_future(embed(batch)))
+            if len(pending) >= pool.jobs * 4:
+                record(*await pending.popleft())
+        while pending:
+            record(*await pending.popleft())
+
+    log_failures(time_failures)
+    summary.log('Embedded metadata into')
+    return summary
 
-def cleanup_files(source_folder):
+def cleanup_files(source_folder, inventory=None):
     #any file that is not one of the designated media files should be deleted
-    for root, dirs, files in os.walk(source_folder):
-        for file in files:
-            if not file.lower().endswith(('.jpg', '.jpeg', '.png', '.mp4', '.mov', '.heic', '.mts', '.wmv', '.avi', '.gif')):
-                os.remove(os.path.join(root, file))
-                logger.debug(f"Removed extraneous file: {file}")
+    if inventory is None:
+        inventory = load_inventory(source_folder)
+    for entry in inventory.files(source_folder):
+        if not entry.name.lower().endswith(KEPT_EXTENSIONS):
+            os.remove(entry.path)
+            inventory.discard(entry.path)
+            logger.debug(f"Removed extraneous file: {entry.name}")
 
 
 def main ():
@@ -245,14 +417,63 @@ def main ():
     parser.add_argument('--target', '-t', 
                        default='./extracts', 
                        help='Target folder for embedding metadata (default: ./extracts)')
+    parser.add_argument('--jobs', '-j',
+                       type=int,
+                       default=1,
+                       help='Number of parallel ExifTool workers (default: 1)')
+    parser.add_argument('--batch-size', '-b',
+                       type=int,
+                       default=32,
+                       help='Number of files sent to an ExifTool worker per round trip (default: 32)')
+    parser.add_argument('--engine',
+                       choices=('exiftool', 'native'),
+                       default='exiftool',
+                       help='Metadata writer: ExifTool for every file, or the in-process writer for JPEG/MP4/MOV with ExifTool as fallback. The native writer patches movies in place when their moov atom fits, without a temporary copy, so an interruption mid-write can leave such a movie unplayable (default: exiftool)')
+    parser.add_argument('--state-db',
+                       default=DEFAULT_STATE_DB,
+                       help=f'SQLite database recording already embedded files (default: {DEFAULT_STATE_DB})')
+    parser.add_argument('--date-manifest',
+                       default=DEFAULT_DATE_MANIFEST,
+                       help=f'Binary manifest of embedded dates read by update_creation_date.py (default: {DEFAULT_DATE_MANIFEST})')
+    parser.add_argument('--inventory',
+                       nargs='?',
+                       const=DEFAULT_INVENTORY,
+                       help=f'Reuse the file inventory saved by an earlier stage and save it back, instead of scanning the whole tree (path defaults to {DEFAULT_INVENTORY})')
+    resume_group = parser.add_mutually_exclusive_group()
+    resume_group.add_argument('--resume',
+                       dest='resume',
+                       action='store_true',
+                       default=True,
+                       help='Skip files already embedded from an unchanged sidecar (default)')
+    resume_group.add_argument('--force',
+                       dest='resume',
+                       action='store_false',
+                       help='Re-embed every file, even if it was already embedded')
+    add_scheduler_arguments(parser)
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
+    setup_metrics(args, 'embed')
     target_dir = args.target
 
     try:
         logger.info(f"Starting metadata re-embedding process in {Colors.CYAN}{target_dir}{Colors.RESET}")
-        embed_metadata(target_dir)
-        cleanup_files(target_dir)
+        manifest = DateManifest(args.date_manifest)
+        inventory = load_inventory(target_dir, args.inventory)
+        with StateDB(args.state_db) as state:
+            if args.use_async:
+                async def embed_async():
+                    with scheduler_from_args(args) as scheduler:
+                        await embed_pairs_async(find_media_pairs(target_dir, inventory), scheduler, args.jobs, args.batch_size,
+                                                state, args.resume, args.engine, manifest, inventory)
+                asyncio.run(embed_async())
+            else:
+                embed_metadata(target_dir, jobs=args.jobs, batch_size=args.batch_size, state=state, resume=args.resume,
+                               engine=args.engine, manifest=manifest, inventory=inventory)
+        manifest.save()
+        cleanup_files(target_dir, inventory)
+        if args.inventory:
+            inventory.save(args.inventory)
         logger.info(f"{Colors.GREEN}Metadata re-embedding process completed successfully{Colors.RESET}")
     except Exception as e:
         logger.error(f"Process failed: {str(e)}")
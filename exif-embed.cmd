@@ -0,0 +1,4 @@
+
+@echo off
+python3 pipeline.py %*
+pause
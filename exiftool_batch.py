@@ -0,0 +1,67 @@
+import itertools
+from exiftool_session import ExifToolResult
+
+
+def batched(items, size):
+    """Yield lists of up to `size` consecutive items"""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def group_commands(commands):
+    """
+    Merge commands whose arguments are identical apart from the target file
+
+    Args:
+        commands: List of (args, path) pairs where path is the file the args apply to
+    Returns:
+        List of (args, paths) blocks in first-seen order. Each block is a single ExifTool
+        command that writes the shared args to every file in paths.
+
+    Embedding writes each file's own dates, so identical arguments are rare and most blocks
+    hold a single file; the saving then comes from chaining them with -execute in one round trip.
+    """
+    groups = {}
+    for args, path in commands:
+        groups.setdefault(tuple(args), []).append(path)
+    return [(list(args), paths) for args, paths in groups.items()]
+
+
+def split_result(result, paths):
+    """
+    Attribute the result of a multi-file ExifTool command back to the individual files
+
+    ExifTool suffixes per-file warnings and errors with ' - <file name>', so those lines are
+    handed to the matching file; a line goes to the longest path it ends with, as 'a - b.jpg'
+    also ends with ' - b.jpg'. If the command failed without naming a file, every file in
+    the block is reported as failed with the full stderr.
+
+    Returns:
+        Dict of path -> ExifToolResult
+    """
+    if len(paths) == 1:
+        return {paths[0]: result}
+
+    lines = result.stderr.splitlines() if result.stderr else []
+    by_path = {path: [] for path in paths}
+    longest_first = sorted(paths, key=len, reverse=True)
+    for line in lines:
+        path = next((path for path in longest_first if line.endswith(f' - {path}')), None)
+        if path is not None:
+            by_path[path].append(line)
+
+    results = {}
+    attributed = False
+    for path in paths:
+        file_lines = by_path[path]
+        attributed = attributed or bool(file_lines)
+        failed = any(line.startswith('Error') for line in file_lines)
+        results[path] = ExifToolResult(1 if failed else 0, result.stdout, '\n'.join(file_lines))
+
+    if not result.ok and not attributed:
+        return {path: ExifToolResult(result.status, result.stdout, result.stderr) for path in paths}
+    return results
@@ -0,0 +1,160 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from exiftool_session import DEFAULT_EXECUTABLE, AsyncExifToolSession, ExifToolSession
+from logger_utils import Colors
+
+logger = logging.getLogger(__name__)
+
+
+class JobSummary:
+    """Collects per-file outcomes so a run can finish with one combined error report"""
+
+    def __init__(self):
+        self.succeeded = 0
+        self.skipped = 0
+        self.errors = []
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+    def add_success(self):
+        self.succeeded += 1
+
+    def add_skipped(self):
+        self.skipped += 1
+
+    def add_error(self, path, message):
+        self.errors.append((path, message))
+
+    def log(self, action='Processed'):
+        """Log the totals followed by every recorded error"""
+        logger.info(f"{action} {self.succeeded} files, {self.skipped} skipped, {self.failed} failed")
+        if self.errors:
+            logger.error(f"{Colors.RED}{self.failed} files failed:{Colors.RESET}")
+            for path, message in self.errors:
+                logger.error(f"  {path}: {message}")
+
+
+class ExifToolPool:
+    """
+    Pool of worker threads that each own a persistent ExifTool session
+
+    imap() runs a function over a stream of work items and yields the outcomes in the
+    order the items were submitted, whatever order the workers finish in. At most
+    `max_pending` items are in flight at once, so the input can be a lazy generator over
+    an arbitrarily large tree without the queue growing with it.
+
+    Usage:
+        with ExifToolPool(jobs=8) as pool:
+            for item, result, error in pool.imap(lambda exiftool, path: exiftool.execute([path]), paths):
+                ...
+    """
+
+    def __init__(self, jobs=1, executable=DEFAULT_EXECUTABLE, timeout=600.0, max_pending=None):
+        self.jobs = max(1, int(jobs))
+        self.executable = executable
+        self.timeout = timeout
+        self.max_pending = max_pending or self.jobs * 4
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+        self._executor = None
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='exiftool')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = ExifToolSession(self.executable, self.timeout)
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def _run(self, func, item):
+        return func(self._session(), item)
+
+    def imap(self, func, items):
+        """
+        Apply func(exiftool_session, item) to every item on the pool
+
+        Yields (item, result, error) tuples in submission order; error is the exception
+        raised by func for that item, or None when it succeeded.
+        """
+        pending = collections.deque()
+        for item in items:
+            pending.append((item, self._executor.submit(self._run, func, item)))
+            if len(pending) >= self.max_pending:
+                yield self._collect(*pending.popleft())
+        while pending:
+            yield self._collect(*pending.popleft())
+
+    @staticmethod
+    def _collect(item, future):
+        try:
+            return item, future.result(), None
+        except Exception as e:
+            return item, None, e
+
+
+class AsyncExifToolPool:
+    """
+    Up to `jobs` persistent AsyncExifToolSession workers shared by the coroutines of one event loop
+
+    session() checks a worker out for the duration of an `async with` block, starting a
+    new one while fewer than `jobs` exist and waiting for one to be handed back otherwise.
+
+    Usage:
+        async with AsyncExifToolPool(jobs=4) as pool:
+            async with pool.session() as exiftool:
+                result = await exiftool.execute([path])
+    """
+
+    def __init__(self, jobs=1, executable=DEFAULT_EXECUTABLE, timeout=600.0):
+        self.jobs = max(1, int(jobs))
+        self.executable = executable
+        self.timeout = timeout
+        self._sessions = []
+        self._idle = None
+
+    async def __aenter__(self):
+        self._idle = asyncio.Queue()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, []
+        await asyncio.gather(*(session.close() for session in sessions))
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        if self._idle.empty() and len(self._sessions) < self.jobs:
+            session = AsyncExifToolSession(self.executable, self.timeout)
+            self._sessions.append(session)
+        else:
+            session = await self._idle.get()
+        try:
+            yield session
+        finally:
+            self._idle.put_nowait(session)
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import metrics
+from exiftool_session import DEFAULT_EXECUTABLE, ExifToolError
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(stream, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield the elements of a JSON array read from a text stream, one at a time
+
+    Only the element currently being decoded is held in memory, so the output of a scan
+    over hundreds of thousands of files never has to be loaded as a whole.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        # Skip separators between elements
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            started = started or buffer[position] == '['
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                raise ValueError(f"Expected a JSON array, got {buffer[position:position + 40]!r}")
+            try:
+                element, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield element
+                continue
+        elif eof:
+            return
+
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def scan_tree(targets, tags, executable=DEFAULT_EXECUTABLE, extra_args=(), fast=2):
+    """
+    Read tags from every file under targets with a single recursive ExifTool run
+
+    targets is a directory or file path, or a list of them; lists are passed to ExifTool
+    through an argument file so any number of paths fit in one run.
+    Yields one dict per file, as produced by `exiftool -json`, with 'SourceFile' holding
+    the file path. fast is the ExifTool -fast level: 2 (the default) skips MakerNotes and
+    stops at the QuickTime mdat atom, 1 only skips JPEG trailers, and 0 reads everything.
+    """
+    cmd = [executable, '-json', '-r'] + ([f'-fast{fast}' if fast > 1 else '-fast'] if fast else [])
+    cmd += ['-charset', 'filename=utf8']
+    cmd += list(extra_args) + [f'-{tag}' for tag in tags]
+    argfile = None
+    if isinstance(targets, str):
+        cmd.append(targets)
+    else:
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.args', delete=False) as argfile:
+            argfile.writelines(f'{target}\n' for target in targets)
+        cmd += ['-@', argfile.name]
+    logger.debug(f"Scanning tree: {' '.join(cmd)}")
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8', errors='replace')
+    except OSError as e:
+        if argfile:
+            os.remove(argfile.name)
+        raise ExifToolError(f"Unable to start ExifTool ({executable}): {e}") from e
+    metrics.count('exiftool_spawns')
+    started = time.perf_counter()
+    records = 0
+
+    # Drain stderr in the background so warnings about individual files can never block stdout
+    stderr_lines = []
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+    try:
+        for record in iter_json_array(process.stdout):
+            records += 1
+            yield record
+    finally:
+        process.stdout.close()
+        status = process.wait()
+        stderr_thread.join()
+        if argfile:
+            os.remove(argfile.name)
+        # Includes the time the caller spent on the records, as the scan runs alongside it
+        metrics.record('exiftool_scan', time.perf_counter() - started, records)
+
+    for line in stderr_lines:
+        logger.warning(f"ExifTool: {line.rstrip()}")
+    # Status 1 only means some files had no readable metadata; anything higher is a real failure
+    if status > 1:
+        raise ExifToolError(f"ExifTool scan failed with status {status}")
+
+
+def path_key(path):
+    """Normalize a path the way ExifTool and os.walk results are compared"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def read_dates(targets, executable=DEFAULT_EXECUTABLE):
+    """
+    Return a {path_key: date string} map of the date taken of every file under targets
+
+    Movies use QuickTime:CreateDate and everything else DateTimeOriginal, matching what
+    update_creation_date reads per file. Files without a date are left out. `-fast` is
+    used rather than `-fast2`, as the moov atom holding CreateDate may follow the mdat.
+    """
+    dates = {}
+    for info in scan_tree(targets, ['DateTimeOriginal', 'QuickTime:CreateDate'], executable, ['--ext', 'wmv'], fast=1):
+        source = info.get('SourceFile')
+        if not source:
+            continue
+        if source.lower().endswith('.mp4'):
+            date = info.get('CreateDate')
+        else:
+            date = info.get('DateTimeOriginal')
+        if isinstance(date, str) and date.strip():
+            dates[path_key(source)] = date.strip()
+    logger.debug(f"Read {len(dates)} dates")
+    return dates
+
+
+def read_content_identifiers(targets, extensions, executable=DEFAULT_EXECUTABLE):
+    """
+    Return a {path_key: ContentIdentifier} map for the files under targets with the given extensions
+
+    Apple writes the same ContentIdentifier into both halves of a live photo: the MakerNotes
+    of the still image and the QuickTime metadata of the movie. `-fast2` would skip the
+    former and stop at the movie's mdat atom, so only `-fast` is used.
+    """
+    extra_args = []
+    for extension in extensions:
+        extra_args += ['-ext', extension.lstrip('.')]
+    identifiers = {}
+    for info in scan_tree(targets, ['ContentIdentifier'], executable, extra_args, fast=1):
+        source = info.get('SourceFile')
+        identifier = info.get('ContentIdentifier')
+        if source and isinstance(identifier, str) and identifier.strip():
+            identifiers[path_key(source)] = identifier.strip()
+    logger.debug(f"Read {len(identifiers)} content identifiers")
+    return identifiers
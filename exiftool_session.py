@@ -0,0 +1,396 @@
+import asyncio
+import logging
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ExifTool executable used when none is passed in, e.g. a stub for benchmarks; found on PATH by default
+DEFAULT_EXECUTABLE = os.environ.get('EXIFTOOL_PATH') or 'exiftool'
+
+# Marker echoed to stderr once ExifTool has finished a command block. ${status} is expanded by
+# ExifTool to the exit status the command would have had if run on its own.
+_STDERR_READY_RE = re.compile(r'^\{ready(\d+):(.*)\}$')
+
+
+class ExifToolError(Exception):
+    """Raised when the ExifTool worker cannot be started or stops responding"""
+
+
+class ExifToolResult:
+    """Outcome of a single command block sent to a persistent ExifTool worker"""
+
+    __slots__ = ('status', 'stdout', 'stderr')
+
+    def __init__(self, status, stdout, stderr):
+        self.status = status
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def ok(self):
+        return self.status == 0
+
+    def __repr__(self):
+        return f"ExifToolResult(status={self.status!r}, stdout={self.stdout!r}, stderr={self.stderr!r})"
+
+
+class ExifToolSession:
+    """
+    Long-lived ExifTool process driven through `-stay_open True -@ -`
+
+    Each call to execute() writes one argument block to the worker's stdin, terminated by
+    `-execute{N}`, and reads stdout/stderr back until the matching `{readyN}` markers.
+    If the worker dies or does not answer within `timeout` seconds it is killed and
+    restarted transparently on the next call.
+
+    Usage:
+        with ExifToolSession() as exiftool:
+            result = exiftool.execute(['-overwrite_original', '-Title=foo', 'photo.jpg'])
+            if not result.ok:
+                print(result.stderr)
+    """
+
+    def __init__(self, executable=DEFAULT_EXECUTABLE, timeout=600.0):
+        self.executable = executable
+        self.timeout = timeout
+        self._process = None
+        self._stdout_lines = None
+        self._stderr_lines = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        """Start the ExifTool worker if it is not already running"""
+        if self.running:
+            return
+
+        cmd = [self.executable, '-stay_open', 'True', '-@', '-']
+        logger.debug(f"Starting ExifTool worker: {' '.join(cmd)}")
+        try:
+            self._process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                encoding='utf-8',
+                errors='replace',
+                bufsize=1
+            )
+        except OSError as e:
+            self._process = None
+            raise ExifToolError(f"Unable to start ExifTool ({self.executable}): {e}") from e
+        metrics.count('exiftool_spawns')
+
+        # Pump both pipes from background threads so a full stderr buffer can never block stdout
+        self._stdout_lines = queue.Queue()
+        self._stderr_lines = queue.Queue()
+        for stream, lines in ((self._process.stdout, self._stdout_lines), (self._process.stderr, self._stderr_lines)):
+            threading.Thread(target=self._pump, args=(stream, lines), daemon=True).start()
+
+    def close(self):
+        """Ask the worker to exit, killing it if it does not comply"""
+        process, self._process = self._process, None
+        if process is None:
+            return
+
+        try:
+            if process.poll() is None:
+                process.stdin.write('-stay_open\nFalse\n')
+                process.stdin.flush()
+                process.wait(timeout=10)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+        finally:
+            for stream in (process.stdin, process.stdout, process.stderr):
+                try:
+                    stream.close()
+                except (OSError, ValueError):
+                    pass
+
+    def restart(self):
+        """Kill the current worker (if any) and start a fresh one"""
+        self._kill()
+        self.start()
+
+    def _kill(self):
+        process, self._process = self._process, None
+        if process is not None and process.poll() is None:
+            logger.warning(f"Killing unresponsive ExifTool worker (pid {process.pid})")
+            process.kill()
+            process.wait()
+
+    def execute(self, args):
+        """
+        Run one ExifTool command block on the persistent worker
+
+        Args:
+            args: ExifTool arguments for this block, including the target file path(s),
+                  without the leading 'exiftool' executable name
+        Returns:
+            ExifToolResult with the exit status and captured stdout/stderr
+        """
+        return self.execute_many([args])[0]
+
+    def execute_many(self, blocks):
+        """
+        Run several command blocks in one round trip
+
+        All blocks are written to the worker back to back, each terminated by its own
+        `-execute{N}`, and the results are then read back in the same order. If the worker
+        dies part way through, the remaining blocks are reported as failed.
+
+        Args:
+            blocks: List of argument lists, as accepted by execute()
+        Returns:
+            List of ExifToolResult, one per block
+        """
+        with self._lock:
+            self.start()
+            sequences = []
+            payload = []
+            for args in blocks:
+                self._sequence += 1
+                sequences.append(self._sequence)
+                payload.append(self._encode_block(args, self._sequence))
+
+            results = []
+            started = time.perf_counter()
+            try:
+                self._process.stdin.write(''.join(payload))
+                self._process.stdin.flush()
+                for sequence in sequences:
+                    results.append(self._read_result(sequence))
+            except (OSError, ValueError, ExifToolError) as e:
+                args = blocks[len(results)]
+                logger.error(f"ExifTool worker failed while processing {args[-1] if args else '<no args>'}: {e}")
+                # The worker is started again on the next call
+                self._kill()
+                results.extend(ExifToolResult(-1, '', str(e)) for _ in blocks[len(results):])
+                metrics.count('exiftool_failures')
+            metrics.record('exiftool_wait', time.perf_counter() - started, len(blocks))
+
+            return results
+
+    def _read_result(self, sequence):
+        stdout = self._read_until(self._stdout_lines, lambda line: line == f'{{ready{sequence}}}')
+        status = None
+
+        def stderr_done(line):
+            nonlocal status
+            match = _STDERR_READY_RE.match(line)
+            if match and int(match.group(1)) == sequence:
+                status = match.group(2)
+                return True
+            return False
+
+        stderr = self._read_until(self._stderr_lines, stderr_done)
+        return ExifToolResult(self._parse_status(status, stderr), stdout, stderr)
+
+    @staticmethod
+    def _encode_block(args, sequence):
+        # The argument file format is one argument per line, so values with embedded newlines
+        # are C-escaped and the block is switched to -ec so ExifTool unescapes them again.
+        # File names arrive as UTF-8 over stdin rather than through the system code page.
+        args = [str(arg) for arg in args]
+        if any('\n' in arg or '\r' in arg for arg in args):
+            escaped = ['-ec']
+            for arg in args:
+                if arg.startswith('-') and '=' in arg:
+                    tag, value = arg.split('=', 1)
+                    value = value.replace('\\', '\\\\').replace('\r', '\\r').replace('\n', '\\n')
+                    arg = f'{tag}={value}'
+                escaped.append(arg)
+            args = escaped
+
+        lines = ['-charset', 'filename=utf8'] + args + ['-echo4', f'{{ready{sequence}:${{status}}}}', f'-execute{sequence}']
+        return '\n'.join(lines) + '\n'
+
+    def _read_until(self, lines, is_marker):
+        collected = []
+        while True:
+            try:
+                line = lines.get(timeout=self.timeout)
+            except queue.Empty:
+                raise ExifToolError(f"no response from ExifTool within {self.timeout} seconds")
+            if line is None:
+                raise ExifToolError("ExifTool worker exited unexpectedly")
+            if is_marker(line):
+                return '\n'.join(collected)
+            collected.append(line)
+
+    @staticmethod
+    def _parse_status(status, stderr):
+        if status is not None and status.strip().isdigit():
+            return int(status)
+        # ExifTool releases before 12.10 do not expand ${status}; fall back to scanning for errors
+        return 1 if 'Error' in stderr else 0
+
+    @staticmethod
+    def _pump(stream, lines):
+        try:
+            for line in stream:
+                lines.put(line.rstrip('\r\n'))
+        except (OSError, ValueError):
+            pass
+        finally:
+            lines.put(None)
+
+
+class AsyncExifToolSession:
+    """
+    asyncio counterpart of ExifToolSession, started with asyncio.create_subprocess_exec
+
+    Speaks the same `-stay_open` protocol, but waiting for ExifTool suspends the calling
+    coroutine instead of blocking a thread, so one event loop can drive several workers
+    alongside other I/O. stdout and stderr are read concurrently until their ready markers.
+
+    Usage:
+        async with AsyncExifToolSession() as exiftool:
+            result = await exiftool.execute(['-overwrite_original', '-Title=foo', 'photo.jpg'])
+    """
+
+    def __init__(self, executable=DEFAULT_EXECUTABLE, timeout=600.0):
+        self.executable = executable
+        self.timeout = timeout
+        self._process = None
+        self._sequence = 0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.returncode is None
+
+    async def start(self):
+        """Start the ExifTool worker if it is not already running"""
+        if self.running:
+            return
+
+        cmd = [self.executable, '-stay_open', 'True', '-@', '-']
+        logger.debug(f"Starting async ExifTool worker: {' '.join(cmd)}")
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as e:
+            self._process = None
+            raise ExifToolError(f"Unable to start ExifTool ({self.executable}): {e}") from e
+        metrics.count('exiftool_spawns')
+
+    async def close(self):
+        """Ask the worker to exit, killing it if it does not comply"""
+        process, self._process = self._process, None
+        if process is None:
+            return
+
+        try:
+            if process.returncode is None:
+                process.stdin.write(b'-stay_open\nFalse\n')
+                await process.stdin.drain()
+                await asyncio.wait_for(process.wait(), timeout=10)
+        except (OSError, asyncio.TimeoutError):
+            process.kill()
+            await process.wait()
+
+    async def _kill(self):
+        process, self._process = self._process, None
+        if process is not None and process.returncode is None:
+            logger.warning(f"Killing unresponsive ExifTool worker (pid {process.pid})")
+            process.kill()
+            await process.wait()
+
+    async def execute(self, args):
+        """Run one ExifTool command block, see ExifToolSession.execute"""
+        return (await self.execute_many([args]))[0]
+
+    async def execute_many(self, blocks):
+        """Run several command blocks in one round trip, see ExifToolSession.execute_many"""
+        async with self._lock:
+            await self.start()
+            sequences = []
+            payload = []
+            for args in blocks:
+                self._sequence += 1
+                sequences.append(self._sequence)
+                payload.append(ExifToolSession._encode_block(args, self._sequence))
+
+            results = []
+            started = time.perf_counter()
+            try:
+                self._process.stdin.write(''.join(payload).encode('utf-8'))
+                await self._process.stdin.drain()
+                for sequence in sequences:
+                    results.append(await asyncio.wait_for(self._read_result(sequence), self.timeout))
+            except asyncio.CancelledError:
+                # The unread output of the blocks in flight would otherwise be taken for the next call's
+                await self._kill()
+                raise
+            except (OSError, ExifToolError, asyncio.TimeoutError) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = ExifToolError(f"no response from ExifTool within {self.timeout} seconds")
+                args = blocks[len(results)]
+                logger.error(f"ExifTool worker failed while processing {args[-1] if args else '<no args>'}: {e}")
+                await self._kill()
+                results.extend(ExifToolResult(-1, '', str(e)) for _ in blocks[len(results):])
+                metrics.count('exiftool_failures')
+            metrics.record('exiftool_wait', time.perf_counter() - started, len(blocks))
+
+            return results
+
+    async def _read_result(self, sequence):
+        stdout_marker = f'{{ready{sequence}}}'
+        status = None
+
+        def stderr_done(line):
+            nonlocal status
+            match = _STDERR_READY_RE.match(line)
+            if match and int(match.group(1)) == sequence:
+                status = match.group(2)
+                return True
+            return False
+
+        # Both pipes are read at once, so a chatty stderr can never stall stdout
+        stdout, stderr = await asyncio.gather(
+            self._read_until(self._process.stdout, lambda line: line == stdout_marker),
+            self._read_until(self._process.stderr, stderr_done)
+        )
+        return ExifToolResult(ExifToolSession._parse_status(status, stderr), stdout, stderr)
+
+    @staticmethod
+    async def _read_until(stream, is_marker):
+        collected = []
+        while True:
+            line = await stream.readline()
+            if not line:
+                raise ExifToolError("ExifTool worker exited unexpectedly")
+            line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+            if is_marker(line):
+                return '\n'.join(collected)
+            collected.append(line)
@@ -1,35 +1,387 @@
 import sys
-import os, zipfile, argparse
+import os, zipfile, argparse, queue, threading, shutil, re, zlib
+import metrics
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from date_manifest import DEFAULT_DATE_MANIFEST, DateManifest
+from exiftool_pool import JobSummary
 from logger_utils import Colors, setup_logging
+from metrics import add_metrics_arguments, setup_metrics
+from sidecar_index import SidecarPairer
+from state_db import DEFAULT_STATE_DB, StateDB, file_fingerprint
 
 logger = setup_logging(script_name='exif-embed-extract')
 
+_STREAM_DONE = object()
+
+# Extracted files are written through a large buffer to cut the number of write calls
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+# Archives bigger than this are split into member ranges that extract in parallel
+DEFAULT_CHUNK_SIZE = 1024 * 1024 * 1024
+
+_WINDOWS_ILLEGAL_CHARS = re.compile(r'[:<>|"?*]')
+
+def find_archives(zip_folder):
+    """Return the paths of the ZIP files in a folder, in name order"""
+    return [os.path.join(zip_folder, item) for item in sorted(os.listdir(zip_folder)) if item.endswith('.zip')]
+
+def member_target(extract_to, member):
+    """
+    Return the path a ZIP member extracts to, sanitized the same way zipfile.extract does
+    """
+    arcname = member.filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    parts = [part for part in arcname.split(os.path.sep) if part not in ('', os.path.curdir, os.path.pardir)]
+    if os.path.sep == '\\':
+        parts = [_WINDOWS_ILLEGAL_CHARS.sub('_', part).rstrip('.') for part in parts]
+        parts = [part for part in parts if part]
+    return os.path.join(extract_to, *parts)
+
+def extract_member(zip_ref, member, extract_to):
+    """
+    Extract a single ZIP member through a large write buffer and return its target path
+
+    The data goes to a temporary file that is renamed into place, so several workers writing
+    the same path (Takeout repeats some files across parts) never interleave their output.
+    """
+    target = member_target(extract_to, member)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_target = f"{target}.{os.getpid()}-{threading.get_ident()}.part"
+    try:
+        with metrics.timer('zip_extract'):
+            with zip_ref.open(member) as source, open(temp_target, 'wb', buffering=WRITE_BUFFER_SIZE) as destination:
+                shutil.copyfileobj(source, destination, WRITE_BUFFER_SIZE)
+            os.replace(temp_target, target)
+    except BaseException:
+        if os.path.exists(temp_target):
+            os.remove(temp_target)
+        raise
+    return target
+
+def file_crc32(path):
+    """Return the CRC32 of a file on disk, as stored in ZIP central directories"""
+    crc = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(WRITE_BUFFER_SIZE):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def member_digest(member):
+    """Return the state database digest identifying a ZIP member's contents"""
+    return f'crc32:{member.CRC:08x}'
+
+def plan_extraction(archives, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Split the archives into (archive_path, members) work units of roughly chunk_size compressed bytes
+    """
+    work = []
+    for file_path in archives:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            members = [member for member in zip_ref.infolist() if not member.is_dir()]
+
+        chunk, chunk_bytes = [], 0
+        for member in members:
+            chunk.append(member)
+            chunk_bytes += member.compress_size
+            if chunk_bytes >= chunk_size:
+                work.append((file_path, chunk))
+                chunk, chunk_bytes = [], 0
+        if chunk:
+            work.append((file_path, chunk))
+    return work
+
+def process_member(zip_ref, member, extract_to, recorded, incremental=False, verify=False):
+    """
+    Extract, skip or verify one ZIP member
+
+    recorded is the fingerprint the state database holds for the member's target, if any.
+    Returns (status, target, fingerprint) where status is 'extracted', 'skipped', 'verified'
+    or 'modified', and fingerprint is what should be recorded for the target (or None).
+    Raises if the member cannot be extracted or fails verification.
+    """
+    target = member_target(extract_to, member)
+    digest = member_digest(member)
+    exists = os.path.isfile(target)
+
+    if verify:
+        if not exists:
+            raise FileNotFoundError(f"missing from {extract_to}")
+        if os.path.getsize(target) == member.file_size and file_crc32(target) == member.CRC:
+            return 'verified', target, None
+        if recorded and recorded[2] == digest:
+            # Extracted intact earlier and rewritten since, e.g. by embedding metadata
+            return 'modified', target, None
+        raise ValueError(f"CRC mismatch against {member.filename}")
+
+    if incremental and exists:
+        if recorded and recorded[2] == digest:
+            return 'skipped', target, None
+        if os.path.getsize(target) == member.file_size and file_crc32(target) == member.CRC:
+            return 'skipped', target, file_fingerprint(target, digest)
+
+    extract_member(zip_ref, member, extract_to)
+    return 'extracted', target, file_fingerprint(target, digest)
+
+def extract_archives(archives, extract_to, jobs=1, chunk_size=DEFAULT_CHUNK_SIZE, state=None, incremental=False, verify=False):
+    """
+    Extract several archives at once, with large archives split into member ranges
+
+    With incremental, members whose target already holds the same contents (according to the
+    state database, or to the on-disk size and CRC32) are not extracted again. With verify,
+    nothing is written and every target is checked against the central directory CRC32.
+    Returns a JobSummary with one entry per member and the errors of any that failed.
+    """
+    work = plan_extraction(archives, chunk_size)
+    total_bytes = sum(member.file_size for _, members in work for member in members)
+    total_entries = sum(len(members) for _, members in work)
+    remaining = {}
+    for file_path, _ in work:
+        remaining[file_path] = remaining.get(file_path, 0) + 1
+    action = 'Verifying' if verify else 'Extracting'
+    logger.info(f"{action} {total_entries} entries from {len(archives)} archives with {jobs} workers")
+
+    summary = JobSummary()
+    lock = threading.Lock()
+    pbar = tqdm(total=total_bytes, desc=action, unit="B", unit_scale=True, unit_divisor=1024, dynamic_ncols=True)
+
+    def process_chunk(file_path, members):
+        fingerprints = []
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            for member, recorded in members:
+                try:
+                    status, target, fingerprint = process_member(zip_ref, member, extract_to, recorded, incremental, verify)
+                    error = None
+                except Exception as e:
+                    status, error = None, e
+                with lock:
+                    if error:
+                        summary.add_error(f"{file_path}:{member.filename}", str(error))
+                    elif status in ('extracted', 'verified'):
+                        summary.add_success()
+                    else:
+                        if status == 'modified':
+                            logger.debug(f"Modified since extraction: {target}")
+                        summary.add_skipped()
+                    pbar.update(member.file_size)
+                    pbar.set_postfix(entries=f"{summary.succeeded + summary.skipped + summary.failed}/{total_entries}", refresh=False)
+                if not error and fingerprint:
+                    fingerprints.append((target, fingerprint))
+        return fingerprints
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix='extract') as executor:
+            futures = {}
+            for file_path, members in work:
+                # Manifest lookups stay on this thread, which owns the database connection
+                members = [(member, state.get('extract', member_target(extract_to, member)) if state else None)
+                           for member in members]
+                futures[executor.submit(process_chunk, file_path, members)] = file_path
+
+            for future in as_completed(futures):
+                file_path = futures[future]
+                if state:
+                    for target, fingerprint in future.result():
+                        state.record('extract', target, fingerprint)
+                    state.commit()
+                else:
+                    future.result()
+                remaining[file_path] -= 1
+                if remaining[file_path] == 0:
+                    logger.info(f"{'Verified' if verify else 'Extracted'}: {file_path}")
+    finally:
+        pbar.close()
+
+    summary.log('Verified' if verify else 'Extracted')
+    return summary
+
+def stream_pairs(archives, extract_to, media_extensions, pair_queue, delete_archives=False, on_extracted=None,
+                 state_db=None, incremental=False, stop=None):
+    """
+    Extract archives entry by entry and put (media_path, json_path) pairs on pair_queue as soon as both exist
+
+    Media files and sidecars are paired across archive boundaries, since Takeout parts do not
+    keep them together. Media files that never get a sidecar are sent as (media_path, None)
+    once every archive has been read. The queue is bounded, so extraction pauses whenever
+    the embed stage falls behind. The last item put on the queue is _STREAM_DONE, or the
+    exception that stopped extraction. on_extracted is called with the path of every
+    extracted file.
+
+    With a state_db path, extracted files are recorded in the state database, through a
+    connection of this thread's own. With incremental, members whose target is unchanged
+    are not written again, so files embedded by an earlier run keep their embed fingerprint;
+    they are still paired and passed on. Setting the stop event ends extraction early.
+    """
+    state = StateDB(state_db) if state_db else None
+    try:
+        pairer = SidecarPairer()
+        for file_path in archives:
+            with zipfile.ZipFile(file_path, 'r') as zip_ref:
+                for member in zip_ref.infolist():
+                    if member.is_dir():
+                        continue
+                    if stop is not None and stop.is_set():
+                        pair_queue.put(_STREAM_DONE)
+                        return
+                    recorded = state.get('extract', member_target(extract_to, member)) if state else None
+                    status, target, fingerprint = process_member(zip_ref, member, extract_to, recorded, incremental)
+                    if status == 'skipped':
+                        metrics.count('extract_skipped')
+                    if state and fingerprint:
+                        state.record('extract', target, fingerprint)
+                        # Never hold the write lock while blocked on the queue, the embed stage writes too
+                        state.commit()
+                    if on_extracted:
+                        on_extracted(target)
+                    directory, name = os.path.split(target)
+                    if name.lower().endswith('.json'):
+                        with metrics.timer('sidecar_match', 0):
+                            pairs = pairer.add_sidecar(directory, name)
+                    elif name.lower().endswith(media_extensions):
+                        with metrics.timer('sidecar_match'):
+                            pairs = pairer.add_media(directory, name)
+                    else:
+                        continue
+                    for directory, media_file, json_file in pairs:
+                        pair_queue.put((os.path.join(directory, media_file), os.path.join(directory, json_file)))
+            logger.info(f"Extracted: {file_path}")
+
+            if delete_archives:
+                os.remove(file_path)
+                logger.info(f"Deleted archive: {file_path}")
+
+        with metrics.timer('sidecar_match', 0):
+            pairs, unmatched = pairer.finish()
+        for directory, media_file, json_file in pairs:
+            pair_queue.put((os.path.join(directory, media_file), os.path.join(directory, json_file)))
+        for directory, media_file in unmatched:
+            pair_queue.put((os.path.join(directory, media_file), None))
+        pair_queue.put(_STREAM_DONE)
+    except Exception as e:
+        pair_queue.put(e)
+    finally:
+        if state:
+            state.close()
+
+def iter_queue(pair_queue):
+    """Yield items from the queue filled by stream_pairs until it signals completion"""
+    while True:
+        item = pair_queue.get()
+        if item is _STREAM_DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def drain_queue(pair_queue, producer):
+    """Discard what the producer thread puts on a bounded queue until it exits, so it never blocks on a full one"""
+    while producer.is_alive():
+        try:
+            pair_queue.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+def stream_extract_and_embed(archives, extract_to, jobs=1, batch_size=32, state=None, resume=True, delete_archives=False,
+                             engine='exiftool', manifest=None, incremental=False):
+    """
+    Extract archives and embed metadata at the same time, handing finished pairs over through a bounded queue
+
+    With incremental, members already extracted unchanged are not written again (see stream_pairs).
+    """
+    # Imported here so plain extraction keeps working without the embed dependencies
+    import embed
+
+    pair_queue = queue.Queue(maxsize=max(1, jobs) * batch_size * 2)
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=stream_pairs,
+        args=(archives, extract_to, embed.MEDIA_EXTENSIONS, pair_queue, delete_archives),
+        kwargs={'state_db': state.path if state else None, 'incremental': incremental, 'stop': stop},
+        name='zip-stream',
+        daemon=True
+    )
+    producer.start()
+    try:
+        summary = embed.embed_pairs(iter_queue(pair_queue), jobs, batch_size, state, resume, engine, manifest)
+    except BaseException:
+        # Unblock the producer if it is waiting on the full queue, and let it finish
+        stop.set()
+        drain_queue(pair_queue, producer)
+        raise
+    finally:
+        producer.join()
+    embed.cleanup_files(extract_to)
+    return summary
+
 def main():
     # Set up command-line argument parsing
     parser = argparse.ArgumentParser(description='Extract ZIP files from source folder to target folder')
-    parser.add_argument('--source', '-s', 
-                       default='./zips', 
+    parser.add_argument('--source', '-s',
+                       default='./zips',
                        help='Source folder containing ZIP files (default: ./zips)')
-    parser.add_argument('--target', '-t', 
-                       default='./extracts', 
+    parser.add_argument('--target', '-t',
+                       default='./extracts',
                        help='Target folder for extraction (default: ./extracts)')
-    
+    parser.add_argument('--stream',
+                       action='store_true',
+                       help='Embed metadata while extracting, as soon as each media file and its sidecar are on disk')
+    parser.add_argument('--delete-archives',
+                       action='store_true',
+                       help='With --stream, delete each ZIP file once it has been fully extracted')
+    parser.add_argument('--engine',
+                       choices=('exiftool', 'native'),
+                       default='exiftool',
+                       help='With --stream, the metadata writer used for embedding; native patches movies in place without a temporary copy, see embed.py --help (default: exiftool)')
+    parser.add_argument('--jobs', '-j',
+                       type=int,
+                       default=1,
+                       help='Number of archives or archive ranges extracted in parallel; with --stream, '
+                            'the number of parallel ExifTool workers instead (default: 1)')
+    parser.add_argument('--chunk-size',
+                       type=int,
+                       default=DEFAULT_CHUNK_SIZE // (1024 * 1024),
+                       help=f'Split archives into ranges of this many compressed MB for parallel extraction '
+                            f'(default: {DEFAULT_CHUNK_SIZE // (1024 * 1024)})')
+    parser.add_argument('--incremental', '-i',
+                       action='store_true',
+                       help='Only extract members that are missing on disk or whose size/CRC32 changed')
+    parser.add_argument('--verify',
+                       action='store_true',
+                       help='Check extracted files against the archive CRC32s without writing anything')
+    parser.add_argument('--state-db',
+                       default=DEFAULT_STATE_DB,
+                       help=f'SQLite database recording extracted and embedded files (default: {DEFAULT_STATE_DB})')
+    parser.add_argument('--date-manifest',
+                       default=DEFAULT_DATE_MANIFEST,
+                       help=f'With --stream, binary manifest of embedded dates read by update_creation_date.py '
+                            f'(default: {DEFAULT_DATE_MANIFEST})')
+    add_metrics_arguments(parser)
+
     args = parser.parse_args()
+    if args.stream and args.verify:
+        parser.error('--verify checks an earlier extraction and cannot be combined with --stream')
+    setup_metrics(args, 'extract')
     zip_folder = args.source
     extract_to = args.target
 
     try:
         logger.info(f"Unzipping files in {Colors.CYAN}{zip_folder}{Colors.RESET}")
- 
-        for item in os.listdir(zip_folder):
-            if item.endswith('.zip'):
-                file_path = os.path.join(zip_folder, item)
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_to)
-                logger.info(f"Extracted: {file_path}")
+
+        with StateDB(args.state_db) as state:
+            if args.stream:
+                manifest = DateManifest(args.date_manifest)
+                stream_extract_and_embed(find_archives(zip_folder), extract_to, jobs=args.jobs, state=state,
+                                         delete_archives=args.delete_archives, engine=args.engine, manifest=manifest,
+                                         incremental=args.incremental)
+                manifest.save()
+            else:
+                extract_archives(find_archives(zip_folder), extract_to, jobs=args.jobs,
+                                 chunk_size=args.chunk_size * 1024 * 1024, state=state,
+                                 incremental=args.incremental, verify=args.verify)
 
         logger.info(f"Unzipped files to {Colors.CYAN}{extract_to}{Colors.RESET}")
-        
+
     except Exception as e:
         logger.error(f"Process failed: {str(e)}")
 
@@ -38,6 +390,6 @@ if __name__ == "__main__":
     # Enable Windows color support
     if os.name == 'nt':
         os.system('color')
-        
+
     # Run the main program
     sys.exit(main())
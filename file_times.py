@@ -0,0 +1,146 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import sys
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from exiftool_batch import batched
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 256
+# Number of failures listed individually in the final error report
+MAX_REPORTED_FAILURES = 20
+
+
+def _set_windows(path, when):
+    """Set the creation time through the Win32 API; access and modification times are left alone"""
+    # Imported lazily so the module also loads where pywin32 is not installed
+    import pywintypes
+    import win32con
+    import win32file
+
+    handle = win32file.CreateFile(
+        path,
+        win32con.GENERIC_WRITE,
+        win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
+        None,
+        win32con.OPEN_EXISTING,
+        win32con.FILE_ATTRIBUTE_NORMAL,
+        None
+    )
+    try:
+        win32file.SetFileTime(handle, pywintypes.Time(when), None, None)
+    finally:
+        handle.close()
+
+
+class _AttrList(ctypes.Structure):
+    _fields_ = [
+        ('bitmapcount', ctypes.c_ushort),
+        ('reserved', ctypes.c_uint16),
+        ('commonattr', ctypes.c_uint32),
+        ('volattr', ctypes.c_uint32),
+        ('dirattr', ctypes.c_uint32),
+        ('fileattr', ctypes.c_uint32),
+        ('forkattr', ctypes.c_uint32),
+    ]
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+_ATTR_BIT_MAP_COUNT = 5
+_ATTR_CMN_CRTIME = 0x00000200
+_libc = None
+
+
+def _set_birthtime_macos(path, timestamp):
+    """Set the birth time with setattrlist(2), which APFS and HFS+ support"""
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    attributes = _AttrList(bitmapcount=_ATTR_BIT_MAP_COUNT, commonattr=_ATTR_CMN_CRTIME)
+    value = _Timespec(int(timestamp), int((timestamp % 1) * 1e9))
+    if _libc.setattrlist(os.fsencode(path), ctypes.byref(attributes), ctypes.byref(value), ctypes.sizeof(value), 0) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), path)
+
+
+def _set_posix(path, when):
+    """
+    Set the access and modification times, plus the birth time on macOS
+
+    Most Linux filesystems keep a birth time but offer no way to set it, so the
+    modification time is what file browsers and photo tools sort by there.
+    """
+    timestamp = when.timestamp()
+    if sys.platform == 'darwin':
+        _set_birthtime_macos(path, timestamp)
+    os.utime(path, (timestamp, timestamp))
+
+
+set_creation_time = _set_windows if os.name == 'nt' else _set_posix
+set_creation_time.__doc__ = "Set the creation time of a file to the naive local datetime `when`"
+
+
+def creation_time(stat):
+    """
+    Return the timestamp set_creation_time last set, from a stat result or inventory FileEntry
+
+    On POSIX st_ctime is the inode change time, which any write bumps, so the modification
+    time that _set_posix always sets is read instead.
+    """
+    if os.name == 'nt':
+        return stat.st_ctime
+    return stat.st_mtime_ns / 1e9
+
+
+def set_creation_times(items):
+    """
+    Set the creation time of every (path, datetime) item in order
+
+    Returns a list of (path, error message) for the files that could not be updated
+    """
+    failures = []
+    with metrics.timer('timestamp_set', len(items)):
+        for path, when in items:
+            try:
+                set_creation_time(path, when)
+            except Exception as e:
+                # Broad on purpose: pywintypes.error does not derive from OSError
+                failures.append((path, str(e)))
+    metrics.count('timestamp_failures', len(failures))
+    return failures
+
+
+def apply_creation_times(items, jobs=4, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Set the creation times of many (path, datetime) items from a thread pool
+
+    Items are handed to the workers in batches, so the per-file cost is just the system
+    calls. Returns the combined list of (path, error message) failures; pass it to
+    log_failures() to report them once.
+    """
+    batches = list(batched(items, batch_size))
+    if jobs <= 1 or len(batches) <= 1:
+        return [failure for batch in batches for failure in set_creation_times(batch)]
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='file-times') as executor:
+        for batch_failures in executor.map(set_creation_times, batches):
+            failures.extend(batch_failures)
+    return failures
+
+
+def log_failures(failures, action='set creation date of'):
+    """Log a single error report for the files whose timestamps could not be set"""
+    if not failures:
+        return
+    logger.error(f"Failed to {action} {len(failures)} files:")
+    for path, message in failures[:MAX_REPORTED_FAILURES]:
+        logger.error(f"  {path}: {message}")
+    if len(failures) > MAX_REPORTED_FAILURES:
+        logger.error(f"  ... and {len(failures) - MAX_REPORTED_FAILURES} more")
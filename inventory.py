@@ -0,0 +1,330 @@
+import logging
+import os
+import struct
+import threading
+import time
+import metrics
+from state_db import DEFAULT_STATE_DB
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INVENTORY = os.path.join(os.path.dirname(DEFAULT_STATE_DB), 'inventory.bin')
+
+_MAGIC = b'EXIFINV\x01'
+# Root record: UTF-8 root path length, then the path
+_ROOT = struct.Struct('<H')
+# Per directory: mtime_ns, file count, subdirectory count, UTF-8 relative path length, then the path
+_DIRECTORY = struct.Struct('<qIIH')
+# Per file: size, mtime_ns, ctime_ns, UTF-8 name length, then the name
+_FILE = struct.Struct('<QqqH')
+# Per subdirectory: UTF-8 name length, then the name
+_NAME = struct.Struct('<H')
+
+
+def _key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class FileEntry:
+    """
+    Cached stat of a single file
+
+    Exposes the st_size / st_mtime_ns / st_ctime fields of os.stat_result, so an entry can
+    be passed anywhere a stat result is expected, e.g. file_fingerprint(path, stat=entry).
+    """
+
+    __slots__ = ('path', 'name', 'st_size', 'st_mtime_ns', 'st_ctime_ns')
+
+    def __init__(self, path, name, st_size, st_mtime_ns, st_ctime_ns):
+        self.path = path
+        self.name = name
+        self.st_size = st_size
+        self.st_mtime_ns = st_mtime_ns
+        self.st_ctime_ns = st_ctime_ns
+
+    def __repr__(self):
+        return f"FileEntry({self.path!r}, size={self.st_size}, mtime_ns={self.st_mtime_ns})"
+
+    @property
+    def st_ctime(self):
+        return self.st_ctime_ns / 1e9
+
+    @classmethod
+    def from_stat(cls, path, name, stat):
+        return cls(path, name, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+
+
+class _Directory:
+    __slots__ = ('path', 'mtime_ns', 'files', 'subdirs')
+
+    def __init__(self, path, mtime_ns, files, subdirs):
+        self.path = path
+        # None for a directory built up with Inventory.add(), whose listing was never read
+        self.mtime_ns = mtime_ns
+        # name -> FileEntry, in scandir order
+        self.files = files
+        self.subdirs = subdirs
+
+
+def _scan_directory(path):
+    """List one directory with os.scandir, returning a _Directory"""
+    files = {}
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                # Like os.walk, symlinked directories are not followed
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    # DirEntry caches the stat; on Windows it comes with the listing itself
+                    files[entry.name] = FileEntry.from_stat(entry.path, entry.name, entry.stat())
+            except OSError as e:
+                logger.warning(f"Skipping {entry.path}: {e}")
+    return _Directory(path, os.stat(path).st_mtime_ns, files, subdirs)
+
+
+class Inventory:
+    """
+    Single-pass listing of every file under a root folder, with its stat cached
+
+    Each pipeline stage reads the tree from the inventory instead of walking it again and
+    stat'ing every file, and keeps it current as it moves, removes or rewrites files.
+    Saved to disk, it is reused by the next stage or run: only directories whose mtime
+    changed since (i.e. had entries added, removed or renamed) are listed again, so files
+    edited in place by other tools are not noticed.
+
+    Usage:
+        inventory = Inventory.scan('./extracts')
+        for directory, entries in inventory.walk():
+            ...
+        inventory.save(DEFAULT_INVENTORY)
+    """
+
+    def __init__(self, root, directories=None):
+        self.root = root
+        # normcase(abspath(directory)) -> _Directory, in top-down walk order
+        self._directories = directories if directories is not None else {}
+        # Guards changes to the directory map, which the pipeline makes from several threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(directory.files) for directory in self._directories.values())
+
+    @classmethod
+    def scan(cls, root, previous=None):
+        """
+        Scan the tree under root with os.scandir
+
+        Directories of a previous inventory whose mtime is unchanged are reused as they
+        are, at the cost of a single stat per directory.
+        """
+        previous = previous._directories if previous is not None else {}
+        directories = {}
+        reused = 0
+        started = time.perf_counter()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                directory = previous.get(_key(path))
+                if directory is not None and os.stat(path).st_mtime_ns == directory.mtime_ns:
+                    reused += 1
+                else:
+                    directory = _scan_directory(path)
+            except OSError as e:
+                logger.warning(f"Skipping directory {path}: {e}")
+                continue
+            directories[_key(path)] = directory
+            # Reversed, so directories are visited top-down in listing order like os.walk
+            stack.extend(os.path.join(path, name) for name in reversed(directory.subdirs))
+
+        inventory = cls(root, directories)
+        metrics.record('inventory_scan', time.perf_counter() - started, len(inventory))
+        logger.debug(f"Inventoried {len(inventory)} files in {len(directories)} directories under {root} "
+                     f"({reused} directories unchanged)")
+        return inventory
+
+    @classmethod
+    def load(cls, path, root):
+        """
+        Load the inventory saved at path and bring it up to date for root
+
+        Falls back to a full scan if there is no saved inventory, or it does not cover root.
+        """
+        if not os.path.exists(path):
+            return cls.scan(root)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(_MAGIC):
+            logger.warning(f"Ignoring unrecognized inventory {path}")
+            return cls.scan(root)
+
+        offset = len(_MAGIC)
+        (length,) = _ROOT.unpack_from(data, offset)
+        offset += _ROOT.size
+        saved_root = data[offset:offset + length].decode('utf-8')
+        offset += length
+        try:
+            inside = os.path.commonpath([_key(saved_root), _key(root)]) == _key(saved_root)
+        except ValueError:
+            inside = False
+        if not inside:
+            logger.debug(f"Inventory {path} covers {saved_root}, not {root}; scanning again")
+            return cls.scan(root)
+
+        directories = {}
+        while offset + _DIRECTORY.size <= len(data):
+            mtime_ns, file_count, subdir_count, length = _DIRECTORY.unpack_from(data, offset)
+            offset += _DIRECTORY.size
+            relative = data[offset:offset + length].decode('utf-8')
+            offset += length
+            directory_path = os.path.join(saved_root, relative) if relative else saved_root
+            files = {}
+            for _ in range(file_count):
+                size, file_mtime_ns, ctime_ns, length = _FILE.unpack_from(data, offset)
+                offset += _FILE.size
+                name = data[offset:offset + length].decode('utf-8')
+                offset += length
+                files[name] = FileEntry(os.path.join(directory_path, name), name, size, file_mtime_ns, ctime_ns)
+            subdirs = []
+            for _ in range(subdir_count):
+                (length,) = _NAME.unpack_from(data, offset)
+                offset += _NAME.size
+                subdirs.append(data[offset:offset + length].decode('utf-8'))
+                offset += length
+            directories[_key(directory_path)] = _Directory(directory_path, mtime_ns, files, subdirs)
+
+        logger.debug(f"Loaded inventory of {len(directories)} directories from {path}")
+        return cls.scan(saved_root, previous=cls(saved_root, directories))
+
+    def save(self, path=DEFAULT_INVENTORY):
+        """Write the inventory atomically, replacing the previous version"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        for directory in self._snapshot():
+            if directory.mtime_ns is None:
+                self._touch(directory)
+        root = self.root.encode('utf-8')
+        records = [_MAGIC, _ROOT.pack(len(root)), root]
+        for directory in self._snapshot():
+            relative = os.path.relpath(directory.path, self.root)
+            relative = b'' if relative == os.curdir else relative.encode('utf-8')
+            records.append(_DIRECTORY.pack(directory.mtime_ns or 0, len(directory.files), len(directory.subdirs), len(relative)))
+            records.append(relative)
+            for entry in directory.files.values():
+                name = entry.name.encode('utf-8')
+                records.append(_FILE.pack(entry.st_size, entry.st_mtime_ns, entry.st_ctime_ns, len(name)))
+                records.append(name)
+            for subdir in directory.subdirs:
+                name = subdir.encode('utf-8')
+                records.append(_NAME.pack(len(name)))
+                records.append(name)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(b''.join(records))
+        os.replace(temp_path, path)
+        logger.debug(f"Saved inventory of {len(self)} files to {path}")
+
+    def walk(self, top=None):
+        """
+        Yield a (directory path, list of FileEntry) tuple for every directory under top, top-down
+
+        top defaults to the inventory root. The lists are copies, so the caller can move or
+        remove files while walking.
+        """
+        prefix = _key(top) if top is not None else _key(self.root)
+        with self._lock:
+            directories = list(self._directories.items())
+        for key, directory in directories:
+            if key == prefix or key.startswith(prefix.rstrip(os.sep) + os.sep):
+                yield directory.path, list(directory.files.values())
+
+    def files(self, top=None):
+        """Yield the FileEntry of every file under top"""
+        for _, entries in self.walk(top):
+            yield from entries
+
+    def names(self, directory):
+        """Return the file names in a directory as a set, or an empty set if it is not inventoried"""
+        directory = self._directories.get(_key(directory))
+        return set(directory.files) if directory else set()
+
+    def get(self, path):
+        """Return the cached FileEntry of a file, or None if it is not in the inventory"""
+        directory = self._directories.get(_key(os.path.dirname(path)))
+        return directory.files.get(os.path.basename(path)) if directory else None
+
+    def stat(self, path):
+        """Return the cached FileEntry of a file, falling back to os.stat() if it is not inventoried"""
+        return self.get(path) or os.stat(path)
+
+    def exists(self, path):
+        return self.get(path) is not None
+
+    def add(self, path):
+        """
+        Add a file created after the scan, such as one just extracted, and return its FileEntry
+
+        Missing directories are added along with it, so an inventory can be built up file by
+        file while the tree is being written, starting from Inventory(root).
+        """
+        stat = os.stat(path)
+        name = os.path.basename(path)
+        with self._lock:
+            directory = self._directory_for(os.path.dirname(path))
+            entry = FileEntry.from_stat(os.path.join(directory.path, name), name, stat)
+            directory.files[name] = entry
+            directory.mtime_ns = None
+        return entry
+
+    def _directory_for(self, path):
+        directory = self._directories.get(_key(path))
+        if directory is not None:
+            return directory
+        if _key(path) != _key(self.root):
+            parent_path = os.path.dirname(path)
+            if parent_path == path:
+                raise ValueError(f"{path} is not under {self.root}")
+            # The parent goes in first, keeping the map in top-down order
+            parent = self._directory_for(parent_path)
+            parent.subdirs.append(os.path.basename(path))
+            parent.mtime_ns = None
+        directory = _Directory(path, None, {}, [])
+        self._directories[_key(path)] = directory
+        return directory
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self._directories.values())
+
+    def refresh(self, path):
+        """Stat a file again after it was written, and return its updated FileEntry"""
+        directory = self._directories.get(_key(os.path.dirname(path)))
+        if directory is None:
+            return None
+        name = os.path.basename(path)
+        entry = FileEntry.from_stat(os.path.join(directory.path, name), name, os.stat(path))
+        directory.files[name] = entry
+        self._touch(directory)
+        return entry
+
+    def discard(self, path):
+        """Drop a file that was moved out of the tree or deleted"""
+        directory = self._directories.get(_key(os.path.dirname(path)))
+        if directory is not None and directory.files.pop(os.path.basename(path), None) is not None:
+            self._touch(directory)
+
+    @staticmethod
+    def _touch(directory):
+        # Our own changes can update the directory mtime; keep the cached listing valid
+        try:
+            directory.mtime_ns = os.stat(directory.path).st_mtime_ns
+        except OSError:
+            pass
+
+
+def load_inventory(root, path=None):
+    """Scan root in memory, or reuse and update the inventory saved at path"""
+    if path:
+        return Inventory.load(path, root)
+    return Inventory.scan(root)
@@ -0,0 +1,95 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DISK_LIMIT = 8
+DEFAULT_NETWORK_LIMIT = 2
+
+
+class IOScheduler:
+    """
+    Concurrency limits per resource class for the coroutines of one event loop
+
+    Work is tagged 'cpu' (ExifTool writes, JSON parsing), 'disk' (sidecar reads, stat and
+    timestamp calls) or 'network' (rclone). Each class has its own semaphore, so a backlog
+    of one kind of work never holds up the others: while ExifTool workers are busy, the
+    disk threads already read the next sidecars and stamp the previous batch, and an
+    upload can use the uplink at the same time.
+
+    Blocking functions are run with run() on the scheduler's own threads; coroutines that
+    wait on a subprocess hold a slot with `async with scheduler.limit(resource)`.
+
+    Usage:
+        async def main():
+            with IOScheduler(disk=16) as scheduler:
+                stat = await scheduler.run('disk', os.stat, path)
+        asyncio.run(main())
+    """
+
+    def __init__(self, cpu=None, disk=DEFAULT_DISK_LIMIT, network=DEFAULT_NETWORK_LIMIT):
+        self.limits = {'cpu': max(1, cpu or os.cpu_count() or 1), 'disk': max(1, disk), 'network': max(1, network)}
+        self._semaphores = {resource: asyncio.Semaphore(limit) for resource, limit in self.limits.items()}
+        self._active = dict.fromkeys(self.limits, 0)
+        self._peak = dict.fromkeys(self.limits, 0)
+        self._busy = dict.fromkeys(self.limits, 0.0)
+        self._executor = ThreadPoolExecutor(max_workers=self.limits['cpu'] + self.limits['disk'],
+                                            thread_name_prefix='io-scheduler')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.log()
+
+    @contextlib.asynccontextmanager
+    async def limit(self, resource):
+        """Hold one slot of a resource class for the duration of the block"""
+        async with self._semaphores[resource]:
+            self._active[resource] += 1
+            self._peak[resource] = max(self._peak[resource], self._active[resource])
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._active[resource] -= 1
+                self._busy[resource] += time.perf_counter() - started
+
+    async def run(self, resource, func, *args, **kwargs):
+        """Run a blocking function on the scheduler's threads within the limit of its resource class"""
+        async with self.limit(resource):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def stat(self, path):
+        return await self.run('disk', os.stat, path)
+
+    def log(self):
+        for resource, limit in self.limits.items():
+            logger.debug(f"{resource}: limit {limit}, peak {self._peak[resource]}, busy {self._busy[resource]:.1f}s in total")
+
+
+def add_scheduler_arguments(parser):
+    """Add the --async option and the per-resource limits to a stage's argument parser"""
+    group = parser.add_argument_group('asyncio mode')
+    group.add_argument('--async', dest='use_async', action='store_true',
+                       help='Drive ExifTool/rclone and file operations from a single asyncio event loop')
+    group.add_argument('--cpu-limit', type=int,
+                       help='With --async, the number of CPU-bound operations run at once (default: number of CPUs)')
+    group.add_argument('--disk-limit', type=int, default=DEFAULT_DISK_LIMIT,
+                       help=f'With --async, the number of file operations run at once (default: {DEFAULT_DISK_LIMIT})')
+    group.add_argument('--network-limit', type=int, default=DEFAULT_NETWORK_LIMIT,
+                       help=f'With --async, the number of uploads run at once (default: {DEFAULT_NETWORK_LIMIT})')
+
+
+def scheduler_from_args(args):
+    """Create the IOScheduler configured by the options of add_scheduler_arguments"""
+    return IOScheduler(args.cpu_limit, args.disk_limit, args.network_limit)
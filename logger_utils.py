@@ -63,15 +63,24 @@ class ColoredFormatter(logging.Formatter):
         
         return result
 
+_configured = False
+
 def setup_logging(script_name='script'):
     """Configure logging with proper formatting and file output
-    
+
+    Only the first call in a process configures the handlers, so a script that imports
+    another script's functions keeps logging to its own log file.
+
     Args:
         script_name (str): Name to use in the log file name
         
     Returns:
         logging.Logger: Configured logger instance
     """
+    global _configured
+    if _configured:
+        return logging.getLogger()
+
     log_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
     os.makedirs(log_directory, exist_ok=True)
     
@@ -97,5 +106,6 @@ def setup_logging(script_name='script'):
     file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     file_handler.setFormatter(file_formatter)
     logger.addHandler(file_handler)
-    
+
+    _configured = True
     return logger
@@ -0,0 +1,250 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from state_db import DEFAULT_STATE_DB
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_DIR = os.path.join(os.path.dirname(DEFAULT_STATE_DB), 'metrics')
+PROFILERS = ('cprofile', 'pyinstrument')
+# Operations listed in the log summary, slowest first
+LOGGED_OPERATIONS = 12
+
+_lock = threading.Lock()
+# operation -> [calls, items, seconds, max seconds]
+_timers = {}
+# event -> count
+_counters = {}
+_started = time.time()
+# (summary path, script name, Profiler or None) of the run set up by setup_metrics
+_run = None
+
+
+class _Timer:
+    __slots__ = ('name', 'items', 'start')
+
+    def __init__(self, name, items):
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.name, time.perf_counter() - self.start, self.items)
+
+
+def timer(name, items=1):
+    """
+    Time a block as one call of an operation that handled `items` files (or commands)
+
+    Usage:
+        with metrics.timer('json_load', len(paths)):
+            sidecars = load_sidecars(paths)
+    """
+    return _Timer(name, items)
+
+
+def record(name, seconds, items=1):
+    """Add one call of an operation that was timed elsewhere"""
+    with _lock:
+        entry = _timers.get(name)
+        if entry is None:
+            _timers[name] = [1, items, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += items
+            entry[2] += seconds
+            if seconds > entry[3]:
+                entry[3] = seconds
+
+
+def count(name, value=1):
+    """Increase an event counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def reset():
+    global _started
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+        _started = time.time()
+
+
+def snapshot(script=None):
+    """Return the collected metrics as a dict of plain values"""
+    with _lock:
+        timers = {name: {'calls': calls, 'items': items, 'seconds': round(seconds, 6), 'max_seconds': round(longest, 6)}
+                  for name, (calls, items, seconds, longest) in sorted(_timers.items())}
+        counters = dict(sorted(_counters.items()))
+    return {
+        'script': script,
+        'started': datetime.datetime.fromtimestamp(_started).isoformat(timespec='seconds'),
+        'elapsed': round(time.time() - _started, 3),
+        'timers': timers,
+        'counters': counters,
+    }
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus(summary):
+    """Render a snapshot() in the Prometheus text exposition format, for node_exporter's textfile collector"""
+    script = f'script="{_label(summary["script"] or "")}"'
+    lines = [
+        '# HELP exif_embed_run_seconds Duration of the run',
+        '# TYPE exif_embed_run_seconds gauge',
+        f'exif_embed_run_seconds{{{script}}} {summary["elapsed"]}',
+        '# HELP exif_embed_run_timestamp_seconds Time the run finished',
+        '# TYPE exif_embed_run_timestamp_seconds gauge',
+        f'exif_embed_run_timestamp_seconds{{{script}}} {time.time():.0f}',
+    ]
+    families = (
+        ('operation_seconds_total', 'counter', 'Time spent in an instrumented operation', 'seconds'),
+        ('operation_calls_total', 'counter', 'Number of times an operation ran', 'calls'),
+        ('operation_items_total', 'counter', 'Number of items (files, or ExifTool command blocks) an operation handled', 'items'),
+        ('operation_seconds_max', 'gauge', 'Longest single call of an operation', 'max_seconds'),
+    )
+    for family, kind, help_text, field in families:
+        lines += [f'# HELP exif_embed_{family} {help_text}', f'# TYPE exif_embed_{family} {kind}']
+        for name, values in summary['timers'].items():
+            lines.append(f'exif_embed_{family}{{{script},operation="{_label(name)}"}} {values[field]}')
+    lines += ['# HELP exif_embed_events_total Number of times an event occurred', '# TYPE exif_embed_events_total counter']
+    for name, value in summary['counters'].items():
+        lines.append(f'exif_embed_events_total{{{script},event="{_label(name)}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_summary(path, script=None):
+    """
+    Write the metrics collected so far to path, atomically
+
+    A path ending in .prom gets the Prometheus text format, anything else JSON.
+    """
+    summary = snapshot(script)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        if path.endswith('.prom'):
+            f.write(format_prometheus(summary))
+        else:
+            json.dump(summary, f, indent=2)
+    os.replace(temp_path, path)
+    return summary
+
+
+def log_summary(summary):
+    """Log the slowest operations and every counter at debug level"""
+    timers = sorted(summary['timers'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+    logger.debug(f"Metrics for {summary['elapsed']:.1f}s run:")
+    for name, values in timers[:LOGGED_OPERATIONS]:
+        per_item = values['seconds'] / values['items'] * 1000 if values['items'] else 0
+        logger.debug(f"  {name:<20} {values['seconds']:9.3f}s  {values['calls']:>8} calls  {values['items']:>9} items  "
+                     f"{per_item:8.3f} ms/item")
+    for name, value in summary['counters'].items():
+        logger.debug(f"  {name:<20} {value:>9}")
+
+
+class Profiler:
+    """
+    cProfile or pyinstrument session around a whole run
+
+    Both profile the thread they were started on; work done on pool threads shows up as
+    time spent waiting for it. cProfile writes a .pstats file (open it with pstats or
+    snakeviz), pyinstrument an HTML report.
+    """
+
+    def __init__(self, kind, output):
+        self.kind = kind
+        self.output = output
+        self._profiler = None
+
+    def start(self):
+        if self.kind == 'pyinstrument':
+            # Optional dependency, only needed for this profiler
+            from pyinstrument import Profiler as PyinstrumentProfiler
+            self._profiler = PyinstrumentProfiler()
+            self._profiler.start()
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        if self._profiler is None:
+            return
+        profiler, self._profiler = self._profiler, None
+        os.makedirs(os.path.dirname(os.path.abspath(self.output)), exist_ok=True)
+        if self.kind == 'pyinstrument':
+            profiler.stop()
+            with open(self.output, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            profiler.dump_stats(self.output)
+        logger.info(f"Wrote {self.kind} profile to {self.output}")
+
+
+def add_metrics_arguments(parser):
+    """Add the --metrics and --profile options to a script's argument parser"""
+    group = parser.add_argument_group('metrics')
+    group.add_argument('--metrics',
+                       help=f'File the run\'s timers and counters are written to, in Prometheus text format if it ends '
+                            f'in .prom and JSON otherwise (default: {DEFAULT_METRICS_DIR}{os.sep}<script>.json)')
+    group.add_argument('--profile', choices=PROFILERS,
+                       help='Profile the run with cProfile or pyinstrument (pyinstrument must be installed)')
+    group.add_argument('--profile-output',
+                       help=f'File the profile is written to '
+                            f'(default: {DEFAULT_METRICS_DIR}{os.sep}<script>.pstats, or .html for pyinstrument)')
+
+
+def setup_metrics(args, script):
+    """
+    Start collecting metrics for a script run configured by add_metrics_arguments
+
+    The summary is written, and the profiler stopped, by finish_metrics(), which runs when
+    the process exits unless it was called before.
+    """
+    global _run
+    # A run set up earlier in the same process, e.g. by a benchmark calling several stages
+    finish_metrics()
+    reset()
+    path = args.metrics or os.path.join(DEFAULT_METRICS_DIR, f'{script}.json')
+    profiler = None
+    if args.profile:
+        extension = '.html' if args.profile == 'pyinstrument' else '.pstats'
+        profiler = Profiler(args.profile, args.profile_output or os.path.join(DEFAULT_METRICS_DIR, f'{script}{extension}'))
+        try:
+            profiler.start()
+        except ImportError:
+            logger.error(f"{args.profile} is not installed; running without profiling")
+            profiler = None
+    _run = (path, script, profiler)
+    # Registered after logging's own exit handler, so it runs while logging still works
+    atexit.unregister(finish_metrics)
+    atexit.register(finish_metrics)
+
+
+def finish_metrics():
+    """Stop the profiler and write the summary of the run started by setup_metrics, once"""
+    global _run
+    if _run is None:
+        return
+    path, script, profiler = _run
+    _run = None
+    if profiler is not None:
+        profiler.stop()
+    try:
+        log_summary(write_summary(path, script))
+        logger.debug(f"Wrote metrics to {path}")
+    except OSError as e:
+        logger.warning(f"Unable to write metrics to {path}: {e}")
@@ -0,0 +1,626 @@
+"""
+In-process metadata writer for JPEG and QuickTime/MP4 files, used by `--engine native`
+
+Files and tags it cannot handle raise NativeWriteUnsupported, and the caller falls back
+to ExifTool. JPEGs, and movies whose moov atom has to grow, are written to a temporary
+file that replaces the original, like ExifTool does.
+
+Trade-off: when the new moov atom fits in the old one plus the free space after it, the
+movie is patched in place instead, so a multi-GB video costs a few KB of I/O rather than
+a full copy. There is no temporary copy on that path: a crash or power loss during the
+write (a few KB, flushed with fsync) can leave the video unplayable. Use the default
+ExifTool engine where that risk is not acceptable.
+"""
+import datetime
+import logging
+import os
+import re
+import shutil
+import struct
+import tempfile
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+# Files handled by the native writer; everything else goes to ExifTool
+NATIVE_EXTENSIONS = ('.jpg', '.jpeg', '.mp4', '.mov')
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+# Free space left after a rewritten moov atom so later edits can be patched in place
+MOOV_PADDING = 16 * 1024
+
+JPEG_TAGS = {
+    'Title', 'ImageDescription', 'DateTimeOriginal', 'CreateDate', 'ModifyDate',
+    'GPSLatitude', 'GPSLongitude', 'GPSLatitudeRef', 'GPSLongitudeRef', 'GPSAltitude',
+    'Make', 'Model', 'Software', 'Copyright', 'Artist',
+}
+# Keywords are left to ExifTool, which writes IPTC:Keywords; readers that only look at IPTC
+# would miss an XMP dc:subject, and both engines have to give the same result
+QUICKTIME_TAGS = JPEG_TAGS
+
+
+class NativeWriteUnsupported(Exception):
+    """Raised when a file or tag cannot be written natively and ExifTool should be used instead"""
+
+
+class NativeWriteResult:
+    """Outcome of a native metadata write"""
+
+    __slots__ = ('path', 'bytes_written', 'in_place')
+
+    def __init__(self, path, bytes_written, in_place=False):
+        self.path = path
+        self.bytes_written = bytes_written
+        self.in_place = in_place
+
+    def __repr__(self):
+        return f"NativeWriteResult(path={self.path!r}, bytes_written={self.bytes_written!r}, in_place={self.in_place!r})"
+
+
+def tags_from_args(args):
+    """
+    Extract the {tag: value} assignments from an ExifTool argument list
+
+    ['-overwrite_original', '-Title=foo', 'photo.jpg'] -> {'Title': 'foo'}
+    """
+    tags = {}
+    for arg in args:
+        if arg.startswith('-') and '=' in arg:
+            tag, value = arg[1:].split('=', 1)
+            tags[tag] = value
+    return tags
+
+
+def write_metadata(path, tags):
+    """
+    Write the tags into a media file without ExifTool
+
+    Only the metadata segments/atoms are rebuilt; the image or movie data is copied through
+    untouched, or not touched at all when a movie's metadata can be patched in place. The
+    file modification time is preserved, like `exiftool -preserve`.
+    Raises NativeWriteUnsupported if the format, the file layout or a tag is not supported.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jpg', '.jpeg'):
+        _check_tags(tags, JPEG_TAGS)
+        return _write_jpeg(path, tags)
+    if extension in ('.mp4', '.mov'):
+        _check_tags(tags, QUICKTIME_TAGS)
+        return _write_quicktime(path, tags)
+    raise NativeWriteUnsupported(f"no native writer for '{extension}' files")
+
+
+def _check_tags(tags, supported):
+    unsupported = set(tags) - supported
+    if unsupported:
+        raise NativeWriteUnsupported(f"tags not supported natively: {', '.join(sorted(unsupported))}")
+
+
+def _parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        raise NativeWriteUnsupported(f"unsupported date value '{value}'")
+
+
+def _signed_coordinate(value, ref, negative_ref):
+    coordinate = abs(float(value))
+    return -coordinate if ref == negative_ref or (not ref and float(value) < 0) else coordinate
+
+
+def _copy_range(source, destination, start, length):
+    source.seek(start)
+    remaining = length
+    while remaining > 0:
+        chunk = source.read(min(COPY_BUFFER_SIZE, remaining))
+        if not chunk:
+            raise NativeWriteUnsupported("file is shorter than its structure claims")
+        destination.write(chunk)
+        remaining -= len(chunk)
+    return length
+
+
+def _replace_file(path, write):
+    """
+    Write a new version of path through write(source, destination) and swap it into place
+
+    Returns the number of bytes written. Permissions and access/modification times of the
+    original file are kept.
+    """
+    stat = os.stat(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.exif-embed-', suffix='.tmp', dir=directory)
+    try:
+        with open(path, 'rb') as source, os.fdopen(fd, 'wb', buffering=COPY_BUFFER_SIZE) as destination:
+            write(source, destination)
+            bytes_written = destination.tell()
+        shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    return bytes_written
+
+
+# --- JPEG (APP1 EXIF + XMP) ---
+
+_SOI = b'\xff\xd8'
+_SOS = 0xDA
+_APP0 = 0xE0
+_APP1 = 0xE1
+_EXIF_HEADER = b'Exif\x00\x00'
+_XMP_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+_DC_NAMESPACE = 'http://purl.org/dc/elements/1.1/'
+_DC_DESCRIPTION_START = f'<rdf:Description rdf:about="" xmlns:dc="{_DC_NAMESPACE}">'
+# Earlier versions also wrote the keywords as dc:subject
+_NATIVE_DC_PROPERTIES = r'(?:<dc:title>.*?</dc:title>)?(?:<dc:subject>.*?</dc:subject>)?'
+_MAX_SEGMENT_PAYLOAD = 0xFFFF - 2
+
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+_BYTE, _ASCII, _LONG, _RATIONAL, _UNDEFINED = 1, 2, 4, 5, 7
+
+_EXIF_IFD_POINTER = 0x8769
+_GPS_IFD_POINTER = 0x8825
+
+_IFD0_TAGS = {
+    'ImageDescription': 0x010E,
+    'Make': 0x010F,
+    'Model': 0x0110,
+    'Software': 0x0131,
+    'ModifyDate': 0x0132,
+    'Artist': 0x013B,
+    'Copyright': 0x8298,
+}
+_EXIF_TAGS = {
+    'DateTimeOriginal': 0x9003,
+    'CreateDate': 0x9004,
+}
+
+
+def _read_jpeg_segments(f):
+    """Return ([(marker, payload)], offset of the SOS marker) for the header part of a JPEG"""
+    if f.read(2) != _SOI:
+        raise NativeWriteUnsupported("not a JPEG file")
+    segments = []
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise NativeWriteUnsupported("corrupt JPEG segment marker")
+        while marker[1] == 0xFF:
+            marker = b'\xff' + f.read(1)
+        code = marker[1]
+        if code == _SOS:
+            return segments, f.tell() - 2
+        if code == 0x01 or 0xD0 <= code <= 0xD7:
+            segments.append((code, None))
+            continue
+        if code == 0xD9:
+            raise NativeWriteUnsupported("JPEG ends before image data")
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            raise NativeWriteUnsupported("truncated JPEG segment")
+        length = struct.unpack('>H', length_bytes)[0]
+        payload = f.read(length - 2)
+        if len(payload) != length - 2:
+            raise NativeWriteUnsupported("truncated JPEG segment")
+        segments.append((code, payload))
+
+
+def _encode_segment(code, payload):
+    if payload is None:
+        return bytes([0xFF, code])
+    if len(payload) > _MAX_SEGMENT_PAYLOAD:
+        raise NativeWriteUnsupported("metadata does not fit in a single JPEG segment")
+    return bytes([0xFF, code]) + struct.pack('>H', len(payload) + 2) + payload
+
+
+def _ascii(value):
+    return _ASCII, len(value.encode('utf-8')) + 1, value.encode('utf-8') + b'\x00'
+
+
+def _rationals(values, endian, denominator=10000):
+    data = b''.join(struct.pack(endian + 'II', int(round(value * denominator)), denominator) for value in values)
+    return _RATIONAL, len(values), data
+
+
+def _dms(value):
+    value = abs(float(value))
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = (value - degrees - minutes / 60) * 3600
+    return [degrees, minutes, max(0.0, seconds)]
+
+
+def _parse_ifd(tiff, offset, endian):
+    """Return ({tag: (type, count, raw 4 byte field)}, next IFD offset) for the IFD at offset"""
+    if offset + 2 > len(tiff):
+        raise NativeWriteUnsupported("EXIF IFD points outside the segment")
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    end = offset + 2 + count * 12
+    if end + 4 > len(tiff):
+        raise NativeWriteUnsupported("truncated EXIF IFD")
+    entries = {}
+    for i in range(count):
+        tag, type_, value_count = struct.unpack_from(endian + 'HHI', tiff, offset + 2 + i * 12)
+        entries[tag] = ('raw', type_, value_count, tiff[offset + 10 + i * 12:offset + 14 + i * 12])
+    return entries, struct.unpack_from(endian + 'I', tiff, end)[0]
+
+
+def _build_ifd(entries, start, next_offset, endian):
+    """Serialize an IFD placed at offset start, with its out-of-line values right after it"""
+    data_offset = start + 2 + len(entries) * 12 + 4
+    body = bytearray(struct.pack(endian + 'H', len(entries)))
+    data = bytearray()
+    for tag in sorted(entries):
+        kind, type_, count, value = entries[tag]
+        if kind == 'raw' or len(value) <= 4:
+            field = value.ljust(4, b'\x00')
+        else:
+            field = struct.pack(endian + 'I', data_offset + len(data))
+            data += value
+            if len(data) % 2:
+                data += b'\x00'
+        body += struct.pack(endian + 'HHI', tag, type_, count) + field
+    body += struct.pack(endian + 'I', next_offset)
+    return bytes(body + data)
+
+
+def _pad(data):
+    return data + b'\x00' if len(data) % 2 else data
+
+
+def _build_exif(original, tags):
+    """
+    Return a new APP1 EXIF payload with the tags applied
+
+    The original TIFF block is kept byte for byte and the modified IFDs are appended after
+    it, so every offset into the original data (maker notes, thumbnails, interoperability
+    IFDs) stays valid. The IFDs they replace stay behind as unused data, so every rewrite of
+    the same file (--force re-runs) grows the segment, until it no longer fits in 64 KB and
+    the file falls back to ExifTool.
+    """
+    if original:
+        tiff = original[len(_EXIF_HEADER):]
+        if tiff[:4] == b'II*\x00':
+            endian = '<'
+        elif tiff[:4] == b'MM\x00*':
+            endian = '>'
+        else:
+            raise NativeWriteUnsupported("unrecognized EXIF byte order")
+        ifd0, next_ifd = _parse_ifd(tiff, struct.unpack_from(endian + 'I', tiff, 4)[0], endian)
+    else:
+        endian = '>'
+        tiff = b'MM\x00*' + struct.pack('>I', 8)
+        ifd0, next_ifd = {}, 0
+
+    def sub_ifd(pointer_tag):
+        if pointer_tag not in ifd0:
+            return {}
+        offset = struct.unpack(endian + 'I', ifd0[pointer_tag][3])[0]
+        return _parse_ifd(tiff, offset, endian)[0]
+
+    exif_ifd = sub_ifd(_EXIF_IFD_POINTER)
+    gps_ifd = sub_ifd(_GPS_IFD_POINTER)
+    exif_changed = gps_changed = False
+
+    for name, tag in _IFD0_TAGS.items():
+        if tags.get(name):
+            ifd0[tag] = ('data',) + _ascii(tags[name])
+    for name, tag in _EXIF_TAGS.items():
+        if tags.get(name):
+            exif_ifd[tag] = ('data',) + _ascii(_parse_date(tags[name]).strftime('%Y:%m:%d %H:%M:%S'))
+            exif_changed = True
+    if exif_changed and 0x9000 not in exif_ifd:
+        exif_ifd[0x9000] = ('data', _UNDEFINED, 4, b'0232')
+
+    if tags.get('GPSLatitude') and tags.get('GPSLongitude'):
+        latitude = _signed_coordinate(tags['GPSLatitude'], tags.get('GPSLatitudeRef'), 'S')
+        longitude = _signed_coordinate(tags['GPSLongitude'], tags.get('GPSLongitudeRef'), 'W')
+        gps_ifd[0x0000] = ('data', _BYTE, 4, bytes([2, 3, 0, 0]))
+        gps_ifd[0x0001] = ('data',) + _ascii('S' if latitude < 0 else 'N')
+        gps_ifd[0x0002] = ('data',) + _rationals(_dms(latitude), endian)
+        gps_ifd[0x0003] = ('data',) + _ascii('W' if longitude < 0 else 'E')
+        gps_ifd[0x0004] = ('data',) + _rationals(_dms(longitude), endian)
+        gps_changed = True
+    if tags.get('GPSAltitude'):
+        altitude = float(tags['GPSAltitude'])
+        gps_ifd[0x0005] = ('data', _BYTE, 1, bytes([1 if altitude < 0 else 0]))
+        gps_ifd[0x0006] = ('data',) + _rationals([abs(altitude)], endian, 1000)
+        gps_changed = True
+
+    # Lay out IFD0, then the rewritten sub-IFDs, after the original block. Pointer values are
+    # 4 byte inline fields, so the sizes are known before the offsets are filled in.
+    if exif_changed:
+        ifd0[_EXIF_IFD_POINTER] = ('data', _LONG, 1, b'\x00' * 4)
+    if gps_changed:
+        ifd0[_GPS_IFD_POINTER] = ('data', _LONG, 1, b'\x00' * 4)
+    base = _pad(tiff)
+    ifd0_start = len(base)
+    exif_start = ifd0_start + len(_pad(_build_ifd(ifd0, ifd0_start, next_ifd, endian)))
+    exif_block = _pad(_build_ifd(exif_ifd, exif_start, 0, endian)) if exif_changed else b''
+    gps_start = exif_start + len(exif_block)
+    gps_block = _pad(_build_ifd(gps_ifd, gps_start, 0, endian)) if gps_changed else b''
+    if exif_changed:
+        ifd0[_EXIF_IFD_POINTER] = ('data', _LONG, 1, struct.pack(endian + 'I', exif_start))
+    if gps_changed:
+        ifd0[_GPS_IFD_POINTER] = ('data', _LONG, 1, struct.pack(endian + 'I', gps_start))
+    ifd0_block = _pad(_build_ifd(ifd0, ifd0_start, next_ifd, endian))
+
+    header = base[:4] + struct.pack(endian + 'I', ifd0_start) + base[8:]
+    return _EXIF_HEADER + header + ifd0_block + exif_block + gps_block
+
+
+def _build_xmp(original, tags):
+    """Return a new APP1 XMP payload carrying the title, or the original if none is set"""
+    properties = []
+    if tags.get('Title'):
+        properties.append(f'<dc:title><rdf:Alt><rdf:li xml:lang="x-default">{escape(tags["Title"])}</rdf:li></rdf:Alt></dc:title>')
+    if not properties:
+        return original
+
+    description = f'{_DC_DESCRIPTION_START}{"".join(properties)}</rdf:Description>'
+    if original:
+        packet = original[len(_XMP_HEADER):].decode('utf-8', errors='strict')
+        # Replace a description written by an earlier native run (only dc:title/dc:subject);
+        # any other Dublin Core properties would need a real RDF merge
+        packet = re.sub(re.escape(_DC_DESCRIPTION_START) + _NATIVE_DC_PROPERTIES + r'</rdf:Description>', '', packet)
+        if _DC_NAMESPACE in packet or '</rdf:RDF>' not in packet:
+            raise NativeWriteUnsupported("existing XMP packet cannot be extended natively")
+        packet = packet.replace('</rdf:RDF>', description + '</rdf:RDF>', 1)
+    else:
+        packet = (
+            '<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+            '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+            '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+            f'{description}'
+            '</rdf:RDF></x:xmpmeta><?xpacket end="w"?>'
+        )
+    return _XMP_HEADER + packet.encode('utf-8')
+
+
+def _write_jpeg(path, tags):
+    with open(path, 'rb') as f:
+        segments, sos_offset = _read_jpeg_segments(f)
+
+    exif = next((payload for code, payload in segments if code == _APP1 and payload and payload.startswith(_EXIF_HEADER)), None)
+    xmp = next((payload for code, payload in segments if code == _APP1 and payload and payload.startswith(_XMP_HEADER)), None)
+    new_exif = _build_exif(exif, tags)
+    new_xmp = _build_xmp(xmp, tags)
+
+    # Drop the old EXIF/XMP segments and put the new ones right after SOI/APP0 (JFIF)
+    kept = [(code, payload) for code, payload in segments if payload is None or payload not in (exif, xmp) or code != _APP1]
+    insert_at = 0
+    while insert_at < len(kept) and kept[insert_at][0] == _APP0:
+        insert_at += 1
+    new_segments = [(_APP1, new_exif)] + ([(_APP1, new_xmp)] if new_xmp else [])
+    kept[insert_at:insert_at] = new_segments
+    header = _SOI + b''.join(_encode_segment(code, payload) for code, payload in kept)
+
+    def write(source, destination):
+        destination.write(header)
+        _copy_range(source, destination, sos_offset, os.fstat(source.fileno()).st_size - sos_offset)
+
+    return NativeWriteResult(path, _replace_file(path, write))
+
+
+# --- QuickTime / MP4 (mvhd + udta) ---
+
+_CONTAINER_ATOMS = {b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf'}
+_FREE_ATOMS = {b'free', b'skip'}
+_QUICKTIME_EPOCH = datetime.datetime(1904, 1, 1)
+_UNDETERMINED_LANGUAGE = 0x55C4
+_USER_DATA_TAGS = {
+    'Title': b'\xa9nam',
+    'ImageDescription': b'\xa9des',
+    'Make': b'\xa9mak',
+    'Model': b'\xa9mod',
+    'Software': b'\xa9swr',
+    'Artist': b'\xa9ART',
+    'Copyright': b'\xa9cpy',
+}
+
+
+def _read_atoms(data, start=0, end=None):
+    """Yield (type, offset, size, header_size) for the atoms in data[start:end]"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, type_ = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise NativeWriteUnsupported("truncated 64-bit atom header")
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise NativeWriteUnsupported(f"corrupt '{type_.decode('latin-1')}' atom")
+        yield type_, offset, size, header_size
+        offset += size
+
+
+def _read_top_level_atoms(f):
+    """Return [(type, offset, size)] for the top-level atoms of a QuickTime file"""
+    file_size = os.fstat(f.fileno()).st_size
+    atoms = []
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, type_ = struct.unpack_from('>I4s', header)
+        if size == 1:
+            size = struct.unpack_from('>Q', header, 8)[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8 or offset + size > file_size:
+            raise NativeWriteUnsupported(f"corrupt top-level '{type_.decode('latin-1')}' atom")
+        atoms.append((type_, offset, size))
+        offset += size
+    return atoms
+
+
+def _atom(type_, payload):
+    return struct.pack('>I4s', len(payload) + 8, type_) + payload
+
+
+def _user_data_text(value):
+    text = value.encode('utf-8')
+    return struct.pack('>HH', len(text), _UNDETERMINED_LANGUAGE) + text
+
+
+def _iso6709(latitude, longitude, altitude):
+    location = f'{latitude:+08.4f}{longitude:+09.4f}'
+    if altitude is not None:
+        location += f'{altitude:+.3f}'
+    return location + '/'
+
+
+def _build_user_data(original, tags):
+    """Return a new udta payload with our text atoms replacing any existing ones"""
+    atoms = {}
+    for name, type_ in _USER_DATA_TAGS.items():
+        if tags.get(name):
+            atoms[type_] = _user_data_text(tags[name])
+    if tags.get('DateTimeOriginal'):
+        atoms[b'\xa9day'] = _user_data_text(_parse_date(tags['DateTimeOriginal']).strftime('%Y-%m-%dT%H:%M:%S'))
+    if tags.get('GPSLatitude') and tags.get('GPSLongitude'):
+        latitude = _signed_coordinate(tags['GPSLatitude'], tags.get('GPSLatitudeRef'), 'S')
+        longitude = _signed_coordinate(tags['GPSLongitude'], tags.get('GPSLongitudeRef'), 'W')
+        altitude = float(tags['GPSAltitude']) if tags.get('GPSAltitude') else None
+        atoms[b'\xa9xyz'] = _user_data_text(_iso6709(latitude, longitude, altitude))
+
+    payload = bytearray()
+    for type_, offset, size, _ in _read_atoms(original):
+        if type_ not in atoms:
+            payload += original[offset:offset + size]
+    for type_, value in atoms.items():
+        payload += _atom(type_, value)
+    return bytes(payload)
+
+
+def _patch_header_dates(header, tags, header_size):
+    """Set the creation/modification dates of an mvhd, tkhd or mdhd atom, which all start with them"""
+    header = bytearray(header)
+    version = header[header_size]
+    field_format, field_size = ('>Q', 8) if version == 1 else ('>I', 4)
+    for index, name in enumerate(('CreateDate', 'ModifyDate')):
+        if tags.get(name):
+            seconds = int((_parse_date(tags[name]) - _QUICKTIME_EPOCH).total_seconds())
+            if seconds < 0 or (version == 0 and seconds > 0xFFFFFFFF):
+                raise NativeWriteUnsupported(f"{name} out of range for the movie header")
+            struct.pack_into(field_format, header, header_size + 4 + index * field_size, seconds)
+    return bytes(header)
+
+
+def _patch_track_dates(atom, tags, start=0, end=None):
+    """Set the dates of the track (tkhd) and media (mdhd) headers under a trak atom, in place"""
+    for type_, offset, size, header_size in _read_atoms(atom, start, end):
+        if type_ in (b'tkhd', b'mdhd'):
+            atom[offset:offset + size] = _patch_header_dates(atom[offset:offset + size], tags, header_size)
+        elif type_ in _CONTAINER_ATOMS:
+            _patch_track_dates(atom, tags, offset + header_size, offset + size)
+
+
+def _shift_chunk_offsets(moov, threshold, delta, start=0, end=None):
+    """Add delta to every stco/co64 chunk offset at or beyond threshold, in place"""
+    for type_, offset, size, header_size in _read_atoms(moov, start, end):
+        body = offset + header_size
+        if type_ in _CONTAINER_ATOMS:
+            _shift_chunk_offsets(moov, threshold, delta, body, offset + size)
+        elif type_ in (b'stco', b'co64'):
+            entry_format, entry_size = ('>I', 4) if type_ == b'stco' else ('>Q', 8)
+            count = struct.unpack_from('>I', moov, body + 4)[0]
+            for i in range(count):
+                position = body + 8 + i * entry_size
+                value = struct.unpack_from(entry_format, moov, position)[0]
+                if value >= threshold:
+                    value += delta
+                    if type_ == b'stco' and value > 0xFFFFFFFF:
+                        raise NativeWriteUnsupported("chunk offsets overflow 32-bit stco")
+                    struct.pack_into(entry_format, moov, position, value)
+
+
+def _build_movie(moov, tags):
+    """Return a new moov atom with the movie, track and media header dates and the user data updated, and any free children dropped"""
+    _, _, _, header_size = next(_read_atoms(moov))
+    children = []
+    user_data = b''
+    for type_, offset, size, child_header_size in _read_atoms(moov, header_size):
+        child = moov[offset:offset + size]
+        if type_ == b'mvhd':
+            child = _patch_header_dates(child, tags, child_header_size)
+        elif type_ == b'trak':
+            child = bytearray(child)
+            _patch_track_dates(child, tags)
+            child = bytes(child)
+        elif type_ == b'udta':
+            user_data = child[child_header_size:]
+            continue
+        elif type_ in _FREE_ATOMS:
+            continue
+        children.append(child)
+    children.append(_atom(b'udta', _build_user_data(user_data, tags)))
+    return _atom(b'moov', b''.join(children))
+
+
+def _free_atom_header(size):
+    return struct.pack('>I4s', size, b'free')
+
+
+def _write_quicktime(path, tags):
+    """
+    Update the moov atom of a QuickTime/MP4 file
+
+    If the new moov fits in the space of the old one plus the free atoms directly after
+    it, only that region is overwritten and the remainder is marked free again, so a
+    multi-GB movie costs a few KB of I/O. Otherwise the file is rewritten with
+    MOOV_PADDING bytes of free space after the moov, so the next edit can be done in place.
+    """
+    with open(path, 'rb') as f:
+        atoms = _read_top_level_atoms(f)
+        if any(type_ == b'moof' for type_, _, _ in atoms):
+            raise NativeWriteUnsupported("fragmented movies are not supported")
+        moov_indexes = [i for i, (type_, _, _) in enumerate(atoms) if type_ == b'moov']
+        if len(moov_indexes) != 1:
+            raise NativeWriteUnsupported("expected exactly one moov atom")
+        _, moov_offset, moov_size = atoms[moov_indexes[0]]
+        f.seek(moov_offset)
+        moov = f.read(moov_size)
+
+    # The moov can grow into the free atoms that follow it
+    available = moov_size
+    for type_, _, size in atoms[moov_indexes[0] + 1:]:
+        if type_ not in _FREE_ATOMS:
+            break
+        available += size
+
+    new_moov = bytearray(_build_movie(moov, tags))
+    remainder = available - len(new_moov)
+    if remainder == 0 or remainder >= 8:
+        stat = os.stat(path)
+        with open(path, 'r+b') as f:
+            f.seek(moov_offset)
+            f.write(new_moov)
+            if remainder:
+                f.write(_free_atom_header(remainder))
+            f.flush()
+            os.fsync(f.fileno())
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        return NativeWriteResult(path, len(new_moov) + (8 if remainder else 0), in_place=True)
+
+    padding = _free_atom_header(MOOV_PADDING) + b'\x00' * (MOOV_PADDING - 8)
+    delta = len(new_moov) + len(padding) - available
+    # Media data stored after the movie atom moves by delta bytes
+    _, _, _, header_size = next(_read_atoms(new_moov))
+    _shift_chunk_offsets(new_moov, moov_offset + available, delta, header_size)
+
+    def write(source, destination):
+        _copy_range(source, destination, 0, moov_offset)
+        destination.write(new_moov)
+        destination.write(padding)
+        file_size = os.fstat(source.fileno()).st_size
+        _copy_range(source, destination, moov_offset + available, file_size - moov_offset - available)
+
+    return NativeWriteResult(path, _replace_file(path, write))
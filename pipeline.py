@@ -0,0 +1,347 @@
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from logger_utils import Colors, setup_logging
+
+logger = setup_logging(script_name='exif-embed-pipeline')
+
+# Stage scripts are imported once logging is set up, so the whole run logs to the pipeline's file
+import embed
+import extract
+import scrub_live_files
+import update_creation_date
+import upload_files
+import metrics
+from date_manifest import DEFAULT_DATE_MANIFEST, DateManifest
+from exiftool_pool import JobSummary
+from file_times import log_failures
+from inventory import DEFAULT_INVENTORY, Inventory, load_inventory
+from metrics import add_metrics_arguments, setup_metrics
+from state_db import DEFAULT_STATE_DB, StateDB, file_fingerprint
+
+_DONE = object()
+# Seconds the date stage waits for more files before applying a partial batch
+DATE_FLUSH_INTERVAL = 1.0
+# Kept files that have no sidecar to embed, and go straight from extraction to the date stage
+DATE_ONLY_EXTENSIONS = tuple(extension for extension in embed.KEPT_EXTENSIONS
+                             if extension not in embed.MEDIA_EXTENSIONS and extension != '.wmv')
+
+
+class StageStats:
+    """Number of files one pipeline stage handled, and the time from its first to its last one"""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        self.started = self.finished = time.perf_counter()
+
+    def add(self, count=1):
+        if self.started is None:
+            self.start()
+        self.count += count
+        self.finished = time.perf_counter()
+
+    def log(self):
+        elapsed = (self.finished - self.started) if self.started is not None else 0.0
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        metrics.record(f'stage_{self.name}', elapsed, self.count)
+        logger.info(f"  {self.name:<8} {self.count:>8} files in {elapsed:8.1f}s  ({rate:.1f} files/s)")
+
+
+def drain_until_done(stage_queue):
+    """Discard items from a stage queue up to its _DONE marker, so producers never block on a stage that failed"""
+    while stage_queue.get() is not _DONE:
+        pass
+
+
+def iter_stage_queue(stage_queue):
+    """Yield items from a queue filled by a pipeline stage until it signals completion"""
+    while True:
+        item = stage_queue.get()
+        if item is _DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+class Pipeline:
+    """
+    Runs extract -> scrub -> embed -> date fixup -> cleanup -> upload in a single process
+
+    The first four stages run at the same time on their own threads, connected by bounded
+    queues: a file moves on to the next stage as soon as the previous one is done with it,
+    and a stage that falls behind makes the earlier ones wait. All stages share one
+    Inventory, built up as files are extracted instead of by walking the tree.
+
+    Live photo movies are held back by the scrub stage until extraction has finished, as
+    their still image can come from a later Takeout part.
+
+    When a stage fails, extraction stops early and the failed stage keeps draining its
+    input queue until the stage feeding it has finished, so no thread is left blocked on
+    a full queue; the files already on their way through the other stages are finished.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        queue_size = max(1, args.jobs) * args.batch_size * 2
+        self.pair_queue = queue.Queue(maxsize=queue_size)
+        self.embed_queue = queue.Queue(maxsize=queue_size)
+        self.date_queue = queue.Queue(maxsize=queue_size)
+        self.stats = {name: StageStats(name) for name in ('extract', 'scrub', 'embed', 'dates', 'cleanup')}
+        self.manifest = DateManifest(args.date_manifest)
+        self.date_summary = JobSummary()
+        self.date_failures = []
+        self.errors = []
+        self.failed = threading.Event()
+        # Set once the date stage has read the _DONE marker off its queue
+        self.dates_done = False
+        if args.inventory:
+            self.inventory = load_inventory(args.target, args.inventory)
+        elif os.path.isdir(args.target):
+            self.inventory = Inventory.scan(args.target)
+        else:
+            self.inventory = Inventory(args.target)
+
+    def _fail(self, name, error):
+        """Record a stage failure and stop extraction; an error passed on from an earlier stage is only logged once"""
+        if not any(error is e for e in self.errors):
+            logger.error(f"Pipeline stage {name} failed: {error}", exc_info=error)
+            self.errors.append(error)
+        self.failed.set()
+
+    def _thread(self, target, name, drain=None, downstream=None):
+        """
+        Start a stage thread
+
+        If the stage fails, drain() is called to empty its input queue until the stage
+        feeding it has finished, and the error is passed on to the downstream queue.
+        """
+        def run():
+            try:
+                target()
+            except Exception as e:
+                self._fail(name, e)
+                if drain is not None:
+                    drain()
+                if downstream is not None:
+                    downstream.put(e)
+        thread = threading.Thread(target=run, name=f'pipeline-{name}', daemon=True)
+        thread.start()
+        return thread
+
+    def extracted(self, path):
+        self.inventory.add(path)
+        self.stats['extract'].add()
+        if path.lower().endswith(DATE_ONLY_EXTENSIONS) and not self.failed.is_set():
+            self.date_queue.put(path)
+
+    def embedded(self, media_path):
+        self.stats['embed'].add()
+        if not media_path.lower().endswith('.wmv') and not self.failed.is_set():
+            self.date_queue.put(media_path)
+
+    def extract_stage(self):
+        self.stats['extract'].start()
+        archives = extract.find_archives(self.args.source)
+        logger.info(f"Extracting {len(archives)} archives from {Colors.CYAN}{self.args.source}{Colors.RESET}")
+        # With --resume, members unchanged since the last run are not written again, so they keep their embed fingerprint
+        extract.stream_pairs(archives, self.args.target, embed.MEDIA_EXTENSIONS, self.pair_queue,
+                             self.args.delete_archives, on_extracted=self.extracted, state_db=self.args.state_db,
+                             incremental=self.args.resume, stop=self.failed)
+
+    def scrub_stage(self):
+        self.stats['scrub'].start()
+        movies = []
+        for media_path, json_path in extract.iter_queue(self.pair_queue):
+            if media_path.lower().endswith(scrub_live_files.LIVE_VIDEO_EXTENSION):
+                movies.append((media_path, json_path))
+                continue
+            self.stats['scrub'].add()
+            self.embed_queue.put((media_path, json_path))
+
+        # Extraction is done, so the inventory now knows every still a movie could belong to
+        moves = []
+        for media_path, json_path in movies:
+            # Takeout names a live photo's movie and still alike, but not necessarily in the same case
+            stem = os.path.splitext(os.path.basename(media_path))[0].lower()
+            names = {name.lower() for name in self.inventory.names(os.path.dirname(media_path))}
+            if any(stem + extension in names for extension in scrub_live_files.STILL_EXTENSIONS):
+                moves.append((media_path, os.path.join(self.args.livefiles, os.path.relpath(media_path, start=self.args.target))))
+            else:
+                self.embed_queue.put((media_path, json_path))
+            self.stats['scrub'].add()
+
+        failures = scrub_live_files.move_files(moves, self.args.jobs)
+        failed = {source_file for source_file, _ in failures}
+        for source_file, _ in moves:
+            if source_file not in failed:
+                self.inventory.discard(source_file)
+        log_failures(failures, 'move')
+        logger.info(f"Moved {len(moves) - len(failures)} live photo movies to {Colors.CYAN}{self.args.livefiles}{Colors.RESET}")
+        self.embed_queue.put(_DONE)
+
+    def date_stage(self):
+        # SQLite connections belong to the thread that opened them
+        self.stats['dates'].start()
+        with StateDB(self.args.state_db) as state:
+            while not self.dates_done:
+                batch = []
+                while len(batch) < update_creation_date.APPLY_BATCH_SIZE:
+                    try:
+                        item = self.date_queue.get(timeout=DATE_FLUSH_INTERVAL if batch else None)
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        self.dates_done = True
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    if self.args.resume and state.is_current('creation_date', item, file_fingerprint(item, stat=self.inventory.stat(item))):
+                        self.date_summary.add_skipped()
+                        continue
+                    batch.append(item)
+                if batch:
+                    self.date_failures += update_creation_date.update_files(self.resolve_dates(batch), self.date_summary, state,
+                                                                            self.inventory, self.args.jobs)
+                    self.stats['dates'].add(len(batch))
+
+    def drain_dates(self):
+        if not self.dates_done:
+            drain_until_done(self.date_queue)
+
+    def resolve_dates(self, files):
+        """Yield (file_path, datetime or None, error) for a batch, reading dates missing from the manifest in one scan"""
+        try:
+            dates = update_creation_date.collect_dates(files, self.manifest, bulk_read=True)
+        except Exception as e:
+            # A failed scan fails this batch's files, not the whole stage
+            logger.error(f"Unable to read the dates of {len(files)} files: {e}")
+            for file_path in files:
+                yield file_path, None, e
+            return
+        for file_path in files:
+            try:
+                yield file_path, update_creation_date.resolve_file_date(None, file_path, self.args.defaultdate, dates, False), None
+            except Exception as e:
+                yield file_path, None, e
+
+    def run(self):
+        started = time.perf_counter()
+        extract_thread = self._thread(self.extract_stage, 'extract', downstream=self.pair_queue)
+        scrub_thread = self._thread(self.scrub_stage, 'scrub', lambda: extract.drain_queue(self.pair_queue, extract_thread),
+                                    self.embed_queue)
+        date_thread = self._thread(self.date_stage, 'dates', self.drain_dates)
+
+        self.stats['embed'].start()
+        with StateDB(self.args.state_db) as state:
+            try:
+                embed.embed_pairs(iter_stage_queue(self.embed_queue), self.args.jobs, self.args.batch_size, state, self.args.resume,
+                                  self.args.engine, self.manifest, self.inventory, on_done=self.embedded)
+            except Exception as e:
+                self._fail('embed', e)
+                extract.drain_queue(self.embed_queue, scrub_thread)
+            finally:
+                # Every file the extract stage sends to the date stage is queued by now, as scrub only ends after it
+                self.date_queue.put(_DONE)
+        for thread in (extract_thread, scrub_thread, date_thread):
+            thread.join()
+        self.manifest.save()
+        log_failures(self.date_failures)
+        self.date_summary.log('Updated creation date of')
+
+        before = len(self.inventory)
+        self.stats['cleanup'].start()
+        embed.cleanup_files(self.args.target, self.inventory)
+        self.stats['cleanup'].add(before - len(self.inventory))
+
+        success = not self.errors
+        if self.args.destination:
+            success = self.upload() and success
+        if self.args.inventory:
+            self.inventory.save(self.args.inventory)
+
+        logger.info(f"{Colors.BOLD}Pipeline finished in {time.perf_counter() - started:.1f}s{Colors.RESET}")
+        for stage in self.stats.values():
+            stage.log()
+        return success
+
+    def upload(self):
+        args = self.args
+        source_dir = args.upload_source or os.path.join(args.target, 'Takeout', 'Google Photos')
+        rclone_path = None
+        if args.destination == 'onedrive':
+            rclone_available, rclone_path = upload_files.check_rclone()
+            if not rclone_available:
+                logger.error(f"{Colors.BRIGHT_RED}Rclone is not set up; run upload_files.py once to configure it{Colors.RESET}")
+                return False
+        ledger = StateDB(args.state_db) if args.incremental and args.destination == 'onedrive' else None
+        try:
+            return upload_files.process_files(source_dir, args.destination, target_dir=args.upload_target, operation=args.operation,
+                                              rclone_remote=args.remote, rclone_path=rclone_path, inventory=self.inventory,
+                                              jobs=args.jobs, ledger=ledger)
+        finally:
+            if ledger is not None:
+                ledger.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='exif-embed', description='Google Takeout photo pipeline')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='Extract, scrub, embed, fix dates, clean up and optionally upload in one pass')
+    run.add_argument('--source', '-s', default='./zips', help='Folder containing the Takeout ZIP files (default: ./zips)')
+    run.add_argument('--target', '-t', default='./extracts', help='Folder the archives are extracted to (default: ./extracts)')
+    run.add_argument('--livefiles', default='./livefiles', help='Folder live photo movies are moved to (default: ./livefiles)')
+    run.add_argument('--jobs', '-j', type=int, default=4, help='Number of parallel ExifTool workers and file threads (default: 4)')
+    run.add_argument('--batch-size', '-b', type=int, default=32,
+                     help='Number of files sent to an ExifTool worker per round trip (default: 32)')
+    run.add_argument('--engine', choices=('exiftool', 'native'), default='exiftool',
+                     help='Metadata writer used for embedding; native patches movies in place without a temporary copy, see embed.py --help (default: exiftool)')
+    run.add_argument('--defaultdate', default='1973:12:21 00:00:00',
+                     help='Creation date for files whose date taken cannot be parsed (default: 1973:12:21 00:00:00)')
+    run.add_argument('--delete-archives', action='store_true', help='Delete each ZIP file once it has been fully extracted')
+    run.add_argument('--state-db', default=DEFAULT_STATE_DB,
+                     help=f'SQLite database recording the files each stage processed (default: {DEFAULT_STATE_DB})')
+    run.add_argument('--date-manifest', default=DEFAULT_DATE_MANIFEST,
+                     help=f'Binary manifest of embedded dates (default: {DEFAULT_DATE_MANIFEST})')
+    run.add_argument('--inventory', nargs='?', const=DEFAULT_INVENTORY,
+                     help=f'Start from the file inventory saved by an earlier run and save it back (path defaults to {DEFAULT_INVENTORY})')
+    resume_group = run.add_mutually_exclusive_group()
+    resume_group.add_argument('--resume', dest='resume', action='store_true', default=True,
+                              help='Skip files already embedded or dated, and unchanged since (default)')
+    resume_group.add_argument('--force', dest='resume', action='store_false',
+                              help='Process every file again')
+    run.add_argument('--destination', '-d', choices=['onedrive', 'pictures'],
+                     help="Upload the result to 'onedrive' or copy it to the 'pictures' folder (default: no upload)")
+    run.add_argument('--upload-source', help='Folder to upload (default: TARGET/Takeout/Google Photos)')
+    run.add_argument('--upload-target', default='', help='Target folder on OneDrive or in the Pictures library (default: root folder)')
+    run.add_argument('--remote', '-r', default='onedrive', help='Rclone remote name (default: onedrive)')
+    run.add_argument('--operation', '-o', choices=['move', 'copy'], default='copy',
+                     help="Whether to 'move' or 'copy' files to the Pictures library (default: copy)")
+    run.add_argument('--incremental', '-i', action='store_true',
+                     help='OneDrive only: upload just the files that are new or changed since the last upload')
+    add_metrics_arguments(run)
+
+    args = parser.parse_args()
+    setup_metrics(args, 'pipeline')
+    logger.info(f"{Colors.BOLD}{Colors.BRIGHT_CYAN}Exif-Embed pipeline{Colors.RESET}")
+    if not os.path.isdir(args.source):
+        logger.error(f"{Colors.BRIGHT_RED}Source directory '{args.source}' does not exist{Colors.RESET}")
+        return 1
+    return 0 if Pipeline(args).run() else 1
+
+
+if __name__ == "__main__":
+    # Enable Windows color support
+    if os.name == 'nt':
+        os.system('color')
+
+    # Run the main program
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import datetime
+import json
+import logging
+import os
+import re
+import time
+from state_db import DEFAULT_STATE_DB
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RUN_LOG = os.path.join(os.path.dirname(DEFAULT_STATE_DB), 'rclone-runs.jsonl')
+# Flags making rclone write one JSON object per log line, with a stats snapshot every second
+JSON_LOG_ARGS = ['--use-json-log', '-v', '--stats', '1s']
+
+_ATTEMPT_FAILED = re.compile(r'Attempt (\d+)/(\d+) failed with (\d+) errors')
+_LOW_LEVEL_RETRY = re.compile(r'Low level retry (\d+)/(\d+)')
+
+
+class RcloneRun:
+    """
+    Follows one rclone run through its --use-json-log output
+
+    feed() classifies each line and keeps the running totals: per-file transfer events,
+    errors, retries, and the latest stats snapshot rclone reports (bytes, speed, ETA).
+    summary() turns them into the machine-readable record appended to the run log.
+
+    Usage:
+        run = RcloneRun(file_count, total_bytes, {'transfers': 4})
+        for line in process.stdout:
+            kind, record = run.feed(line)
+        write_summary(run.summary(process.returncode))
+    """
+
+    def __init__(self, file_count=0, total_bytes=0, settings=None):
+        self.file_count = file_count
+        self.total_bytes = total_bytes
+        self.settings = dict(settings or {})
+        self.transfers = []
+        self.errors = []
+        self.retries = 0
+        self.low_level_retries = 0
+        self.stats = {}
+        self.nothing_to_transfer = False
+        self.started = time.time()
+
+    def feed(self, line):
+        """
+        Parse one output line and return a (kind, record) pair
+
+        kind is 'transfer', 'error', 'retry', 'stats', 'log', or 'text' for lines that are not
+        JSON; record is the decoded JSON object (or the raw line for 'text').
+        """
+        line = line.strip()
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return 'text', line
+        if not isinstance(record, dict):
+            return 'text', line
+
+        message = record.get('msg', '')
+        if isinstance(record.get('stats'), dict):
+            self.stats = record['stats']
+            return 'stats', record
+        if 'There was nothing to transfer' in message:
+            self.nothing_to_transfer = True
+            return 'log', record
+
+        if _ATTEMPT_FAILED.search(message):
+            self.retries += 1
+            return 'retry', record
+        if _LOW_LEVEL_RETRY.search(message):
+            self.low_level_retries += 1
+            return 'retry', record
+
+        if record.get('level') in ('error', 'critical'):
+            self.errors.append((record.get('object', ''), message))
+            return 'error', record
+        if record.get('object') and message.startswith(('Copied', 'Moved', 'Updated')):
+            self.transfers.append((record['object'], message, record.get('time', '')))
+            return 'transfer', record
+        return 'log', record
+
+    @property
+    def bytes(self):
+        return self.stats.get('bytes', 0)
+
+    def eta(self):
+        """Seconds left according to rclone, or None when it has no estimate"""
+        return self.stats.get('eta')
+
+    def summary(self, return_code=None):
+        """Return the run as a dict of plain values, ready to be written as JSON"""
+        elapsed = self.stats.get('elapsedTime') or (time.time() - self.started)
+        return {
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'return_code': return_code,
+            'settings': self.settings,
+            'files_expected': self.file_count,
+            'bytes_expected': self.total_bytes,
+            'files_transferred': len(self.transfers),
+            'files_checked': self.stats.get('checks', 0),
+            'bytes_transferred': self.bytes,
+            'elapsed': round(elapsed, 3),
+            'transfer_time': self.stats.get('transferTime', 0),
+            'speed_avg': round(self.bytes / elapsed, 1) if elapsed else 0,
+            'speed_last': self.stats.get('speed', 0),
+            'errors': len(self.errors),
+            'retries': self.retries,
+            'low_level_retries': self.low_level_retries,
+            'nothing_to_transfer': self.nothing_to_transfer,
+        }
+
+
+def write_summary(summary, path=DEFAULT_RUN_LOG):
+    """Append a run summary as one JSON line to the run log"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(summary, sort_keys=True) + '\n')
+    logger.debug(f"Appended run summary to {path}")
+
+
+def read_summaries(path=DEFAULT_RUN_LOG):
+    """Return the run summaries recorded in the run log, oldest first"""
+    if not os.path.exists(path):
+        return []
+    summaries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                summaries.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"Ignoring malformed line in {path}")
+    return summaries
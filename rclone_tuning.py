@@ -0,0 +1,61 @@
+import logging
+import statistics
+
+logger = logging.getLogger(__name__)
+
+# Files at or above this median size make a tree "large video" rather than "small photo"
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+# Runs that moved less than this tell little about throughput and are not used for tuning
+MIN_MEASURED_BYTES = 64 * 1024 * 1024
+MAX_TRANSFERS = 32
+
+# Starting points per profile. OneDrive upload chunks must be a multiple of 320 KiB.
+PROFILES = {
+    # Many small files: per-file latency dominates, so keep lots of them in flight
+    'small': {'transfers': 16, 'checkers': 32, 'chunk_size': '10M'},
+    # Few large files: bandwidth dominates, so fewer streams with bigger chunks
+    'large': {'transfers': 4, 'checkers': 8, 'chunk_size': '100M'},
+}
+
+
+def classify(sizes):
+    """Return the 'small' or 'large' profile for a list of file sizes"""
+    if not sizes:
+        return 'small'
+    # The median rather than the byte share: a few videos often hold most of the bytes of
+    # a photo library, but the many photos still decide how the upload behaves
+    return 'large' if statistics.median(sizes) >= LARGE_FILE_SIZE else 'small'
+
+
+def tune_settings(sizes, summaries=(), remote=None):
+    """
+    Choose rclone transfers/checkers/chunk size for uploading files of the given sizes
+
+    The profile comes from the file size distribution. Earlier runs of the same profile
+    and remote (summaries from rclone_log.read_summaries) then adjust the transfers: the
+    best measured setting is kept, one that ran into retries or errors is halved, and
+    one that worked cleanly is doubled once to probe for more throughput.
+    Returns a settings dict, which is also recorded in the run summary.
+    """
+    profile = classify(sizes)
+    settings = dict(PROFILES[profile], profile=profile)
+
+    measured = [summary for summary in summaries
+                if summary.get('settings', {}).get('profile') == profile
+                and summary.get('settings', {}).get('remote') == remote
+                and summary.get('bytes_transferred', 0) >= MIN_MEASURED_BYTES]
+    if measured:
+        best = max(measured, key=lambda summary: summary.get('speed_avg', 0))
+        transfers = best['settings'].get('transfers', settings['transfers'])
+        tried = {summary['settings'].get('transfers') for summary in measured}
+        if best.get('errors') or best.get('retries') or best.get('low_level_retries'):
+            transfers = max(1, transfers // 2)
+        elif transfers * 2 not in tried and transfers * 2 <= MAX_TRANSFERS:
+            transfers *= 2
+        logger.debug(f"Best measured {profile} upload: {best.get('speed_avg', 0) / (1024 * 1024):.2f} MB/s "
+                     f"with {best['settings'].get('transfers')} transfers, {len(measured)} runs")
+        settings['transfers'] = transfers
+        settings['checkers'] = max(settings['checkers'], transfers * 2)
+
+    logger.debug(f"Tuned rclone settings for {len(sizes)} files: {settings}")
+    return settings
@@ -1,44 +1,139 @@
 import argparse
 import os
 import sys
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from exiftool_batch import batched
+from exiftool_scan import path_key, read_content_identifiers
+from file_times import log_failures
+from inventory import DEFAULT_INVENTORY, load_inventory
 from logger_utils import Colors, setup_logging
+from metrics import add_metrics_arguments, setup_metrics
 
 logger = setup_logging(script_name='exif-embed-scrub-live-files')
 
+# Movie half of a live photo, and the still image extensions it pairs with, in order of preference
+LIVE_VIDEO_EXTENSION = '.mp4'
+STILL_EXTENSIONS = ('.jpg', '.heic', '.jpeg')
+MOVE_BATCH_SIZE = 256
+
+def find_live_pairs(inventory, source_dir, identifiers=None):
+    """
+    Yield a (video FileEntry, still FileEntry) pair for every live photo movie under source_dir
+
+    Files are paired per directory on their stem, with extensions compared case-insensitively.
+    With a {path_key: ContentIdentifier} map, movies without a same-named still are paired
+    with a still holding the same ContentIdentifier anywhere in the tree.
+    """
+    videos = []
+    stills_by_identifier = {}
+    for _, entries in inventory.walk(source_dir):
+        # stem -> {lowercase extension: entry}
+        stems = {}
+        for entry in entries:
+            stem, extension = os.path.splitext(entry.name)
+            stems.setdefault(os.path.normcase(stem), {})[extension.lower()] = entry
+
+        for extensions in stems.values():
+            video = extensions.get(LIVE_VIDEO_EXTENSION)
+            still = next((extensions[ext] for ext in STILL_EXTENSIONS if ext in extensions), None)
+            if video and still:
+                yield video, still
+            elif video:
+                videos.append(video)
+            if identifiers:
+                for ext in STILL_EXTENSIONS:
+                    if ext in extensions and path_key(extensions[ext].path) in identifiers:
+                        stills_by_identifier.setdefault(identifiers[path_key(extensions[ext].path)], extensions[ext])
+
+    if not identifiers:
+        return
+    for video in videos:
+        still = stills_by_identifier.get(identifiers.get(path_key(video.path)))
+        if still:
+            logger.debug(f"Paired {video.path} with {still.path} by ContentIdentifier")
+            yield video, still
+
+def move_batch(moves):
+    """Move a batch of (source, destination) files, returning (source, error message) failures"""
+    failures = []
+    with metrics.timer('file_rename', len(moves)):
+        for source_file, dest_file in moves:
+            try:
+                os.rename(source_file, dest_file)
+            except OSError as e:
+                failures.append((source_file, str(e)))
+    return failures
+
+def move_files(moves, jobs=4, batch_size=MOVE_BATCH_SIZE):
+    """
+    Move (source, destination) files from a thread pool, in batches
+
+    Destination directories are created once up front. Returns the list of failures.
+    """
+    for directory in sorted({os.path.dirname(dest_file) for _, dest_file in moves}):
+        os.makedirs(directory, exist_ok=True)
+
+    batches = list(batched(moves, batch_size))
+    if jobs <= 1 or len(batches) <= 1:
+        return [failure for batch in batches for failure in move_batch(batch)]
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='scrub') as executor:
+        for batch_failures in executor.map(move_batch, batches):
+            failures.extend(batch_failures)
+    return failures
+
 def scrub():
     parser = argparse.ArgumentParser(description="Cleanup MP4 live photo files")
     parser.add_argument("--source", default="./extracts", help="Root folder containing media files (default: ./extracts)")
     parser.add_argument("--target", default="./livefiles", help="Target folder for extracted files (default: ./livefiles)")
+    parser.add_argument("--jobs", "-j", type=int, default=4, help="Number of parallel move threads (default: 4)")
+    parser.add_argument("--dry-run", "-n", action="store_true", help="Report the live photo movies that would be moved, without moving them")
+    parser.add_argument("--content-id", action="store_true",
+                        help="Also pair movies with stills sharing an Apple ContentIdentifier, read with a single ExifTool scan")
+    parser.add_argument("--inventory", nargs="?", const=DEFAULT_INVENTORY,
+                        help=f"Reuse the file inventory saved by an earlier stage and save it back, instead of scanning the whole tree (path defaults to {DEFAULT_INVENTORY})")
+    add_metrics_arguments(parser)
     args = parser.parse_args()
+    setup_metrics(args, 'scrub-live-files')
     source_dir = args.source
     target_dir = args.target
+    inventory = load_inventory(source_dir, args.inventory)
+
+    identifiers = None
+    if args.content_id:
+        logger.info(f"Reading content identifiers in {Colors.CYAN}{source_dir}{Colors.RESET}")
+        identifiers = read_content_identifiers(source_dir, STILL_EXTENSIONS + (LIVE_VIDEO_EXTENSION,))
+
+    moves = []
+    total_bytes = 0
+    report = logger.info if args.dry_run else logger.debug
+    for video, still in find_live_pairs(inventory, source_dir, identifiers):
+        dest_file = os.path.join(target_dir, os.path.relpath(video.path, start=source_dir))
+        report(f"{'would move' if args.dry_run else 'moving'} '{video.path}' (live photo of {os.path.basename(still.path)}) to '{dest_file}'")
+        moves.append((video.path, dest_file))
+        total_bytes += video.st_size
+
+    if args.dry_run:
+        logger.info(f"Dry run: {len(moves)} live photo movies ({total_bytes / (1024 * 1024):.1f} MB) would be moved "
+                    f"from {Colors.CYAN}{source_dir}{Colors.RESET} to {Colors.CYAN}{target_dir}{Colors.RESET}")
+        return 0
 
-    for root, dirs, files in os.walk(source_dir):
-        for file in files:
-            if file.lower().endswith('.mp4'):
-                print (f"Processing file: {file}")
-                file_path = None
-                heic_path = f"{os.path.splitext(file)[0]}.heic"
-                jpg_path = f"{os.path.splitext(file)[0]}.jpg"
-                jpeg_path = f"{os.path.splitext(file)[0]}.jpeg"
-                if os.path.exists(os.path.join(root, jpg_path)):
-                    file_path = jpg_path
-                elif os.path.exists(os.path.join(root, heic_path)):
-                    file_path = heic_path
-                elif os.path.exists(os.path.join(root, jpeg_path)):
-                    file_path = jpeg_path
-
-                if file_path:
-                    source_file = os.path.join(root, file)
-                    dest_file = os.path.join(target_dir, os.path.relpath(source_file, start=source_dir))
-                    os.makedirs(os.path.dirname(dest_file), exist_ok=True)
-                    logger.debug (f"moving '{source_file}' to '{dest_file}'")
-                    os.rename(source_file, dest_file)
+    failures = move_files(moves, args.jobs)
+    failed = {source_file for source_file, _ in failures}
+    for source_file, _ in moves:
+        if source_file not in failed:
+            inventory.discard(source_file)
+    log_failures(failures, 'move')
+    if args.inventory:
+        inventory.save(args.inventory)
 
+    logger.info(f"Moved {len(moves) - len(failures)} live photo movies to {Colors.CYAN}{target_dir}{Colors.RESET}")
     logger.info(f"Scrubbing complete in {Colors.CYAN}{source_dir}{Colors.RESET}")
-    return 0
+    return 1 if failures else 0
 
 if __name__ == "__main__":
     if os.name == 'nt':
         os.system('color')
-    sys.exit(scrub())
\ No newline at end of file
+    sys.exit(scrub())
@@ -0,0 +1,160 @@
+import json
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class SidecarRecord:
+    """The fields of a Google Takeout JSON sidecar that get embedded into the media file"""
+
+    __slots__ = ('title', 'description', 'photo_taken_time', 'latitude', 'longitude', 'altitude',
+                 'make', 'model', 'software', 'keywords', 'copyright', 'artist', 'people')
+
+    def __init__(self, title='', description='', photo_taken_time=None, latitude=None, longitude=None,
+                 altitude=None, make='', model='', software='', keywords=None, copyright='', artist='',
+                 people=None):
+        self.title = title
+        self.description = description
+        self.photo_taken_time = photo_taken_time or {}
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+        self.make = make
+        self.model = model
+        self.software = software
+        self.keywords = keywords or []
+        self.copyright = copyright
+        self.artist = artist
+        self.people = people or []
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f"SidecarRecord({fields})"
+
+    @classmethod
+    def from_dict(cls, metadata):
+        """Build a record from a decoded sidecar dict"""
+        location = metadata.get('geoData') or {}
+        people = metadata.get('people')
+        return cls(
+            title=metadata.get('title', ''),
+            description=metadata.get('description', ''),
+            photo_taken_time=metadata.get('photoTakenTime'),
+            latitude=location.get('latitude'),
+            longitude=location.get('longitude'),
+            altitude=location.get('altitude'),
+            make=metadata.get('cameraMake', ''),
+            model=metadata.get('cameraModel', ''),
+            software=metadata.get('software', ''),
+            keywords=list(metadata.get('keywords') or []),
+            copyright=metadata.get('copyright', ''),
+            artist=metadata.get('artist', ''),
+            people=[person['name'] for person in people if isinstance(person, dict) and person.get('name')]
+            if isinstance(people, list) else [],
+        )
+
+
+if msgspec is not None:
+    # Typed layout of the sidecar: msgspec decodes straight into these structs and skips
+    # every other key (creationTime, url, googlePhotosOrigin, ...) without building it
+    class _GeoData(msgspec.Struct):
+        latitude: Optional[float] = None
+        longitude: Optional[float] = None
+        altitude: Optional[float] = None
+
+    class _Person(msgspec.Struct):
+        name: str = ''
+
+    class _Sidecar(msgspec.Struct, rename='camel'):
+        title: str = ''
+        description: str = ''
+        photo_taken_time: dict = {}
+        geo_data: Optional[_GeoData] = None
+        camera_make: str = ''
+        camera_model: str = ''
+        software: str = ''
+        keywords: list = []
+        copyright: str = ''
+        artist: str = ''
+        people: List[_Person] = []
+
+    _decoder = msgspec.json.Decoder(_Sidecar)
+
+    def _decode_typed(data):
+        sidecar = _decoder.decode(data)
+        location = sidecar.geo_data or _GeoData()
+        return SidecarRecord(
+            title=sidecar.title,
+            description=sidecar.description,
+            photo_taken_time=sidecar.photo_taken_time,
+            latitude=location.latitude,
+            longitude=location.longitude,
+            altitude=location.altitude,
+            make=sidecar.camera_make,
+            model=sidecar.camera_model,
+            software=sidecar.software,
+            keywords=list(sidecar.keywords),
+            copyright=sidecar.copyright,
+            artist=sidecar.artist,
+            people=[person.name for person in sidecar.people if person.name],
+        )
+
+
+if orjson is not None:
+    _loads = orjson.loads
+    BACKEND = 'orjson'
+else:
+    _loads = json.loads
+    BACKEND = 'json'
+if msgspec is not None:
+    BACKEND = 'msgspec'
+
+
+def parse_sidecar(data):
+    """
+    Decode the raw bytes of a sidecar into a SidecarRecord
+
+    msgspec is used when installed, falling back to a plain decode for sidecars that do not
+    match the typed layout; otherwise orjson, otherwise the standard library.
+    """
+    if msgspec is not None:
+        try:
+            return _decode_typed(data)
+        except msgspec.ValidationError:
+            pass
+    return SidecarRecord.from_dict(_loads(data))
+
+
+def load_sidecar(json_path):
+    """Read and decode a single sidecar file"""
+    with open(json_path, 'rb') as f:
+        return parse_sidecar(f.read())
+
+
+def load_sidecars(json_paths):
+    """
+    Read and decode a batch of sidecars
+
+    Returns a list in json_paths order holding a SidecarRecord, or the exception raised for
+    that file. Batches are read by the embed workers, which already run in parallel.
+    """
+    records = []
+    for json_path in json_paths:
+        try:
+            with open(json_path, 'rb') as f:
+                data = f.read()
+            records.append(parse_sidecar(data))
+        except (OSError, ValueError) as e:
+            records.append(e)
+    return records
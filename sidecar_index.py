@@ -0,0 +1,227 @@
+import bisect
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Google Takeout caps sidecar file names at 51 characters (including '.json'), truncating the
+# media name and/or the '.supplemental-metadata' suffix to fit.
+MAX_SIDECAR_NAME_LENGTH = 51
+MAX_TRUNCATED_STEM_LENGTH = MAX_SIDECAR_NAME_LENGTH - len('.json')
+SUPPLEMENTAL_SUFFIX = 'supplemental-metadata'
+
+_DUPLICATE_RE = re.compile(r'^(.*)\((\d+)\)$')
+_MEDIA_DUPLICATE_RE = re.compile(r'^(.*)\((\d+)\)(\.[^.]*)$')
+
+
+def sidecar_key(json_file):
+    """
+    Normalize a sidecar file name to the (media name, duplicate number) it describes
+
+    'IMG_1.jpg.json'                          -> ('IMG_1.jpg', 0)
+    'IMG_1.jpg.supplemental-metadata.json'    -> ('IMG_1.jpg', 0)
+    'IMG_1.jpg.supplemental-me(2).json'       -> ('IMG_1.jpg', 2)
+    """
+    stem = json_file[:-len('.json')] if json_file.lower().endswith('.json') else json_file
+    duplicate = 0
+    match = _DUPLICATE_RE.match(stem)
+    if match:
+        stem, duplicate = match.group(1), int(match.group(2))
+
+    base, dot, suffix = stem.rpartition('.')
+    if dot and base and SUPPLEMENTAL_SUFFIX.startswith(suffix.lower()):
+        # Covers the full suffix, any truncation of it, and a name cut right after the dot
+        stem = base
+    return stem, duplicate
+
+
+def media_keys(media_file):
+    """
+    Return the sidecar keys that could describe a media file name, most specific first
+
+    'IMG_1(1).jpg' -> [('IMG_1(1).jpg', 0), ('IMG_1.jpg', 1)]
+    """
+    keys = [(media_file, 0)]
+    match = _MEDIA_DUPLICATE_RE.match(media_file)
+    if match:
+        keys.append((match.group(1) + match.group(3), int(match.group(2))))
+    return keys
+
+
+def truncated_keys(keys):
+    """
+    Yield the truncated forms of the given keys that Google could have written, longest first
+    """
+    for name, duplicate in keys:
+        for length in range(min(len(name) - 1, MAX_TRUNCATED_STEM_LENGTH), 0, -1):
+            yield name[:length], duplicate
+
+
+class SidecarIndex:
+    """
+    Per-directory lookup table from media file names to their JSON sidecars
+
+    Sidecars are indexed by their normalized (media name, duplicate number) key, so a media
+    file resolves with a handful of dict probes instead of a scan over every JSON file in the
+    directory. Sidecars whose names hit the 51 character limit are also kept in a second table
+    that is probed with the truncated prefixes of the media name. Anything else that merely
+    starts with the media name (the previous matching rule) is found by binary search over the
+    sorted names.
+
+    Usage:
+        index = SidecarIndex(json_files)
+        json_file = index.find('IMG_1234(1).jpg')
+    """
+
+    def __init__(self, json_files=()):
+        self._keys = {}
+        self._truncated = {}
+        self._names = []
+        for json_file in json_files:
+            self._add_key(json_file)
+            self._names.append(json_file)
+        self._names.sort()
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, json_file):
+        """Add a sidecar file name to the index"""
+        self._add_key(json_file)
+        bisect.insort(self._names, json_file)
+
+    def _add_key(self, json_file):
+        key = sidecar_key(json_file)
+        self._keys.setdefault(key, json_file)
+        if len(json_file) >= MAX_SIDECAR_NAME_LENGTH:
+            self._truncated.setdefault(key, json_file)
+
+    def find(self, media_file, prefix_fallback=True):
+        """
+        Return the sidecar file name for a media file name, or None if there is none
+
+        With prefix_fallback disabled only the Takeout naming rules are applied, which is what
+        callers that are still waiting for more sidecars to arrive need.
+        """
+        json_file = self._lookup(media_file, prefix_fallback)
+        if json_file:
+            logger.debug(f"Found matching JSON file '{json_file}' for media file '{media_file}'")
+        else:
+            logger.debug(f"No matching JSON file found for '{media_file}'")
+        return json_file
+
+    def _lookup(self, media_file, prefix_fallback):
+        keys = media_keys(media_file)
+        for key in keys:
+            json_file = self._keys.get(key)
+            if json_file:
+                return json_file
+
+        if self._truncated:
+            # Duplicate keys go first so 'name(1).ext' does not fall back on the original's sidecar
+            for key in truncated_keys(reversed(keys)):
+                json_file = self._truncated.get(key)
+                if json_file:
+                    return json_file
+
+        if prefix_fallback:
+            position = bisect.bisect_left(self._names, media_file)
+            if position < len(self._names) and self._names[position].startswith(media_file):
+                return self._names[position]
+        return None
+
+
+class SidecarPairer:
+    """
+    Pairs media files with their sidecars while both are still arriving, in any order
+
+    Used when entries are streamed out of several Takeout parts, where a media file and its
+    JSON sidecar can land far apart. Media files without a sidecar yet are held back as
+    pending, and released as soon as a sidecar that matches them shows up. Only names are
+    kept, never file contents.
+
+    Usage:
+        pairer = SidecarPairer()
+        for directory, name in entries:
+            adder = pairer.add_sidecar if name.endswith('.json') else pairer.add_media
+            for directory, media_file, json_file in adder(directory, name):
+                ...
+        pairs, unmatched = pairer.finish()
+    """
+
+    def __init__(self):
+        self._indexes = {}
+        self._pending_names = {}
+        self._pending_keys = {}
+
+    def add_media(self, directory, media_file):
+        """Register a media file; returns a list with its (directory, media, sidecar) pair if already known"""
+        index = self._indexes.get(directory)
+        json_file = index.find(media_file, prefix_fallback=False) if index else None
+        if json_file:
+            return [(directory, media_file, json_file)]
+
+        names = self._pending_names.setdefault(directory, [])
+        position = bisect.bisect_left(names, media_file)
+        if position < len(names) and names[position] == media_file:
+            # The same file from another Takeout part; it is paired once
+            return []
+        names.insert(position, media_file)
+        keys = self._pending_keys.setdefault(directory, {})
+        for key in media_keys(media_file):
+            keys.setdefault(key, set()).add(media_file)
+        return []
+
+    def add_sidecar(self, directory, json_file):
+        """Register a sidecar; returns the (directory, media, sidecar) pairs it completes"""
+        index = self._indexes.setdefault(directory, SidecarIndex())
+        index.add(json_file)
+
+        names = self._pending_names.get(directory)
+        if not names:
+            return []
+
+        stem, duplicate = sidecar_key(json_file)
+        candidates = set(self._pending_keys[directory].get((stem, duplicate), ()))
+        if len(json_file) >= MAX_SIDECAR_NAME_LENGTH:
+            # A truncated sidecar can belong to any pending media file that starts with its stem
+            position = bisect.bisect_left(names, stem)
+            while position < len(names) and names[position].startswith(stem):
+                candidates.add(names[position])
+                position += 1
+
+        pairs = []
+        for media_file in sorted(candidates):
+            if index.find(media_file, prefix_fallback=False) == json_file:
+                self._remove_pending(directory, media_file)
+                pairs.append((directory, media_file, json_file))
+        return pairs
+
+    def finish(self):
+        """
+        Resolve everything still pending once no more entries will arrive
+
+        Returns (pairs, unmatched) where unmatched is a list of (directory, media) tuples
+        """
+        pairs = []
+        unmatched = []
+        for directory, names in self._pending_names.items():
+            index = self._indexes.get(directory)
+            for media_file in names:
+                json_file = index.find(media_file) if index else None
+                if json_file:
+                    pairs.append((directory, media_file, json_file))
+                else:
+                    unmatched.append((directory, media_file))
+        self._pending_names = {}
+        self._pending_keys = {}
+        return pairs, unmatched
+
+    def _remove_pending(self, directory, media_file):
+        names = self._pending_names[directory]
+        del names[bisect.bisect_left(names, media_file)]
+        keys = self._pending_keys[directory]
+        for key in media_keys(media_file):
+            keys[key].discard(media_file)
+            if not keys[key]:
+                del keys[key]
@@ -0,0 +1,103 @@
+import datetime
+import hashlib
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state', 'exif-embed-state.sqlite')
+
+
+def sidecar_hash(json_path):
+    """Return a hex digest of a JSON sidecar's contents"""
+    with open(json_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def file_fingerprint(path, digest='', stat=None):
+    """
+    Return the (size, mtime_ns, digest) fingerprint used to decide whether a file changed
+
+    digest identifies the input the stage worked from: the sidecar hash for embedding, the
+    ZIP member CRC32 for extraction. A stat result already at hand, such as an inventory
+    FileEntry, saves the os.stat() call.
+    """
+    if stat is None:
+        stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns, digest
+
+
+class StateDB:
+    """
+    SQLite manifest of files each pipeline stage has already processed
+
+    Rows are keyed by (stage, absolute path) and store the fingerprint the file had right
+    after the stage finished with it. A later run can skip any file whose current
+    fingerprint still matches, and only process new or modified files.
+
+    Usage:
+        with StateDB() as state:
+            if not state.is_current('embed', path, file_fingerprint(path, digest)):
+                ...
+                state.record('embed', path, file_fingerprint(path, digest))
+    """
+
+    def __init__(self, path=DEFAULT_STATE_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                stage TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT NOT NULL DEFAULT '',
+                updated TEXT NOT NULL,
+                PRIMARY KEY (stage, path)
+            )
+        ''')
+        self._conn.commit()
+        logger.debug(f"Opened state database {path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def is_current(self, stage, path, fingerprint):
+        """Return True if the stage already processed this file and it has not changed since"""
+        return self.get(stage, path) == tuple(fingerprint)
+
+    def get(self, stage, path):
+        """Return the (size, mtime_ns, digest) fingerprint recorded for a file, or None"""
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, digest FROM files WHERE stage = ? AND path = ?',
+            (stage, self._key(path))
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def record(self, stage, path, fingerprint):
+        """Remember that the stage finished processing a file with the given fingerprint"""
+        size, mtime_ns, digest = fingerprint
+        self._conn.execute(
+            'INSERT OR REPLACE INTO files (stage, path, size, mtime_ns, digest, updated) VALUES (?, ?, ?, ?, ?, ?)',
+            (stage, self._key(path), size, mtime_ns, digest, datetime.datetime.now().isoformat(timespec='seconds'))
+        )
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
@@ -1,5 +1,5 @@
 
 @echo off
-python3 proces_media_files.py %*
-python3 update_creation_date.py %*
+python3 update_creation_date.py
+python3 upload_files.py %*
 pause
@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+from date_manifest import DateManifest
+
+
+@pytest.fixture
+def berlin_time(monkeypatch):
+    """Run in a time zone with DST, where 02:30 on 2021-03-28 does not exist"""
+    if not hasattr(time, 'tzset'):
+        pytest.skip("time.tzset is POSIX only")
+    monkeypatch.setenv('TZ', 'Europe/Berlin')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.mark.parametrize('date', [
+    '1950:06:01 08:15:00',
+    '1900:01:01 00:00:00',
+    # In the DST gap, and the repeated hour when the clocks go back
+    '2021:03:28 02:30:00',
+    '2021:10:31 02:30:00',
+    '2020:09:13 12:26:40',
+])
+def test_round_trip_through_saved_manifest(tmp_path, berlin_time, date):
+    path = str(tmp_path / 'dates.bin')
+    manifest = DateManifest(path)
+    manifest.add('/photos/scan.jpg', date)
+    assert manifest.get('/photos/scan.jpg') == date
+    manifest.save()
+
+    assert DateManifest(path).get('/photos/scan.jpg') == date
+
+
+def test_unknown_file_has_no_date(tmp_path):
+    assert DateManifest(str(tmp_path / 'dates.bin')).get('/photos/missing.jpg') is None
+
+
+def test_previous_format_is_ignored(tmp_path):
+    path = tmp_path / 'dates.bin'
+    path.write_bytes(b'EXIFDATE\x01' + bytes(16))
+    assert len(DateManifest(str(path))) == 0
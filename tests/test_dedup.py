@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from dedup import find_duplicates, hardlink
+from inventory import FileEntry
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'link'), reason="hard links are not available")
+
+
+@pytest.fixture
+def copies(tmp_path):
+    year = tmp_path / 'Photos from 2019'
+    album = tmp_path / 'Holiday'
+    year.mkdir()
+    album.mkdir()
+    data = os.urandom(300 * 1024)
+    (year / 'beach.jpg').write_bytes(data)
+    (album / 'beach.jpg').write_bytes(data)
+    (album / 'other.jpg').write_bytes(os.urandom(300 * 1024))
+    return str(year / 'beach.jpg'), str(album / 'beach.jpg')
+
+
+def entries(directory):
+    return [FileEntry.from_stat(os.path.join(root, name), name, os.stat(os.path.join(root, name)))
+            for root, _, files in os.walk(directory) for name in files]
+
+
+def test_find_duplicates_keeps_year_folder_copy(copies, tmp_path):
+    duplicates = find_duplicates(entries(tmp_path), jobs=2)
+    assert [[entry.path for entry in group] for _, group in duplicates] == [list(copies)]
+
+
+def test_hardlink_twice_leaves_no_temporary_files(copies):
+    kept, duplicate = copies
+    assert hardlink(kept, duplicate)
+    assert os.path.samefile(kept, duplicate)
+
+    assert not hardlink(kept, duplicate)
+    assert os.path.samefile(kept, duplicate)
+    assert sorted(os.listdir(os.path.dirname(duplicate))) == ['beach.jpg', 'other.jpg']
@@ -0,0 +1,33 @@
+import datetime
+import os
+
+import pytest
+
+from embed import file_creation_date
+from file_times import set_creation_time
+from inventory import FileEntry
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(b'')
+    return str(path)
+
+
+def test_creation_date_already_set(photo):
+    set_creation_time(photo, datetime.datetime(2019, 7, 14, 15, 30, 45))
+    # Only the access and modification times change; the inode change time stays today
+    assert file_creation_date(photo, '2019:07:14 15:30:45') is None
+    entry = FileEntry.from_stat(photo, 'photo.jpg', os.stat(photo))
+    assert file_creation_date(photo, '2019:07:14 15:30:45', entry) is None
+
+
+@pytest.mark.parametrize('image_date, expected', [
+    ('2019:07:14 15:30:45', datetime.datetime(2019, 7, 14, 15, 30, 45)),
+    ('2019:07:14 15:30:45.120+02:00', datetime.datetime(2019, 7, 14, 15, 30, 45, 120000)),
+    ('July 2019', datetime.datetime(1973, 12, 21)),
+])
+def test_creation_date_to_set(photo, image_date, expected):
+    os.utime(photo, (1_000_000_000, 1_000_000_000))
+    assert file_creation_date(photo, image_date) == expected
@@ -0,0 +1,48 @@
+from exiftool_batch import batched, group_commands, split_result
+from exiftool_session import ExifToolResult
+
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
+
+
+def test_group_commands_merges_identical_args():
+    commands = [
+        (['-Title=a'], 'one.jpg'),
+        (['-Title=b'], 'two.jpg'),
+        (['-Title=a'], 'three.jpg'),
+    ]
+    assert group_commands(commands) == [(['-Title=a'], ['one.jpg', 'three.jpg']), (['-Title=b'], ['two.jpg'])]
+
+
+def test_split_result_single_file():
+    result = ExifToolResult(1, '', 'Error: oops')
+    assert split_result(result, ['one.jpg']) == {'one.jpg': result}
+
+
+def test_split_result_attributes_lines_to_the_longest_matching_path():
+    # 'x - b.jpg' ends with ' - b.jpg', and '/d/a/b.jpg' ends with 'a/b.jpg'
+    paths = ['b.jpg', 'x - b.jpg', 'a/b.jpg', '/d/a/b.jpg']
+    stderr = '\n'.join([
+        'Warning: Bad MakerNotes directory - x - b.jpg',
+        'Error: Not a valid JPEG - /d/a/b.jpg',
+        'Warning: [minor] Ignored empty rational value - b.jpg',
+    ])
+    results = split_result(ExifToolResult(1, '    2 image files updated', stderr), paths)
+
+    assert results['x - b.jpg'].status == 0
+    assert results['x - b.jpg'].stderr == 'Warning: Bad MakerNotes directory - x - b.jpg'
+    assert results['/d/a/b.jpg'].status == 1
+    assert results['/d/a/b.jpg'].stderr == 'Error: Not a valid JPEG - /d/a/b.jpg'
+    assert results['b.jpg'].stderr == 'Warning: [minor] Ignored empty rational value - b.jpg'
+    assert results['a/b.jpg'].status == 0 and results['a/b.jpg'].stderr == ''
+
+
+def test_split_result_unattributed_failure_fails_every_file():
+    result = ExifToolResult(2, '', 'Error: Unknown option -Titel')
+    results = split_result(result, ['one.jpg', 'two.jpg'])
+    assert {path: (r.status, r.stderr) for path, r in results.items()} == {
+        'one.jpg': (2, 'Error: Unknown option -Titel'),
+        'two.jpg': (2, 'Error: Unknown option -Titel'),
+    }
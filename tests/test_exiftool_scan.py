@@ -0,0 +1,82 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+from exiftool_scan import iter_json_array, path_key, read_content_identifiers, read_dates
+
+pytestmark = pytest.mark.skipif(os.name == 'nt', reason="the fake ExifTool is a script run through its shebang")
+
+# Stands in for ExifTool: records its arguments and reports the tags a real scan would find with
+# them. With -fast2 ExifTool stops at the mdat atom, so a movie whose moov follows it has no
+# CreateDate, and MakerNotes (where the still of a live photo keeps its ContentIdentifier) are skipped.
+FAKE_EXIFTOOL = '''#!{python}
+import json, os, sys
+with open({log!r}, 'a') as log:
+    log.write(json.dumps(sys.argv[1:]) + '\\n')
+fast2 = '-fast2' in sys.argv
+records = []
+for directory, _, files in os.walk(sys.argv[-1]):
+    for name in sorted(files):
+        record = {{'SourceFile': os.path.join(directory, name)}}
+        if name.endswith('.jpg'):
+            record['DateTimeOriginal'] = '2019:07:14 15:30:45'
+            if not fast2:
+                record['ContentIdentifier'] = 'LIVE-1'
+        elif name.endswith('.mp4') and not (fast2 and 'moov-last' in name):
+            record['CreateDate'] = '2020:01:02 03:04:05'
+            record['ContentIdentifier'] = 'LIVE-1'
+        records.append(record)
+print(json.dumps(records))
+'''
+
+
+@pytest.fixture
+def exiftool(tmp_path):
+    log = tmp_path / 'calls.log'
+    path = tmp_path / 'exiftool'
+    path.write_text(FAKE_EXIFTOOL.format(python=sys.executable, log=str(log)))
+    path.chmod(0o755)
+
+    def calls():
+        return [json.loads(line) for line in log.read_text().splitlines()]
+    return str(path), calls
+
+
+@pytest.fixture
+def media(tmp_path):
+    directory = tmp_path / 'media'
+    directory.mkdir()
+    for name in ('photo.jpg', 'moov-first.mp4', 'moov-last.mp4'):
+        (directory / name).write_bytes(b'')
+    return directory
+
+
+def test_read_dates_finds_moov_after_mdat(exiftool, media):
+    executable, calls = exiftool
+    dates = read_dates(str(media), executable)
+
+    assert dates == {
+        path_key(media / 'photo.jpg'): '2019:07:14 15:30:45',
+        path_key(media / 'moov-first.mp4'): '2020:01:02 03:04:05',
+        path_key(media / 'moov-last.mp4'): '2020:01:02 03:04:05',
+    }
+    assert '-fast' in calls()[0] and '-fast2' not in calls()[0]
+
+
+def test_read_content_identifiers_includes_maker_notes(exiftool, media):
+    executable, calls = exiftool
+    identifiers = read_content_identifiers(str(media), ('.jpg', '.mp4'), executable)
+
+    assert identifiers[path_key(media / 'photo.jpg')] == 'LIVE-1'
+    assert identifiers[path_key(media / 'moov-last.mp4')] == 'LIVE-1'
+    assert '-fast2' not in calls()[0]
+    assert calls()[0][calls()[0].index('-ext') + 1] == 'jpg'
+
+
+def test_iter_json_array_across_chunks():
+    records = [{'SourceFile': f'/photos/{i}.jpg', 'Title': 'x' * i} for i in range(50)]
+    stream = io.StringIO(json.dumps(records, indent=2))
+    assert list(iter_json_array(stream, chunk_size=7)) == records
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import signal
+import sys
+
+import pytest
+
+from exiftool_session import AsyncExifToolSession, ExifToolSession
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import stub_exiftool  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def executable(tmp_path_factory):
+    return stub_exiftool.make_wrapper(str(tmp_path_factory.mktemp('stub')))
+
+
+@pytest.fixture
+def session(executable):
+    with ExifToolSession(executable, timeout=30) as session:
+        yield session
+
+
+@pytest.fixture
+def photo(tmp_path):
+    # Non-ASCII file names only survive if the block is sent, and read, as UTF-8
+    path = tmp_path / 'Ålesund – été 📷.jpg'
+    path.write_bytes(b'')
+    return str(path)
+
+
+def test_encode_block_escapes_newlines():
+    block = ExifToolSession._encode_block(['-Description=line one\nline two\\', '-Title=plain', 'a.jpg'], 7)
+    assert block.split('\n') == [
+        '-charset', 'filename=utf8', '-ec', '-Description=line one\\nline two\\\\', '-Title=plain', 'a.jpg',
+        '-echo4', '{ready7:${status}}', '-execute7', '',
+    ]
+    # Blocks without newlines are sent as they are
+    assert '-ec' not in ExifToolSession._encode_block(['-Title=plain', 'a.jpg'], 8).split('\n')
+
+
+def test_execute(session, photo):
+    result = session.execute(['-overwrite_original', '-Title=Été', photo])
+    assert result.ok
+    assert result.stdout == '    1 image files updated'
+    assert result.stderr == ''
+
+
+def test_newline_argument_stays_in_its_block(session, photo, tmp_path):
+    missing = str(tmp_path / 'missing.jpg')
+    results = session.execute_many([
+        ['-Description=first line\nsecond line', photo],
+        ['-Title=x', missing],
+        ['-Title=y', photo],
+    ])
+    # A newline that leaked through would have split the first block and shifted every result
+    assert [result.status for result in results] == [0, 1, 0]
+    assert results[1].stderr == f'Error: File not found - {missing}'
+    assert [result.stdout for result in results] == ['    1 image files updated', '    0 image files updated', '    1 image files updated']
+
+
+def test_non_zero_status(session, tmp_path):
+    result = session.execute(['-Title=x', str(tmp_path / 'missing.jpg')])
+    assert result.status == 1 and not result.ok
+    assert 'File not found' in result.stderr
+
+
+def test_restart_after_worker_died(session, photo):
+    session.execute(['-Title=x', photo])
+    process = session._process
+    process.kill()
+    process.wait()
+
+    result = session.execute(['-Title=y', photo])
+    assert result.ok
+    assert session._process is not process
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGSTOP'), reason="needs SIGSTOP to freeze the worker")
+def test_restart_after_timeout(executable, photo):
+    with ExifToolSession(executable, timeout=0.5) as session:
+        process = session._process
+        os.kill(process.pid, signal.SIGSTOP)
+
+        results = session.execute_many([['-Title=x', photo], ['-Title=y', photo]])
+        assert [result.status for result in results] == [-1, -1]
+        assert 'no response' in results[0].stderr
+        assert process.poll() is not None
+
+        # The next call starts a fresh worker whose output is not mixed up with the old one's
+        result = session.execute(['-Title=z', photo])
+        assert result.ok and result.stdout == '    1 image files updated'
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGSTOP'), reason="needs SIGSTOP to freeze the worker")
+def test_async_cancel_kills_the_busy_worker(executable, photo):
+    async def main():
+        async with AsyncExifToolSession(executable, timeout=5) as session:
+            process = session._process
+            os.kill(process.pid, signal.SIGSTOP)
+            task = asyncio.ensure_future(session.execute_many([['-Title=x', photo], ['-Title=y', photo]]))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert process.returncode is not None
+
+            # A fresh worker answers the next call, with none of the cancelled blocks' output
+            result = await session.execute(['-Title=z', photo])
+            assert result.ok and result.stdout == '    1 image files updated'
+
+    asyncio.run(main())
@@ -0,0 +1,534 @@
+"""
+Round-trip tests for native_writer: every file is written natively and read back with the
+small independent JPEG/TIFF/XMP and QuickTime parsers below.
+"""
+import datetime
+import os
+import struct
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+import native_writer
+from native_writer import NativeWriteUnsupported, write_metadata
+
+DATE = '2019:07:14 15:30:45'
+TAGS = {
+    'Title': 'Beach & <sunset>',
+    'ImageDescription': 'Evening at the beach',
+    'DateTimeOriginal': DATE,
+    'CreateDate': DATE,
+    'ModifyDate': DATE,
+    'GPSLatitude': '48.858222',
+    'GPSLatitudeRef': 'N',
+    'GPSLongitude': '-2.2945',
+    'GPSLongitudeRef': 'W',
+    'GPSAltitude': '35.5',
+    'Make': 'Apple',
+    'Model': 'iPhone 12',
+    'Software': 'Takeout',
+    'Copyright': 'Someone',
+    'Artist': 'Someone Else',
+}
+QUICKTIME_EPOCH = datetime.datetime(1904, 1, 1)
+
+
+def quicktime_seconds(value):
+    return int((datetime.datetime.strptime(value, '%Y:%m:%d %H:%M:%S') - QUICKTIME_EPOCH).total_seconds())
+
+
+# --- JPEG fixtures and readers ---
+
+# Entropy coded data never contains a bare 0xFF, so nothing in it can look like a marker
+SCAN_DATA = bytes(range(0x10, 0xF0)) * 8
+
+
+def segment(code, payload):
+    return bytes([0xFF, code]) + struct.pack('>H', len(payload) + 2) + payload
+
+
+def make_jpeg(extra_segments=(), progressive=False):
+    """Return a small JPEG: JFIF, the extra (code, payload) segments, tables, then one scan or two for progressive"""
+    data = b'\xff\xd8' + segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+    for code, payload in extra_segments:
+        data += segment(code, payload)
+    data += segment(0xDB, b'\x00' + bytes([1] * 64))
+    data += segment(0xC2 if progressive else 0xC0, struct.pack('>BHHB', 8, 16, 16, 1) + b'\x01\x11\x00')
+    data += segment(0xC4, b'\x00' + bytes(16) + b'')
+    data += segment(0xDA, struct.pack('>B', 1) + b'\x01\x00\x00\x3f\x00') + SCAN_DATA
+    if progressive:
+        data += segment(0xC4, b'\x10' + bytes(16))
+        data += segment(0xDA, struct.pack('>B', 1) + b'\x01\x00\x01\x3f\x00') + SCAN_DATA[::-1]
+    return data + b'\xff\xd9'
+
+
+def jpeg_header_segments(data):
+    """Return ([(code, payload)] before the first scan, offset of the first SOS marker)"""
+    assert data[:2] == b'\xff\xd8'
+    offset = 2
+    segments = []
+    while True:
+        code = data[offset + 1]
+        if code == 0xDA:
+            return segments, offset
+        length = struct.unpack_from('>H', data, offset + 2)[0]
+        segments.append((code, data[offset + 4:offset + 2 + length]))
+        offset += 2 + length
+
+
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1}
+
+
+def read_ifd(tiff, offset, endian):
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    values = {}
+    for i in range(count):
+        tag, type_, value_count = struct.unpack_from(endian + 'HHI', tiff, offset + 2 + i * 12)
+        size = TYPE_SIZES[type_] * value_count
+        field = offset + 2 + i * 12 + 8
+        start = field if size <= 4 else struct.unpack_from(endian + 'I', tiff, field)[0]
+        raw = tiff[start:start + size]
+        if type_ == 2:
+            values[tag] = raw.rstrip(b'\x00').decode('utf-8')
+        elif type_ == 3:
+            values[tag] = list(struct.unpack(endian + 'H' * value_count, raw))
+        elif type_ == 4:
+            values[tag] = list(struct.unpack(endian + 'I' * value_count, raw))
+        elif type_ == 5:
+            numbers = struct.unpack(endian + 'I' * (2 * value_count), raw)
+            values[tag] = [numbers[j] / numbers[j + 1] for j in range(0, len(numbers), 2)]
+        else:
+            values[tag] = raw
+    return values
+
+
+def read_exif(data):
+    """Return (byte order, IFD0, Exif IFD, GPS IFD) of a JPEG's APP1 EXIF segment"""
+    segments, _ = jpeg_header_segments(data)
+    exif = [payload for code, payload in segments if code == 0xE1 and payload.startswith(b'Exif\x00\x00')]
+    assert len(exif) == 1
+    tiff = exif[0][6:]
+    endian = '<' if tiff[:2] == b'II' else '>'
+    ifd0 = read_ifd(tiff, struct.unpack_from(endian + 'I', tiff, 4)[0], endian)
+    exif_ifd = read_ifd(tiff, ifd0[0x8769][0], endian) if 0x8769 in ifd0 else {}
+    gps_ifd = read_ifd(tiff, ifd0[0x8825][0], endian) if 0x8825 in ifd0 else {}
+    return tiff[:2], ifd0, exif_ifd, gps_ifd
+
+
+def read_xmp(data):
+    segments, _ = jpeg_header_segments(data)
+    header = b'http://ns.adobe.com/xap/1.0/\x00'
+    packets = [payload[len(header):] for code, payload in segments if code == 0xE1 and payload.startswith(header)]
+    assert len(packets) == 1
+    return ElementTree.fromstring(packets[0].decode('utf-8').split('?>', 1)[1].rsplit('<?xpacket', 1)[0])
+
+
+XMP_NAMESPACES = {
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+}
+
+
+def decimal_degrees(dms):
+    degrees, minutes, seconds = dms
+    return degrees + minutes / 60 + seconds / 3600
+
+
+def little_endian_exif():
+    """APP1 EXIF payload with Orientation and Make in IFD0 and ExposureTime in the Exif IFD, as a camera writes it"""
+    make = b'OldMake\x00'
+    ifd0_offset = 8
+    ifd0_size = 2 + 3 * 12 + 4
+    make_offset = ifd0_offset + ifd0_size
+    exif_offset = make_offset + len(make)
+    exposure_offset = exif_offset + 2 + 12 + 4
+    tiff = b'II*\x00' + struct.pack('<I', ifd0_offset)
+    tiff += struct.pack('<H', 3)
+    tiff += struct.pack('<HHIHH', 0x0112, 3, 1, 6, 0)
+    tiff += struct.pack('<HHII', 0x010F, 2, len(make), make_offset)
+    tiff += struct.pack('<HHII', 0x8769, 4, 1, exif_offset)
+    tiff += struct.pack('<I', 0) + make
+    tiff += struct.pack('<H', 1) + struct.pack('<HHII', 0x829A, 5, 1, exposure_offset) + struct.pack('<I', 0)
+    tiff += struct.pack('<II', 1, 125)
+    return b'Exif\x00\x00' + tiff
+
+
+@pytest.fixture
+def jpeg(tmp_path):
+    def create(name='photo.jpg', **kwargs):
+        path = tmp_path / name
+        path.write_bytes(make_jpeg(**kwargs))
+        os.utime(path, (1_000_000_000, 1_000_000_000))
+        return str(path)
+    return create
+
+
+def test_jpeg_exif_round_trip(jpeg):
+    path = jpeg()
+    original = open(path, 'rb').read()
+
+    result = write_metadata(path, TAGS)
+
+    data = open(path, 'rb').read()
+    assert result.bytes_written == len(data) and not result.in_place
+    byte_order, ifd0, exif_ifd, gps = read_exif(data)
+    assert byte_order == b'MM'
+    assert ifd0[0x010E] == 'Evening at the beach'
+    assert (ifd0[0x010F], ifd0[0x0110], ifd0[0x0131]) == ('Apple', 'iPhone 12', 'Takeout')
+    assert (ifd0[0x013B], ifd0[0x8298]) == ('Someone Else', 'Someone')
+    assert ifd0[0x0132] == DATE
+    assert exif_ifd[0x9003] == DATE and exif_ifd[0x9004] == DATE
+    assert exif_ifd[0x9000] == b'0232'
+    assert (gps[0x0001], gps[0x0003]) == ('N', 'W')
+    assert decimal_degrees(gps[0x0002]) == pytest.approx(48.858222, abs=1e-5)
+    assert decimal_degrees(gps[0x0004]) == pytest.approx(2.2945, abs=1e-5)
+    assert gps[0x0005] == b'\x00' and gps[0x0006] == [pytest.approx(35.5)]
+
+    # The image data is copied through unchanged, and the modification time is kept
+    assert data[jpeg_header_segments(data)[1]:] == original[jpeg_header_segments(original)[1]:]
+    assert os.stat(path).st_mtime == 1_000_000_000
+
+
+def test_jpeg_exif_readable_by_pillow(jpeg):
+    image_module = pytest.importorskip('PIL.Image')
+    path = jpeg()
+    write_metadata(path, TAGS)
+
+    with image_module.open(path) as image:
+        exif = image.getexif()
+        assert exif[0x010F] == 'Apple'
+        assert exif.get_ifd(0x8769)[0x9003] == DATE
+        assert exif.get_ifd(0x8825)[0x0001] == 'N'
+
+
+def test_jpeg_xmp_title(jpeg):
+    path = jpeg()
+    write_metadata(path, {'Title': 'Beach & <sunset>'})
+
+    root = read_xmp(open(path, 'rb').read())
+    title = root.find('.//dc:title/rdf:Alt/rdf:li', XMP_NAMESPACES)
+    assert title.text == 'Beach & <sunset>'
+    assert root.find('.//dc:subject', XMP_NAMESPACES) is None
+
+
+def test_jpeg_replaces_xmp_of_earlier_versions(jpeg):
+    # Earlier versions also wrote the keywords as dc:subject
+    packet = ('<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+              '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+              '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+              '<dc:title><rdf:Alt><rdf:li xml:lang="x-default">Old</rdf:li></rdf:Alt></dc:title>'
+              '<dc:subject><rdf:Bag><rdf:li>Person A</rdf:li></rdf:Bag></dc:subject>'
+              '</rdf:Description></rdf:RDF></x:xmpmeta><?xpacket end="w"?>')
+    path = jpeg(extra_segments=[(0xE1, b'http://ns.adobe.com/xap/1.0/\x00' + packet.encode('utf-8'))])
+    write_metadata(path, {'Title': 'New'})
+
+    root = read_xmp(open(path, 'rb').read())
+    assert [li.text for li in root.findall('.//dc:title/rdf:Alt/rdf:li', XMP_NAMESPACES)] == ['New']
+    assert root.find('.//dc:subject', XMP_NAMESPACES) is None
+
+
+def test_repeated_rewrites_grow_exif_until_fallback(jpeg):
+    path = jpeg()
+    sizes = []
+    with pytest.raises(NativeWriteUnsupported):
+        for _ in range(1000):
+            write_metadata(path, TAGS)
+            data = open(path, 'rb').read()
+            sizes.append(len(data))
+    # Every rewrite leaves the replaced IFDs behind, and the file is still readable at the cap
+    assert sizes == sorted(sizes) and len(set(sizes)) == len(sizes)
+    assert read_exif(data)[1][0x010F] == 'Apple'
+    assert open(path, 'rb').read() == data
+
+
+def test_jpeg_rewrite_replaces_metadata_segments(jpeg):
+    path = jpeg()
+    write_metadata(path, {'Title': 'First', 'Make': 'One'})
+    write_metadata(path, {'Title': 'Second', 'Make': 'Two'})
+
+    data = open(path, 'rb').read()
+    _, ifd0, _, _ = read_exif(data)
+    assert ifd0[0x010F] == 'Two'
+    assert read_xmp(data).find('.//dc:title/rdf:Alt/rdf:li', XMP_NAMESPACES).text == 'Second'
+    # The new segments follow the JFIF APP0 segment
+    codes = [code for code, _ in jpeg_header_segments(data)[0]]
+    assert codes[:3] == [0xE0, 0xE1, 0xE1]
+
+
+def test_jpeg_keeps_existing_exif(jpeg):
+    path = jpeg(extra_segments=[(0xE1, little_endian_exif())])
+    write_metadata(path, {'DateTimeOriginal': DATE, 'Model': 'New model'})
+
+    byte_order, ifd0, exif_ifd, _ = read_exif(open(path, 'rb').read())
+    assert byte_order == b'II'
+    assert ifd0[0x0112] == [6]
+    assert ifd0[0x010F] == 'OldMake'
+    assert ifd0[0x0110] == 'New model'
+    assert exif_ifd[0x829A] == [pytest.approx(1 / 125)]
+    assert exif_ifd[0x9003] == DATE
+
+
+def test_progressive_jpeg_keeps_every_scan(jpeg):
+    path = jpeg(progressive=True)
+    original = open(path, 'rb').read()
+    write_metadata(path, {'Title': 'Progressive', 'DateTimeOriginal': DATE})
+
+    data = open(path, 'rb').read()
+    # Everything from the first scan on, including the tables between scans, is untouched
+    assert data[jpeg_header_segments(data)[1]:] == original[jpeg_header_segments(original)[1]:]
+    assert 0xC2 in [code for code, _ in jpeg_header_segments(data)[0]]
+    assert read_exif(data)[2][0x9003] == DATE
+
+
+def _existing_dc_xmp():
+    packet = ('<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+              '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:creator>Camera</dc:creator>'
+              '</rdf:Description></rdf:RDF></x:xmpmeta>')
+    return b'http://ns.adobe.com/xap/1.0/\x00' + packet.encode('utf-8')
+
+
+@pytest.mark.parametrize('data, tags', [
+    pytest.param(b'\x89PNG\r\n\x1a\n' + bytes(32), {'Title': 'x'}, id='not-a-jpeg'),
+    pytest.param(b'\xff\xd8' + segment(0xE0, b'JFIF\x00') + b'\xff\xd9', {'Title': 'x'}, id='no-image-data'),
+    pytest.param(b'\xff\xd8\xff\xe0\x00\x40JFIF', {'Title': 'x'}, id='truncated-segment'),
+    pytest.param(b'\xff\xd8\x00\x00', {'Title': 'x'}, id='corrupt-marker'),
+    pytest.param(make_jpeg(), {'ImageDescription': 'x' * 70000}, id='metadata-too-large'),
+    pytest.param(make_jpeg([(0xE1, b'Exif\x00\x00XX*\x00')]), {'Make': 'x'}, id='unknown-byte-order'),
+    pytest.param(make_jpeg([(0xE1, _existing_dc_xmp())]), {'Title': 'x'}, id='foreign-dublin-core-xmp'),
+    pytest.param(make_jpeg(), {'Rating': '5'}, id='unsupported-tag'),
+    # ExifTool writes IPTC:Keywords, which this writer does not
+    pytest.param(make_jpeg(), {'Title': 'x', 'Keywords': 'Person A'}, id='keywords'),
+    pytest.param(make_jpeg(), {'DateTimeOriginal': '2019-07-14 15:30'}, id='unparsable-date'),
+])
+def test_jpeg_fallbacks_leave_file_untouched(tmp_path, data, tags):
+    path = tmp_path / 'odd.jpg'
+    path.write_bytes(data)
+    with pytest.raises(NativeWriteUnsupported):
+        write_metadata(str(path), tags)
+    assert path.read_bytes() == data
+    assert os.listdir(tmp_path) == ['odd.jpg']
+
+
+def test_unsupported_extension(tmp_path):
+    path = tmp_path / 'image.png'
+    path.write_bytes(b'\x89PNG\r\n\x1a\n')
+    with pytest.raises(NativeWriteUnsupported):
+        write_metadata(str(path), {'Title': 'x'})
+
+
+# --- QuickTime fixtures and readers ---
+
+CHUNKS = [b'first chunk of media data', b'second chunk', b'third and last chunk']
+
+
+def atom(type_, payload):
+    return struct.pack('>I4s', len(payload) + 8, type_) + payload
+
+
+def header_atom(type_, version, tail):
+    """mvhd/tkhd/mdhd with zero dates, followed by the rest of the header"""
+    dates = struct.pack('>QQ', 0, 0) if version == 1 else struct.pack('>II', 0, 0)
+    return atom(type_, bytes([version, 0, 0, 0]) + dates + tail)
+
+
+def chunk_offset_atom(type_, offsets):
+    entry = '>Q' if type_ == b'co64' else '>I'
+    return atom(type_, struct.pack('>II', 0, len(offsets)) + b''.join(struct.pack(entry, offset) for offset in offsets))
+
+
+def make_moov(offsets, version=0, user_data=b''):
+    duration = struct.pack('>Q' if version == 1 else '>I', 1000)
+    mvhd = header_atom(b'mvhd', version, struct.pack('>I', 1000) + duration + bytes(80))
+    tracks = b''
+    for track_id, offset_type in enumerate((b'stco', b'co64'), start=1):
+        tkhd = header_atom(b'tkhd', version, struct.pack('>II', track_id, 0) + duration + bytes(60))
+        mdhd = header_atom(b'mdhd', version, struct.pack('>I', 1000) + duration + struct.pack('>HH', 0x55C4, 0))
+        stbl = atom(b'stbl', chunk_offset_atom(offset_type, offsets))
+        tracks += atom(b'trak', tkhd + atom(b'mdia', mdhd + atom(b'minf', stbl)))
+    return atom(b'moov', mvhd + tracks + (atom(b'udta', user_data) if user_data else b''))
+
+
+def make_movie(moov_first=True, free=0, version=0, user_data=b'', extra_atoms=b''):
+    """Return a movie whose two tracks (stco and co64) point at the CHUNKS stored in its mdat"""
+    ftyp = atom(b'ftyp', b'isom\x00\x00\x00\x00isom')
+    mdat_payload = b''.join(CHUNKS)
+    free_atom = atom(b'free', bytes(free - 8)) if free else b''
+    moov_size = len(make_moov([0] * len(CHUNKS), version, user_data))
+    if moov_first:
+        mdat_offset = len(ftyp) + moov_size + len(free_atom)
+    else:
+        mdat_offset = len(ftyp)
+    offsets = []
+    position = mdat_offset + 8
+    for chunk in CHUNKS:
+        offsets.append(position)
+        position += len(chunk)
+    moov = make_moov(offsets, version, user_data)
+    mdat = atom(b'mdat', mdat_payload)
+    body = moov + free_atom + mdat if moov_first else mdat + moov + free_atom
+    return ftyp + body + extra_atoms
+
+
+def walk_atoms(data, start=0, end=None, containers=(b'moov', b'trak', b'mdia', b'minf', b'stbl', b'udta')):
+    """Yield (type, offset, size) for every atom, descending into container atoms"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, type_ = struct.unpack_from('>I4s', data, offset)
+        yield type_, offset, size
+        if type_ in containers:
+            yield from walk_atoms(data, offset + 8, offset + size, containers)
+        offset += size
+
+
+def top_level(data):
+    return [(type_, offset, size) for type_, offset, size in walk_atoms(data, containers=())]
+
+
+def header_dates(data, type_):
+    dates = []
+    for found, offset, _ in walk_atoms(data):
+        if found == type_:
+            version = data[offset + 8]
+            dates.append(struct.unpack_from('>QQ' if version == 1 else '>II', data, offset + 12))
+    return dates
+
+
+def chunk_offsets(data):
+    offsets = {}
+    for type_, offset, _ in walk_atoms(data):
+        if type_ in (b'stco', b'co64'):
+            count = struct.unpack_from('>I', data, offset + 12)[0]
+            entry = '>Q' if type_ == b'co64' else '>I'
+            size = 8 if type_ == b'co64' else 4
+            offsets[type_] = [struct.unpack_from(entry, data, offset + 16 + i * size)[0] for i in range(count)]
+    return offsets
+
+
+def user_data(data):
+    values = {}
+    for type_, offset, size in walk_atoms(data):
+        if type_ == b'udta':
+            for child, child_offset, child_size in walk_atoms(data, offset + 8, offset + size, containers=()):
+                payload = data[child_offset + 8:child_offset + child_size]
+                length = struct.unpack_from('>H', payload)[0]
+                values[child] = payload[4:4 + length].decode('utf-8')
+    return values
+
+
+def assert_chunks_intact(data):
+    offsets = chunk_offsets(data)
+    assert set(offsets) == {b'stco', b'co64'}
+    for track_offsets in offsets.values():
+        for offset, chunk in zip(track_offsets, CHUNKS):
+            assert data[offset:offset + len(chunk)] == chunk
+
+
+@pytest.fixture
+def movie(tmp_path):
+    def create(name='movie.mp4', **kwargs):
+        path = tmp_path / name
+        path.write_bytes(make_movie(**kwargs))
+        os.utime(path, (1_000_000_000, 1_000_000_000))
+        return str(path)
+    return create
+
+
+@pytest.mark.parametrize('version', [0, 1])
+def test_movie_track_and_media_header_dates(movie, version):
+    path = movie(version=version)
+    write_metadata(path, {'CreateDate': DATE, 'ModifyDate': '2020:01:02 03:04:05'})
+
+    data = open(path, 'rb').read()
+    expected = (quicktime_seconds(DATE), quicktime_seconds('2020:01:02 03:04:05'))
+    assert header_dates(data, b'mvhd') == [expected]
+    assert header_dates(data, b'tkhd') == [expected, expected]
+    assert header_dates(data, b'mdhd') == [expected, expected]
+    assert os.stat(path).st_mtime == 1_000_000_000
+
+
+def test_movie_user_data(movie):
+    existing = atom(b'\xa9nam', struct.pack('>HH', 3, 0x55C4) + b'Old') + atom(b'\xa9too', struct.pack('>HH', 4, 0x55C4) + b'Lavf')
+    path = movie(user_data=existing)
+    write_metadata(path, TAGS)
+
+    values = user_data(open(path, 'rb').read())
+    assert values[b'\xa9nam'] == 'Beach & <sunset>'
+    assert values[b'\xa9des'] == 'Evening at the beach'
+    assert (values[b'\xa9mak'], values[b'\xa9mod'], values[b'\xa9swr']) == ('Apple', 'iPhone 12', 'Takeout')
+    assert (values[b'\xa9ART'], values[b'\xa9cpy']) == ('Someone Else', 'Someone')
+    assert values[b'\xa9day'] == '2019-07-14T15:30:45'
+    assert values[b'\xa9xyz'] == '+48.8582-002.2945+35.500/'
+    # Atoms the writer does not manage are kept
+    assert values[b'\xa9too'] == 'Lavf'
+
+
+def test_moov_growth_before_mdat_shifts_chunk_offsets(movie):
+    path = movie(moov_first=True)
+    original = open(path, 'rb').read()
+    write_metadata(path, TAGS)
+
+    data = open(path, 'rb').read()
+    assert_chunks_intact(data)
+    types = [type_ for type_, _, _ in top_level(data)]
+    assert types == [b'ftyp', b'moov', b'free', b'mdat']
+    _, free_offset, free_size = top_level(data)[2]
+    assert free_size == native_writer.MOOV_PADDING
+    delta = top_level(data)[3][1] - top_level(original)[2][1]
+    assert delta > 0
+    assert chunk_offsets(data)[b'stco'] == [offset + delta for offset in chunk_offsets(original)[b'stco']]
+
+    # The padding left behind lets the next edit be patched in place
+    size = len(data)
+    result = write_metadata(path, {'Title': 'Second edit'})
+    assert result.in_place
+    assert os.path.getsize(path) == size
+    assert_chunks_intact(open(path, 'rb').read())
+
+
+def test_moov_after_mdat_keeps_chunk_offsets(movie):
+    path = movie(moov_first=False)
+    original = open(path, 'rb').read()
+    write_metadata(path, TAGS)
+
+    data = open(path, 'rb').read()
+    assert chunk_offsets(data) == chunk_offsets(original)
+    assert_chunks_intact(data)
+    assert [type_ for type_, _, _ in top_level(data)] == [b'ftyp', b'mdat', b'moov', b'free']
+
+
+def test_in_place_patch_uses_free_atom(movie):
+    path = movie(moov_first=True, free=4096)
+    original = open(path, 'rb').read()
+    mdat_offset = top_level(original)[3][1]
+
+    result = write_metadata(path, TAGS)
+
+    data = open(path, 'rb').read()
+    assert result.in_place
+    assert len(data) == len(original)
+    # The media data did not move, and the rest of the old space is one free atom again
+    assert data[mdat_offset:] == original[mdat_offset:]
+    (_, moov_offset, moov_size), (free_type, free_offset, free_size) = top_level(data)[1:3]
+    assert free_type == b'free' and free_offset == moov_offset + moov_size
+    assert free_offset + free_size == mdat_offset
+    assert_chunks_intact(data)
+    assert user_data(data)[b'\xa9nam'] == 'Beach & <sunset>'
+    assert os.stat(path).st_mtime == 1_000_000_000
+
+
+@pytest.mark.parametrize('data, tags', [
+    pytest.param(make_movie(extra_atoms=atom(b'moof', atom(b'mfhd', bytes(8))) + atom(b'mdat', b'fragment')),
+                 {'Title': 'x'}, id='fragmented'),
+    pytest.param(make_movie() + make_moov([0]), {'Title': 'x'}, id='two-moov-atoms'),
+    pytest.param(make_movie()[:-10], {'Title': 'x'}, id='truncated'),
+    pytest.param(make_movie(), {'Keywords': 'x'}, id='unsupported-tag'),
+    pytest.param(make_movie(), {'CreateDate': '1900:01:01 00:00:00'}, id='date-before-1904'),
+])
+def test_quicktime_fallbacks_leave_file_untouched(tmp_path, data, tags):
+    path = tmp_path / 'odd.mov'
+    path.write_bytes(data)
+    with pytest.raises(NativeWriteUnsupported):
+        write_metadata(str(path), tags)
+    assert path.read_bytes() == data
+    assert os.listdir(tmp_path) == ['odd.mov']
@@ -0,0 +1,59 @@
+import argparse
+import threading
+
+import pipeline
+
+
+def pipeline_args(tmp_path):
+    (tmp_path / 'zips').mkdir()
+    (tmp_path / 'extracts').mkdir()
+    return argparse.Namespace(
+        source=str(tmp_path / 'zips'), target=str(tmp_path / 'extracts'), livefiles=str(tmp_path / 'livefiles'),
+        jobs=1, batch_size=2, engine='exiftool', defaultdate='1973:12:21 00:00:00', delete_archives=False,
+        state_db=str(tmp_path / 'state.sqlite'), date_manifest=str(tmp_path / 'dates.bin'), inventory=None, resume=True,
+        destination=None, upload_source=None, upload_target='', remote='onedrive', operation='copy', incremental=False)
+
+
+def test_stage_without_files_logs():
+    stage = pipeline.StageStats('dates')
+    stage.start()
+    stage.log()
+    assert stage.count == 0
+
+
+def test_failed_date_stage_does_not_block_embedding(tmp_path, monkeypatch):
+    def failing_date_stage(self):
+        raise RuntimeError("date stage failed")
+
+    def embed_pairs(pairs, *args, on_done, **kwargs):
+        list(pairs)
+        # Many more files than the date queue holds
+        for i in range(100):
+            on_done(str(tmp_path / 'extracts' / f'{i}.jpg'))
+
+    monkeypatch.setattr(pipeline.Pipeline, 'date_stage', failing_date_stage)
+    monkeypatch.setattr(pipeline.embed, 'embed_pairs', embed_pairs)
+    run = pipeline.Pipeline(pipeline_args(tmp_path))
+    result = []
+    thread = threading.Thread(target=lambda: result.append(run.run()), daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+
+    assert result == [False]
+    assert [str(error) for error in run.errors] == ["date stage failed"]
+    assert run.stats['embed'].count == 100
+
+
+def test_failed_date_scan_fails_only_its_files(tmp_path, monkeypatch):
+    def collect_dates(files, manifest=None, bulk_read=True):
+        raise OSError("ExifTool not found")
+
+    monkeypatch.setattr(pipeline.update_creation_date, 'collect_dates', collect_dates)
+    run = pipeline.Pipeline(pipeline_args(tmp_path))
+    files = [str(tmp_path / 'a.jpg'), str(tmp_path / 'b.jpg')]
+
+    resolved = list(run.resolve_dates(files))
+    assert [(path, date, str(error)) for path, date, error in resolved] == [
+        (files[0], None, "ExifTool not found"),
+        (files[1], None, "ExifTool not found"),
+    ]
@@ -0,0 +1,120 @@
+import pytest
+
+from sidecar_index import MAX_SIDECAR_NAME_LENGTH, SidecarIndex, SidecarPairer, media_keys, sidecar_key, truncated_keys
+
+# Takeout cuts sidecar names at 51 characters: 46 for the stem and '.json'
+LONG_NAME = 'PXL_20210101_123456789_Some_Very_Long_Name_Part.jpg'
+LONG_SIDECAR = LONG_NAME[:MAX_SIDECAR_NAME_LENGTH - len('.json')] + '.json'
+LONG_DUPLICATE = LONG_NAME[:-len('.jpg')] + '(1).jpg'
+LONG_DUPLICATE_SIDECAR = LONG_NAME[:MAX_SIDECAR_NAME_LENGTH - len('.json')] + '(1).json'
+
+
+def old_lookup(media_file, json_files):
+    """The lookup this index replaced: the first JSON file, in listing order, that starts with the media name"""
+    for json_file in json_files:
+        if json_file.startswith(media_file) and json_file.endswith('.json'):
+            return json_file
+    return None
+
+
+@pytest.mark.parametrize('json_files, media_file, expected, old', [
+    pytest.param(['IMG_1.jpg.json'], 'IMG_1.jpg', 'IMG_1.jpg.json', 'IMG_1.jpg.json', id='plain'),
+    pytest.param(['IMG_1.jpg.supplemental-metadata.json'], 'IMG_1.jpg',
+                 'IMG_1.jpg.supplemental-metadata.json', 'IMG_1.jpg.supplemental-metadata.json', id='supplemental-metadata'),
+    pytest.param(['IMG_1.jpg.supplemental-me.json'], 'IMG_1.jpg',
+                 'IMG_1.jpg.supplemental-me.json', 'IMG_1.jpg.supplemental-me.json', id='truncated-supplemental-suffix'),
+    pytest.param(['IMG_1.jpg(1).json', 'IMG_1.jpg.json'], 'IMG_1(1).jpg',
+                 'IMG_1.jpg(1).json', None, id='duplicate-suffix'),
+    # The old rule took whichever sidecar was listed first, here the duplicate's
+    pytest.param(['IMG_1.jpg(1).json', 'IMG_1.jpg.json'], 'IMG_1.jpg',
+                 'IMG_1.jpg.json', 'IMG_1.jpg(1).json', id='original-next-to-duplicate'),
+    pytest.param(['IMG_1.jpg.supplemental-metadata(2).json', 'IMG_1.jpg.supplemental-metadata.json'], 'IMG_1(2).jpg',
+                 'IMG_1.jpg.supplemental-metadata(2).json', None, id='duplicate-supplemental-metadata'),
+    pytest.param([LONG_SIDECAR], LONG_NAME, LONG_SIDECAR, None, id='51-character-truncation'),
+    pytest.param([LONG_SIDECAR, LONG_DUPLICATE_SIDECAR], LONG_DUPLICATE,
+                 LONG_DUPLICATE_SIDECAR, None, id='truncated-duplicate'),
+    pytest.param(['IMG_1.jpg.edited-by-app.json'], 'IMG_1.jpg',
+                 'IMG_1.jpg.edited-by-app.json', 'IMG_1.jpg.edited-by-app.json', id='prefix-fallback'),
+    pytest.param(['IMG_1.jpg.json'], 'IMG_2.jpg', None, None, id='no-sidecar'),
+    pytest.param(['IMG_1.jpg.json'], 'IMG_1-edited.jpg', None, None, id='edited-copy'),
+])
+def test_find(json_files, media_file, expected, old):
+    assert old_lookup(media_file, json_files) == old
+    assert SidecarIndex(json_files).find(media_file) == expected
+
+    # Adding the names one by one builds the same index
+    index = SidecarIndex()
+    for json_file in json_files:
+        index.add(json_file)
+    assert index.find(media_file) == expected
+
+
+def test_prefix_fallback_can_be_disabled():
+    index = SidecarIndex(['IMG_1.jpg.edited-by-app.json'])
+    assert index.find('IMG_1.jpg', prefix_fallback=False) is None
+
+
+@pytest.mark.parametrize('json_file, key', [
+    ('IMG_1.jpg.json', ('IMG_1.jpg', 0)),
+    ('IMG_1.jpg.supplemental-metadata.json', ('IMG_1.jpg', 0)),
+    ('IMG_1.jpg.supplemental-me(2).json', ('IMG_1.jpg', 2)),
+    ('IMG_1.jpg.s.json', ('IMG_1.jpg', 0)),
+    ('IMG_1.jpg..json', ('IMG_1.jpg', 0)),
+    ('IMG_1.jpg(1).json', ('IMG_1.jpg', 1)),
+])
+def test_sidecar_key(json_file, key):
+    assert sidecar_key(json_file) == key
+
+
+def test_media_and_truncated_keys():
+    assert media_keys('IMG_1(1).jpg') == [('IMG_1(1).jpg', 0), ('IMG_1.jpg', 1)]
+    assert media_keys('IMG_1.jpg') == [('IMG_1.jpg', 0)]
+    assert list(truncated_keys([('abcd', 3)])) == [('abc', 3), ('ab', 3), ('a', 3)]
+    assert len(next(truncated_keys([(LONG_NAME, 0)]))[0]) == MAX_SIDECAR_NAME_LENGTH - len('.json')
+
+
+def test_pairer_media_before_sidecar():
+    pairer = SidecarPairer()
+    assert pairer.add_media('a', 'IMG_1.jpg') == []
+    assert pairer.add_sidecar('a', 'IMG_1.jpg.json') == [('a', 'IMG_1.jpg', 'IMG_1.jpg.json')]
+    assert pairer.finish() == ([], [])
+
+
+def test_pairer_sidecar_before_media():
+    pairer = SidecarPairer()
+    assert pairer.add_sidecar('a', 'IMG_1.jpg.json') == []
+    assert pairer.add_media('a', 'IMG_1.jpg') == [('a', 'IMG_1.jpg', 'IMG_1.jpg.json')]
+    # The sidecar of another directory does not match
+    assert pairer.add_media('b', 'IMG_1.jpg') == []
+    assert pairer.finish() == ([], [('b', 'IMG_1.jpg')])
+
+
+def test_pairer_waits_for_the_duplicate_sidecar():
+    pairer = SidecarPairer()
+    pairer.add_media('a', 'IMG_1(1).jpg')
+    # The original's sidecar must not be taken for the duplicate's
+    assert pairer.add_sidecar('a', 'IMG_1.jpg.json') == []
+    assert pairer.add_sidecar('a', 'IMG_1.jpg(1).json') == [('a', 'IMG_1(1).jpg', 'IMG_1.jpg(1).json')]
+
+
+def test_pairer_truncated_sidecar():
+    pairer = SidecarPairer()
+    pairer.add_media('a', LONG_NAME)
+    assert pairer.add_sidecar('a', LONG_SIDECAR) == [('a', LONG_NAME, LONG_SIDECAR)]
+
+
+def test_pairer_prefix_fallback_at_finish():
+    pairer = SidecarPairer()
+    pairer.add_media('a', 'IMG_1.jpg')
+    assert pairer.add_sidecar('a', 'IMG_1.jpg.edited-by-app.json') == []
+    assert pairer.finish() == ([('a', 'IMG_1.jpg', 'IMG_1.jpg.edited-by-app.json')], [])
+
+
+def test_pairer_media_in_two_parts_is_pending_once():
+    pairer = SidecarPairer()
+    pairer.add_media('a', 'IMG_1.jpg')
+    pairer.add_media('a', 'IMG_1.jpg')
+    pairer.add_media('a', 'IMG_2.jpg')
+    pairer.add_media('a', 'IMG_2.jpg')
+    assert pairer.add_sidecar('a', 'IMG_1.jpg.json') == [('a', 'IMG_1.jpg', 'IMG_1.jpg.json')]
+    assert pairer.finish() == ([], [('a', 'IMG_2.jpg')])
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from state_db import StateDB, file_fingerprint, sidecar_hash
+
+
+@pytest.fixture
+def state(tmp_path):
+    with StateDB(str(tmp_path / 'state' / 'state.sqlite')) as state:
+        yield state
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(b'jpeg data')
+    os.utime(path, ns=(1_000_000_000_000_000_000, 1_000_000_000_000_000_000))
+    return str(path)
+
+
+def test_record_and_is_current(state, photo):
+    fingerprint = file_fingerprint(photo, 'abc')
+    assert fingerprint == (9, 1_000_000_000_000_000_000, 'abc')
+    assert state.get('embed', photo) is None
+    assert not state.is_current('embed', photo, fingerprint)
+
+    state.record('embed', photo, fingerprint)
+    assert state.get('embed', photo) == fingerprint
+    assert state.is_current('embed', photo, fingerprint)
+    # A relative spelling of the same path finds the same row
+    assert state.is_current('embed', os.path.relpath(photo), fingerprint)
+
+
+def test_recorded_rows_survive_reopening(tmp_path, photo):
+    path = str(tmp_path / 'state.sqlite')
+    with StateDB(path) as state:
+        state.record('embed', photo, file_fingerprint(photo, 'abc'))
+        state.commit()
+    with StateDB(path) as state:
+        assert state.is_current('embed', photo, file_fingerprint(photo, 'abc'))
+
+
+def test_record_replaces_the_previous_fingerprint(state, photo):
+    state.record('embed', photo, (1, 2, 'old'))
+    state.record('embed', photo, file_fingerprint(photo, 'new'))
+    assert state.get('embed', photo) == file_fingerprint(photo, 'new')
+
+
+@pytest.mark.parametrize('edit', [
+    pytest.param(lambda path: open(path, 'ab').write(b'more'), id='size'),
+    pytest.param(lambda path: os.utime(path, ns=(2_000_000_000_000_000_000, 2_000_000_000_000_000_000)), id='mtime'),
+])
+def test_changed_file_is_not_current(state, photo, edit):
+    state.record('embed', photo, file_fingerprint(photo, 'abc'))
+    edit(photo)
+    assert not state.is_current('embed', photo, file_fingerprint(photo, 'abc'))
+
+
+def test_changed_digest_is_not_current(state, photo):
+    state.record('embed', photo, file_fingerprint(photo, 'abc'))
+    assert not state.is_current('embed', photo, file_fingerprint(photo, 'def'))
+
+
+def test_rows_are_keyed_by_stage_and_path(state, photo, tmp_path):
+    other = tmp_path / 'other.jpg'
+    other.write_bytes(b'jpeg data')
+    fingerprint = file_fingerprint(photo, 'abc')
+    state.record('embed', photo, fingerprint)
+
+    assert not state.is_current('creation_date', photo, fingerprint)
+    assert state.get('embed', str(other)) is None
+    state.record('creation_date', photo, (1, 2, ''))
+    assert state.get('embed', photo) == fingerprint
+
+
+def test_fingerprint_from_a_stat_result(photo):
+    assert file_fingerprint(photo, 'abc', os.stat(photo)) == file_fingerprint(photo, 'abc')
+
+
+def test_sidecar_hash(tmp_path):
+    sidecar = tmp_path / 'photo.jpg.json'
+    sidecar.write_text('{"title": "a"}')
+    first = sidecar_hash(str(sidecar))
+    sidecar.write_text('{"title": "b"}')
+    assert sidecar_hash(str(sidecar)) != first
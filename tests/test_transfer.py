@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+import transfer
+from transfer import TransferStats, copy_file, move_file, transfer_files
+
+DATA = os.urandom(256 * 1024)
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'source.jpg'
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def test_copy_file(source, tmp_path):
+    destination = str(tmp_path / 'copy.jpg')
+    assert copy_file(source, destination) in ('reflink', 'copy_file_range', 'buffered')
+    assert open(destination, 'rb').read() == DATA
+    with pytest.raises(FileExistsError):
+        copy_file(source, destination)
+
+
+@pytest.mark.skipif(not hasattr(os, 'copy_file_range'), reason="copy_file_range is Linux only")
+def test_short_copy_file_range_falls_back(source, tmp_path, monkeypatch):
+    copy_file_range = os.copy_file_range
+    calls = []
+
+    def stops_early(source_fd, destination_fd, count):
+        # Copies one block, then reports end of file as some filesystems do
+        calls.append(count)
+        return copy_file_range(source_fd, destination_fd, 4096) if len(calls) == 1 else 0
+
+    monkeypatch.setattr(os, 'copy_file_range', stops_early)
+    monkeypatch.setattr(transfer, '_FAST_PATHS', [transfer._copy_file_range])
+    destination = str(tmp_path / 'copy.jpg')
+
+    assert copy_file(source, destination) == 'buffered'
+    assert open(destination, 'rb').read() == DATA
+
+
+def test_move_never_overwrites(source, tmp_path):
+    destination = tmp_path / 'existing.jpg'
+    destination.write_bytes(b'keep me')
+    with pytest.raises(FileExistsError):
+        move_file(source, str(destination))
+    assert destination.read_bytes() == b'keep me'
+    assert open(source, 'rb').read() == DATA
+
+
+def test_transfer_files_move(source, tmp_path):
+    destination = str(tmp_path / 'moved' / 'source.jpg')
+    stats = TransferStats()
+    results = list(transfer_files([(source, destination)], 'move', jobs=2, same_drive=True, stats=stats))
+
+    assert [result.status for result in results] == ['moved']
+    assert not os.path.exists(source)
+    assert open(destination, 'rb').read() == DATA
+    assert stats.bytes == len(DATA)
@@ -0,0 +1,50 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from io_scheduler import IOScheduler
+from upload_files import run_rclone_async
+
+# Stands in for rclone: reports its pid, then keeps running like a long upload
+SLOW_RCLONE = [sys.executable, '-c', 'import os, time; print(os.getpid(), flush=True); time.sleep(60)']
+
+
+def running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    # A killed child the loop has already waited on is gone; one not yet reaped would be a zombie
+    with open(f'/proc/{pid}/stat') as f:
+        return f.read().split(') ')[1][0] != 'Z'
+
+
+def test_run_rclone_async_returns_exit_code():
+    lines = []
+
+    async def main():
+        with IOScheduler(network=1) as scheduler:
+            return await run_rclone_async([sys.executable, '-c', 'print("one"); print("two"); raise SystemExit(3)'],
+                                          lines.append, scheduler)
+
+    assert asyncio.run(main()) == 3
+    assert [line.strip() for line in lines] == ['one', 'two']
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason="checks the process through /proc")
+def test_run_rclone_async_kills_rclone_when_reading_fails():
+    pids = []
+
+    def on_line(line):
+        pids.append(int(line))
+        raise ValueError("progress bar failed")
+
+    async def main():
+        with IOScheduler(network=1) as scheduler:
+            await asyncio.wait_for(run_rclone_async(SLOW_RCLONE, on_line, scheduler), timeout=30)
+
+    with pytest.raises(ValueError):
+        asyncio.run(main())
+    assert not running(pids[0])
@@ -0,0 +1,246 @@
+import collections
+import errno
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_BUFFER_SIZE = 8 * 1024 * 1024
+DEFAULT_TRANSFER_JOBS = 8
+# FICLONE ioctl: share the source extents with the copy (btrfs, XFS, bcachefs, ...)
+_FICLONE = 0x40049409
+# Errors meaning the fast path is not supported for this pair of files, so the next one is tried
+_UNSUPPORTED_ERRORS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class TransferResult:
+    """Outcome of a single file transfer; status is 'copied', 'moved', 'skipped' or 'failed'"""
+
+    __slots__ = ('source', 'destination', 'status', 'size', 'seconds', 'method', 'error')
+
+    def __init__(self, source, destination, status, size=0, seconds=0.0, method='', error=''):
+        self.source = source
+        self.destination = destination
+        self.status = status
+        self.size = size
+        self.seconds = seconds
+        self.method = method
+        self.error = error
+
+    def __repr__(self):
+        return f"TransferResult({self.source!r}, {self.status!r}, size={self.size}, method={self.method!r})"
+
+
+class TransferStats:
+    """Totals and throughput of a batch of transfers"""
+
+    def __init__(self):
+        self.counts = {'copied': 0, 'moved': 0, 'skipped': 0, 'failed': 0}
+        self.methods = {}
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def add(self, result):
+        self.counts[result.status] += 1
+        if result.status in ('copied', 'moved'):
+            self.bytes += result.size
+            self.methods[result.method] = self.methods.get(result.method, 0) + 1
+
+    @property
+    def transferred(self):
+        return self.counts['copied'] + self.counts['moved']
+
+    def log(self):
+        """Log the totals and the overall throughput"""
+        elapsed = max(self.elapsed, 1e-9)
+        megabytes = self.bytes / (1024 * 1024)
+        methods = ', '.join(f"{method}: {count}" for method, count in sorted(self.methods.items())) or 'none'
+        logger.info(f"Transferred {self.transferred} files ({megabytes:.1f} MB) in {self.elapsed:.1f}s: "
+                    f"{megabytes / elapsed:.1f} MB/s, {self.transferred / elapsed:.1f} files/s "
+                    f"({self.counts['skipped']} skipped, {self.counts['failed']} failed; {methods})")
+
+
+class _DirectoryCache:
+    """
+    Creates each destination directory once and lists it once
+
+    The listing answers "does this file already exist" for every later file in the same
+    directory, instead of a stat per file.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = {}
+
+    def names(self, directory):
+        with self._lock:
+            names = self._names.get(directory)
+            if names is None:
+                os.makedirs(directory, exist_ok=True)
+                with os.scandir(directory) as entries:
+                    names = {os.path.normcase(entry.name) for entry in entries}
+                self._names[directory] = names
+            return names
+
+
+def _reflink(source_fd, destination_fd, size):
+    fcntl.ioctl(destination_fd, _FICLONE, source_fd)
+    return 'reflink'
+
+
+def _copy_file_range(source_fd, destination_fd, size):
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(source_fd, destination_fd, min(size - copied, 1 << 30))
+        if count == 0:
+            # Some filesystems report 0 instead of an error; let the buffered copy take over
+            raise OSError(errno.EINVAL, f"copy_file_range stopped after {copied} of {size} bytes")
+        copied += count
+    return 'copy_file_range'
+
+
+_FAST_PATHS = []
+if sys.platform.startswith('linux') and fcntl is not None:
+    _FAST_PATHS.append(_reflink)
+if hasattr(os, 'copy_file_range'):
+    _FAST_PATHS.append(_copy_file_range)
+
+
+def _copy_buffered(source, destination):
+    buffer = bytearray(TRANSFER_BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        count = source.readinto(buffer)
+        if not count:
+            break
+        destination.write(view[:count])
+    return 'buffered'
+
+
+def copy_file(source_path, destination_path):
+    """
+    Copy a file's data and metadata, like shutil.copy2, never overwriting the destination
+
+    On Linux the copy is a reflink when the filesystem supports it, then copy_file_range
+    (kernel side copy); otherwise the data goes through a large reusable buffer. Raises
+    FileExistsError if the destination exists. Returns the copy method used.
+    """
+    with open(source_path, 'rb', buffering=0) as source:
+        size = os.fstat(source.fileno()).st_size
+        try:
+            with open(destination_path, 'xb', buffering=0) as destination:
+                method = None
+                for fast_path in _FAST_PATHS:
+                    try:
+                        method = fast_path(source.fileno(), destination.fileno(), size)
+                        break
+                    except OSError as e:
+                        if e.errno not in _UNSUPPORTED_ERRORS:
+                            raise
+                        # Start over in case the failed attempt wrote part of the file
+                        source.seek(0)
+                        destination.seek(0)
+                        destination.truncate()
+                if method is None:
+                    method = _copy_buffered(source, destination)
+        except FileExistsError:
+            raise
+        except BaseException:
+            try:
+                os.remove(destination_path)
+            except OSError:
+                pass
+            raise
+    shutil.copystat(source_path, destination_path)
+    return method
+
+
+def move_file(source_path, destination_path):
+    """
+    Move a file within a drive, never overwriting the destination
+
+    os.rename silently replaces an existing destination on POSIX, so the file is hard
+    linked to its new name (which fails with FileExistsError) and the old name removed.
+    Where hard links are not possible, e.g. across filesystems, it is copied exclusively
+    and the source deleted; Windows' rename already refuses to replace. Returns the method used.
+    """
+    if os.name == 'nt':
+        os.rename(source_path, destination_path)
+        return 'rename'
+    try:
+        os.link(source_path, destination_path)
+        method = 'link'
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED_ERRORS and e.errno != errno.EMLINK:
+            raise
+        method = copy_file(source_path, destination_path)
+    os.unlink(source_path)
+    return method
+
+
+def transfer_file(source, destination, operation, same_drive, directories):
+    """Copy or move a single file and return its TransferResult"""
+    started = time.perf_counter()
+    directory, name = os.path.split(destination)
+    try:
+        names = directories.names(directory)
+        if os.path.normcase(name) in names:
+            return TransferResult(source, destination, 'skipped', error='destination exists')
+        size = os.path.getsize(source)
+        if operation == 'move' and same_drive:
+            method = move_file(source, destination)
+        else:
+            method = copy_file(source, destination)
+            if operation == 'move':
+                # Cross-drive move requires copy then delete
+                os.remove(source)
+        names.add(os.path.normcase(name))
+    except FileExistsError:
+        return TransferResult(source, destination, 'skipped', error='destination exists')
+    except OSError as e:
+        metrics.count('transfer_failures')
+        return TransferResult(source, destination, 'failed', seconds=time.perf_counter() - started, error=str(e))
+    status = 'moved' if operation == 'move' else 'copied'
+    seconds = time.perf_counter() - started
+    metrics.record('file_rename' if method in ('rename', 'link') else 'file_copy', seconds)
+    return TransferResult(source, destination, status, size, seconds, method)
+
+
+def transfer_files(pairs, operation='copy', jobs=DEFAULT_TRANSFER_JOBS, same_drive=False, stats=None):
+    """
+    Copy or move many (source, destination) files from a thread pool
+
+    Existing destinations are skipped, never overwritten. Yields a TransferResult per file
+    in input order; pass a TransferStats to have it filled in with the totals of the run.
+    Only a few files per thread are queued at a time, so pairs can be a lazy iterator.
+    """
+    stats = stats if stats is not None else TransferStats()
+    directories = _DirectoryCache()
+    jobs = max(1, jobs)
+    started = time.perf_counter()
+    pending = collections.deque()
+    try:
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='transfer') as executor:
+            for source, destination in pairs:
+                pending.append(executor.submit(transfer_file, source, destination, operation, same_drive, directories))
+                if len(pending) >= jobs * 4:
+                    result = pending.popleft().result()
+                    stats.add(result)
+                    yield result
+            while pending:
+                result = pending.popleft().result()
+                stats.add(result)
+                yield result
+    finally:
+        stats.elapsed = time.perf_counter() - started
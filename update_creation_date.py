@@ -1,97 +1,267 @@
+import asyncio
 import datetime
 import logging
 import os
-import subprocess
 import sys
 import argparse
+import metrics
+from date_manifest import DEFAULT_DATE_MANIFEST, DateManifest
+from exiftool_batch import batched
+from exiftool_pool import AsyncExifToolPool, ExifToolPool, JobSummary
+from exiftool_scan import path_key, read_dates
+from file_times import DEFAULT_BATCH_SIZE, apply_creation_times, log_failures, set_creation_times
+from inventory import DEFAULT_INVENTORY, load_inventory
+from io_scheduler import add_scheduler_arguments, scheduler_from_args
 from logger_utils import Colors, setup_logging
-import win32file
-import win32con
-import pywintypes
+from metrics import add_metrics_arguments, setup_metrics
+from state_db import DEFAULT_STATE_DB, StateDB, file_fingerprint
 
 logger = setup_logging(script_name='exif-embed-update-creation-date')
 
+# Files whose dates are resolved, applied and recorded in the state database together
+APPLY_BATCH_SIZE = 1000
+
+def find_files(root_folder, summary, state=None, resume=True, inventory=None):
+    """
+    Walk the tree and yield the path of every file whose creation date should be updated
+
+    With a state database and resume enabled, files whose date was already applied and that
+    have not changed since are skipped, using the inventory's cached stats.
+    """
+    if inventory is None:
+        inventory = load_inventory(root_folder)
+    for subdir, entries in inventory.walk(root_folder):
+        logger.info(f"Processing directory: {Colors.CYAN}{subdir}{Colors.RESET}")
+        for entry in entries:
+            if entry.name.lower().endswith('.wmv'):
+                continue
+            file_path = entry.path
+            if state and resume and state.is_current('creation_date', file_path, file_fingerprint(file_path, stat=entry)):
+                logger.debug(f"Skipping already updated file: {file_path}")
+                summary.add_skipped()
+                continue
+            yield file_path
+
+def date_read_args(file_path):
+    """Return the ExifTool arguments that read the raw date taken of a single file"""
+    if file_path.lower().endswith('.mp4'):
+        return [
+            '-s',  # Short output
+            '-Quicktime:CreateDate',  # Get the original date taken
+            file_path
+        ]
+    return [
+        '-s',  # Short output
+        '-DateTimeOriginal',  # Get the original date taken
+        file_path
+    ]
+
+def parse_date_output(file_path, result):
+    """Return the raw date taken from the ExifTool result of date_read_args, or None"""
+    image_date = None
+    if result.ok:
+        logger.debug(f"ExifTool output for {os.path.basename(file_path)}: {result.stdout.strip()}")
+        parts = result.stdout.strip().split(': ')
+        if len(parts) > 1 and (parts[0].strip() == 'DateTimeOriginal' or parts[0].strip() == 'CreateDate'):
+            image_date = parts[1].strip()
+    return image_date
+
+def read_file_date(exiftool, file_path):
+    """Read the raw date taken of a single file with ExifTool, or return None"""
+    return parse_date_output(file_path, exiftool.execute(date_read_args(file_path)))
+
+def collect_dates(files, manifest=None, bulk_read=True):
+    """
+    Return a {path_key: date string} map of the known dates taken of files
+
+    Dates recorded by embed.py in the date manifest are used first. With bulk_read, the
+    files missing from it are read with a single ExifTool scan; otherwise they are left
+    for update_file_date to read one at a time.
+    """
+    dates = {}
+    if manifest is not None:
+        for file_path in files:
+            date = manifest.get(file_path)
+            if date:
+                dates[path_key(file_path)] = date
+        logger.info(f"Found dates for {len(dates)} of {len(files)} files in the date manifest")
+        metrics.count('manifest_dates', len(dates))
+
+    missing = [file_path for file_path in files if path_key(file_path) not in dates]
+    if bulk_read and missing:
+        logger.info(f"Reading dates of {len(missing)} files with ExifTool")
+        dates.update(read_dates(missing))
+    return dates
+
+def resolve_file_date(exiftool, file_path, default_date, dates=None, read_missing=True):
+    """
+    Work out the creation date a single file should get from its date taken
+
+    The date comes from the dates map when it has one for the file, otherwise, with
+    read_missing, it is read from the file with ExifTool.
+    Returns the datetime to apply, or None if no usable date was found
+    """
+    file = os.path.basename(file_path)
+    image_date = dates.get(path_key(file_path)) if dates else None
+    if image_date is None and read_missing:
+        image_date = read_file_date(exiftool, file_path)
+    if image_date:
+        image_date = image_date.split('-')[0].split('+')[0].strip()
+
+    if not image_date:
+        return None
+
+    try :
+        try:
+            logger.debug(f"Raw image date for {file}: {image_date}")
+
+            image_date = datetime.datetime.strptime(image_date, '%Y:%m:%d %H:%M:%S')
+            image_date = image_date.replace(year=1971) if image_date.year < 1971 else image_date
+            logger.debug(f"Parsed image date for {file}: {image_date}")
+        except ValueError as e:
+            logging.debug(f"Using default date. Failed to parse image date for {file}: [{e}]")
+            image_date = datetime.datetime.strptime(default_date, '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        raise ValueError(f"Invalid date format for {file}: {image_date}")
+
+    return image_date
+
+def plan_updates(resolved, summary, state, inventory=None):
+    """
+    Sort a batch of resolved dates into the creation times to apply
+
+    resolved yields a (file_path, datetime or None, error) triple per file, as
+    ExifToolPool.imap does for resolve_file_date. Errors are added to the summary, and
+    files without a usable date are recorded as done. Returns the (file_path, datetime) updates.
+    """
+    updates = []
+    for file_path, image_date, error in resolved:
+        if error:
+            logger.error(f"Failed to process {os.path.basename(file_path)}: {str(error)}", exc_info=error)
+            summary.add_error(file_path, str(error))
+        elif image_date:
+            logger.debug(f"Updating {os.path.basename(file_path)} creation date to {image_date}")
+            updates.append((file_path, image_date))
+        else:
+            summary.add_skipped()
+            state.record('creation_date', file_path, file_fingerprint(file_path, stat=inventory.get(file_path) if inventory else None))
+    return updates
+
+def record_updates(updates, failures, summary, state, inventory=None):
+    """Record the applied creation times in the summary and the state database"""
+    failed = {file_path for file_path, _ in failures}
+    for file_path, message in failures:
+        summary.add_error(file_path, message)
+    for file_path, _ in updates:
+        if file_path not in failed:
+            summary.add_success()
+            state.record('creation_date', file_path, file_fingerprint(file_path, stat=inventory.refresh(file_path) if inventory else None))
+    state.commit()
+
+def update_files(resolved, summary, state, inventory=None, jobs=1):
+    """Apply and record the creation dates of a batch of resolved files, and return the timestamp failures"""
+    updates = plan_updates(resolved, summary, state, inventory)
+    failures = apply_creation_times(updates, jobs)
+    record_updates(updates, failures, summary, state, inventory)
+    return failures
+
+async def update_files_async(files, summary, state, scheduler, default_date, dates, read_missing, inventory=None, jobs=1):
+    """
+    asyncio variant of the update loop of update_creation_date, returning the timestamp failures
+
+    Dates missing from the dates map are read by up to `jobs` ExifTool workers driven from
+    the event loop, and the creation times of each batch are set on the IOScheduler's disk
+    threads in chunks, within its disk limit.
+    """
+    failures = []
+    async with AsyncExifToolPool(jobs=jobs) as pool:
+        async def resolve(file_path):
+            try:
+                known = dates
+                if read_missing and path_key(file_path) not in dates:
+                    async with scheduler.limit('cpu'), pool.session() as exiftool:
+                        result = await exiftool.execute(date_read_args(file_path))
+                    known = {path_key(file_path): parse_date_output(file_path, result)}
+                return file_path, resolve_file_date(None, file_path, default_date, known, False), None
+            except Exception as e:
+                return file_path, None, e
+
+        for batch in batched(files, APPLY_BATCH_SIZE):
+            resolved = await asyncio.gather(*(resolve(file_path) for file_path in batch))
+            updates = plan_updates(resolved, summary, state, inventory)
+            chunks = await asyncio.gather(*(scheduler.run('disk', set_creation_times, chunk)
+                                            for chunk in batched(updates, DEFAULT_BATCH_SIZE)))
+            batch_failures = [failure for chunk in chunks for failure in chunk]
+            record_updates(updates, batch_failures, summary, state, inventory)
+            failures += batch_failures
+    return failures
+
 def update_creation_date():
     parser = argparse.ArgumentParser(description="Update the creation date of media files based on metadata JSON files.")
-    parser.add_argument("--source", "-s", default="./extracts/Takeout/Google Photos", 
+    parser.add_argument("--source", "-s", default="./extracts/Takeout/Google Photos",
                         help="Source directory containing files (default: ./extracts/Takeout/Google Photos)")
-    parser.add_argument("--defaultdate", "-d", default="1973:12:21 00:00:00", 
+    parser.add_argument("--defaultdate", "-d", default="1973:12:21 00:00:00",
                         help="Default date to use if no metadata is found (default: 1973:12:21 00:00:00)")
-    
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of parallel ExifTool workers and timestamp threads (default: 1)")
+    parser.add_argument("--state-db", default=DEFAULT_STATE_DB,
+                        help=f"SQLite database recording already updated files (default: {DEFAULT_STATE_DB})")
+    parser.add_argument("--date-manifest", default=DEFAULT_DATE_MANIFEST,
+                        help=f"Manifest of dates recorded by embed.py, used before reading any file (default: {DEFAULT_DATE_MANIFEST})")
+    parser.add_argument("--inventory", nargs="?", const=DEFAULT_INVENTORY,
+                        help=f"Reuse the file inventory saved by an earlier stage and save it back, instead of scanning the whole tree (path defaults to {DEFAULT_INVENTORY})")
+    parser.add_argument("--no-date-manifest", dest="use_manifest", action="store_false",
+                        help="Ignore the date manifest and read every date from the files")
+    read_group = parser.add_mutually_exclusive_group()
+    read_group.add_argument("--bulk-read", dest="bulk_read", action="store_true", default=True,
+                        help="Read dates missing from the manifest with a single ExifTool scan before updating (default)")
+    read_group.add_argument("--per-file-read", dest="bulk_read", action="store_false",
+                        help="Query ExifTool once per file for dates missing from the manifest")
+    resume_group = parser.add_mutually_exclusive_group()
+    resume_group.add_argument("--resume", dest="resume", action="store_true", default=True,
+                        help="Skip files whose creation date was already updated (default)")
+    resume_group.add_argument("--force", dest="resume", action="store_false",
+                        help="Update every file, even if it was already updated")
+    add_scheduler_arguments(parser)
+    add_metrics_arguments(parser)
+
     args = parser.parse_args()
+    setup_metrics(args, 'update-creation-date')
     root_folder = args.source
     default_date = args.defaultdate
 
-    for subdir, _, files in os.walk(root_folder):
-        logger.info(f"Processing directory: {Colors.CYAN}{subdir}{Colors.RESET}")        
-        for file in files:
-            try:
-                if file.lower().endswith('.wmv'):
-                    continue
-
-                image_date = None
-                file_date = os.path.getctime(os.path.join(subdir, file))
-                file_date = datetime.datetime.fromtimestamp(file_date).strftime('%Y:%m:%d %H:%M:%S')
-                if file.lower().endswith('.mp4'):
-                    exiftool_cmd = [
-                        'exiftool',
-                        '-s',  # Short output
-                        '-Quicktime:CreateDate',  # Get the original date taken
-                        os.path.join(subdir, file)
-                    ]
-                else:
-                    exiftool_cmd = [
-                        'exiftool',
-                        '-s',  # Short output
-                        '-DateTimeOriginal',  # Get the original date taken
-                        os.path.join(subdir, file)
-                    ]
- 
-                result = subprocess.run(exiftool_cmd, capture_output=True, text=True)
-                if result.returncode == 0:
-                    logger.debug(f"ExifTool output for {file}: {result.stdout.strip()}")
-                    parts = result.stdout.strip().split(': ')
-                    if len(parts) > 1 and (parts[0].strip() == 'DateTimeOriginal' or parts[0].strip() == 'CreateDate'):
-                        image_date = parts[1].strip()
-                    if image_date:
-                        image_date = image_date.split('-')[0].split('+')[0].strip()
-
-                if image_date : # and image_date.split()[0].strip() != file_date.split()[0].strip():
-                    try :
-                        try:
-                            logger.debug(f"Raw image date for {file}: {image_date}")
-
-                            image_date = datetime.datetime.strptime(image_date, '%Y:%m:%d %H:%M:%S')
-                            image_date = image_date.replace(year=1971) if image_date.year < 1971 else image_date 
-                            logger.debug(f"Parsed image date for {file}: {image_date}")
-                        except ValueError as e:
-                            logging.debug(f"Using default date. Failed to parse image date for {file}: [{e}]")
-                            image_date = datetime.datetime.strptime(default_date, '%Y:%m:%d %H:%M:%S')
-                    except ValueError:
-                        logger.error(f"Invalid date format for {file}: {image_date} : {result.stdout.strip()}")
-                        continue
-
-                    logger.debug(f"Updating {file} creation date from {file_date} to {image_date}")
-                    win_time = pywintypes.Time(image_date)
-                    logger.debug(f"Setting creation date to {win_time}")
-                    handle = win32file.CreateFile(
-                        os.path.join(subdir, file),
-                        win32con.GENERIC_WRITE,
-                        win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
-                        None,
-                        win32con.OPEN_EXISTING,
-                        win32con.FILE_ATTRIBUTE_NORMAL,
-                        None
-                    )
-                    
-                    win32file.SetFileTime(handle, win_time, None, None)
-                    handle.close()
+    summary = JobSummary()
+    manifest = DateManifest(args.date_manifest) if args.use_manifest else None
 
-            except Exception as e:
-                logger.exception(f"Failed to process {file}: {str(e)}")
+    inventory = load_inventory(root_folder, args.inventory)
+
+    time_failures = []
+    with StateDB(args.state_db) as state:
+        files = list(find_files(root_folder, summary, state, args.resume, inventory))
+        if args.use_async:
+            async def update_async():
+                with scheduler_from_args(args) as scheduler:
+                    # The bulk scan is one long ExifTool run, streamed from a thread
+                    dates = await scheduler.run('cpu', collect_dates, files, manifest, args.bulk_read)
+                    return await update_files_async(files, summary, state, scheduler, default_date, dates, not args.bulk_read,
+                                                    inventory, args.jobs)
+            time_failures = asyncio.run(update_async())
+        else:
+            dates = collect_dates(files, manifest, args.bulk_read)
+            resolve = lambda exiftool, file_path: resolve_file_date(exiftool, file_path, default_date, dates, not args.bulk_read)
+            with ExifToolPool(jobs=args.jobs) as pool:
+                for batch in batched(files, APPLY_BATCH_SIZE):
+                    time_failures += update_files(pool.imap(resolve, batch), summary, state, inventory, args.jobs)
+
+    if args.inventory:
+        inventory.save(args.inventory)
+
+    log_failures(time_failures)
+    summary.log('Updated creation date of')
+    return 1 if summary.failed else 0
 
 
 if __name__ == "__main__":
     if os.name == 'nt':
         os.system('color')
-    sys.exit(update_creation_date())
\ No newline at end of file
+    sys.exit(update_creation_date())
@@ -1,5 +1,17 @@
-import os, subprocess, logging, argparse, sys, shutil
+import os, subprocess, logging, argparse, sys, tempfile
+import asyncio
+import time
+import metrics
+from dedup import DEFAULT_DUPLICATE_REPORT, read_report
+from exiftool_scan import path_key
+from inventory import DEFAULT_INVENTORY, load_inventory
+from io_scheduler import add_scheduler_arguments, scheduler_from_args
 from logger_utils import Colors, setup_logging
+from metrics import add_metrics_arguments, setup_metrics
+from rclone_log import DEFAULT_RUN_LOG, JSON_LOG_ARGS, RcloneRun, read_summaries, write_summary
+from rclone_tuning import tune_settings
+from state_db import DEFAULT_STATE_DB, StateDB, file_fingerprint
+from transfer import DEFAULT_TRANSFER_JOBS, TransferStats, transfer_files
 from  tqdm import tqdm
 
 logger = setup_logging(script_name='exif-embed-upload-files')
@@ -39,74 +51,201 @@ def check_rclone():
         logger.error(f"{Colors.BRIGHT_RED}Rclone not found. Please install rclone and ensure it's in your PATH.{Colors.RESET}")
         return False, None
 
-def upload_to_onedrive(source_dir, target_path, remote, rclone_path):
+def write_rclone_excludes(paths, source_dir):
+    """Write an rclone --exclude-from file matching exactly the given files under source_dir, and return its path"""
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False) as f:
+        for path in paths:
+            relative = os.path.relpath(path, source_dir).replace(os.sep, '/')
+            # Escape the filter glob characters, and anchor the pattern to the source root
+            f.write('/' + ''.join('\\' + c if c in '\\*?[]{}' else c for c in relative) + '\n')
+    return f.name
+
+def write_rclone_files_from(paths, source_dir):
+    """Write an rclone --files-from-raw list of the given files, relative to source_dir, and return its path"""
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False) as f:
+        for path in paths:
+            f.write(os.path.relpath(path, source_dir).replace(os.sep, '/') + '\n')
+    return f.name
+
+async def run_rclone_async(cmd, on_line, scheduler):
+    """
+    Run rclone with asyncio.create_subprocess_exec within the scheduler's network limit
+
+    Every line rclone writes to stdout or stderr is passed to on_line. Returns the exit code.
+    If on_line raises or the task is cancelled, rclone is killed rather than left running.
+    """
+    async with scheduler.limit('network'):
+        process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        try:
+            async for line in process.stdout:
+                on_line(line.decode('utf-8', errors='replace'))
+            return await process.wait()
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+def upload_to_onedrive(source_dir, target_path, remote, rclone_path, inventory=None, exclude=None, run_log=DEFAULT_RUN_LOG,
+                       ledger=None, overrides=None, scheduler=None):
     """
     Upload files to OneDrive using rclone while preserving directory structure
-    
+
+    rclone reports through its JSON log: the progress bar follows the bytes and ETA of its
+    stats, and every copied file, error and retry is logged. A summary of the run, with
+    the settings used and the measured throughput, is appended to run_log.
+
+    The transfers, checkers and chunk size are tuned from the file size distribution and
+    the throughput measured by earlier runs in run_log. With a ledger, only the files that
+    are new or changed since they were last uploaded to this destination are handed to
+    rclone through --files-from-raw, and rclone does not list the remote at all.
+
     Args:
-        files: List of files to upload
         remote: Rclone remote name (e.g., 'onedrive')
         target_path: Target folder on the remote
         rclone_path: Path to the rclone executable
         source_dir: Source directory to use as base for preserving folder structure
+        inventory: Inventory of source_dir used to count the files, scanned if not given
+        exclude: Set of path_key() paths to leave out, e.g. duplicates found by dedup.py
+        run_log: JSON lines file the run summary is appended to, or None
+        ledger: StateDB recording the files already uploaded, for an incremental upload
+        overrides: Dict of settings (transfers, checkers, chunk_size) that replace the tuned ones
+        scheduler: IOScheduler to run rclone from an asyncio event loop with, instead of a blocking Popen
+    Returns:
+        True if rclone succeeded
     """ 
     if not os.path.isdir(source_dir):
         logger.error(f"{Colors.BRIGHT_RED}Source directory '{source_dir}' does not exist{Colors.RESET}")
         return False
     
+    destination = f"{remote}:{target_path}"
+    list_file = None
+    launched = False
+    return_code = None
+    pbar = None
+    run = None
+    pending = []
     try:
-        file_cmd = f'dir /s /b /a-d "{source_dir}" | find /c /v ""'
-        file_output = subprocess.check_output(file_cmd, shell=True, text=True)
-        file_count = int(file_output.strip())
+        if inventory is None:
+            inventory = load_inventory(source_dir)
+        entries = list(inventory.files(source_dir))
+        if exclude:
+            included = [entry for entry in entries if path_key(entry.path) not in exclude]
+            logger.info(f"Leaving out {len(entries) - len(included)} duplicate files")
+        else:
+            included = entries
+        if ledger is not None:
+            # The destination is part of the fingerprint, so a new target folder uploads everything again
+            pending = [entry for entry in included
+                       if not ledger.is_current('upload', entry.path, file_fingerprint(entry.path, destination, entry))]
+            logger.info(f"{len(pending)} of {len(included)} files are new or changed since the last upload to {destination}")
+            if not pending:
+                logger.info(f"{Colors.BRIGHT_GREEN}Nothing new to upload{Colors.RESET}")
+                return True
+        else:
+            pending = included
+        file_count = len(pending)
+        total_bytes = sum(entry.st_size for entry in pending)
         logger.info(f"{Colors.BRIGHT_GREEN}Starting upload of {file_count} files in directory {source_dir} to OneDrive{Colors.RESET}")
 
-        pbar = tqdm(total=file_count, desc="Uploading files", unit="file", dynamic_ncols=True)
-        # Build the rclone command with progress option
+        settings = tune_settings([entry.st_size for entry in pending], read_summaries(run_log) if run_log else (), remote)
+        settings.update(overrides or {})
+        settings.update(remote=remote, incremental=ledger is not None)
+        logger.info(f"Using {settings['transfers']} transfers, {settings['checkers']} checkers and "
+                    f"{settings['chunk_size']} chunks ({settings['profile']} file profile)")
+        run = RcloneRun(file_count, total_bytes, settings)
+        pbar = tqdm(total=total_bytes, desc="Uploading files", unit="B", unit_scale=True, unit_divisor=1024, dynamic_ncols=True)
+        # Build the rclone command with JSON log and stats output
         cmd = [
             rclone_path, 
             "copy", 
-            "-v",
-            "--transfers", "4",  # Number of file transfers to run in parallel
+            *JSON_LOG_ARGS,
+            "--transfers", str(settings['transfers']),  # Number of file transfers to run in parallel
+            "--checkers", str(settings['checkers']),
+            "--onedrive-chunk-size", settings['chunk_size'],
             source_dir,  
-            f"{remote}:{target_path}"  # Destination
+            destination
         ]
+        if ledger is not None:
+            # Only the listed files are looked up on the remote, instead of listing every remote folder
+            list_file = write_rclone_files_from([entry.path for entry in pending], source_dir)
+            cmd[2:2] = ["--files-from-raw", list_file, "--no-traverse"]
+        elif len(included) < len(entries):
+            list_file = write_rclone_excludes([entry.path for entry in entries if path_key(entry.path) in exclude], source_dir)
+            cmd[2:2] = ["--exclude-from", list_file]
 
         logger.debug(f"Running command: {' '.join(cmd)}")
         
-        # Run the command and stream output in real-time
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1
-        )
-        
-        # Process and log output in real-time
-        for line in process.stdout:
-            line = line.strip()
-            if line:
-                if "ERROR" in line:
-                    logger.error(line)
-                elif "copied:" in line or "Copied:" in line:
-                    pbar.update(1)
-                    logger.info(f"{Colors.BRIGHT_BLUE}{line}{Colors.RESET}")
-                elif "There was nothing to transfer" in line:
-                    pbar.update(file_count - pbar.n)  # Complete the progress bar if no files to transfer
-                else:
-                    logger.debug(line)
-        
-        process.wait()
+        def follow(line):
+            if not line.strip():
+                return
+            kind, record = run.feed(line)
+            if kind == 'stats':
+                pbar.update(max(0, run.bytes - pbar.n))
+                eta = run.eta()
+                pbar.set_postfix(files=f"{len(run.transfers)}/{file_count}", eta=f"{eta}s" if eta is not None else '-')
+            elif kind == 'transfer':
+                logger.info(f"{Colors.BRIGHT_BLUE}{record['msg']}: {record['object']}{Colors.RESET}")
+            elif kind == 'error':
+                logger.error(f"{record.get('object', '')}: {record.get('msg', '')}" if record.get('object') else record.get('msg', ''))
+            elif kind == 'retry':
+                logger.warning(f"{Colors.YELLOW}{record.get('msg', '')}{Colors.RESET}")
+            elif kind == 'log':
+                logger.debug(record.get('msg', ''))
+            else:
+                logger.debug(record)
+
+        launched = True
+        started = time.perf_counter()
+        if scheduler is not None:
+            return_code = asyncio.run(run_rclone_async(cmd, follow, scheduler))
+        else:
+            # Run the command and stream output in real-time
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                encoding='utf-8',
+                errors='replace',
+                bufsize=1
+            )
+            for line in process.stdout:
+                follow(line)
+            return_code = process.wait()
+        if run.nothing_to_transfer:
+            pbar.update(total_bytes - pbar.n)  # Complete the progress bar if no files to transfer
             
     except Exception as e:
         logger.error(f"{Colors.BRIGHT_RED}Error during upload: {str(e)}{Colors.RESET}")
 
     finally:
-        pbar.close()
-        if process.returncode == 0:
-            logger.info(f"{Colors.BRIGHT_GREEN}Upload completed successfully{Colors.RESET}")
-        else:
-            logger.error(f"{Colors.BRIGHT_RED}Upload failed with return code {process.returncode}{Colors.RESET}")
+        if list_file:
+            os.remove(list_file)
+        if pbar is not None:
+            pbar.close()
+
+    if run is not None and launched:
+        summary = run.summary(return_code)
+        metrics.record('rclone_run', time.perf_counter() - started, summary['files_transferred'])
+        metrics.count('bytes_uploaded', summary['bytes_transferred'])
+        metrics.count('upload_errors', summary['errors'])
+        logger.info(f"Uploaded {summary['files_transferred']} files ({summary['bytes_transferred'] / (1024 * 1024):.1f} MB) "
+                    f"in {summary['elapsed']:.1f}s at {summary['speed_avg'] / (1024 * 1024):.2f} MB/s, "
+                    f"{summary['errors']} errors, {summary['retries']} retries")
+        if run_log:
+            write_summary(summary, run_log)
+    if ledger is not None and run is not None:
+        # On success every listed file is on the remote, whether it was copied or already there
+        uploaded = {path_key(os.path.join(source_dir, name)) for name, _, _ in run.transfers}
+        for entry in pending:
+            if return_code == 0 or path_key(entry.path) in uploaded:
+                ledger.record('upload', entry.path, file_fingerprint(entry.path, destination, entry))
+        ledger.commit()
+    if return_code == 0:
+        logger.info(f"{Colors.BRIGHT_GREEN}Upload completed successfully{Colors.RESET}")
+        return True
+    logger.error(f"{Colors.BRIGHT_RED}Upload failed with return code {return_code}{Colors.RESET}")
+    return False
 
 def process_files(source_dir, destination, **kwargs):
     """
@@ -118,9 +257,16 @@ def process_files(source_dir, destination, **kwargs):
         kwargs: Additional arguments:
             - target_dir: Target directory on OneDrive
             - operation: Either 'move' or 'copy', only used if target is Pictures.
+            - jobs: Number of parallel copy/move threads, only used if target is Pictures.
                 
             - rclone_path: Path to the rclone executable
             - rclone_remote: Rclone remote name which was setup by running `rclone config`
+            - inventory: Inventory of source_dir shared with the earlier stages, scanned if not given
+            - exclude: Set of path_key() paths to leave out, e.g. duplicates listed by dedup.py
+            - run_log: JSON lines file the OneDrive run summary is appended to
+            - ledger: StateDB of files already uploaded; only new or changed files are sent to OneDrive
+            - overrides: Dict of rclone settings (transfers, checkers, chunk_size) replacing the tuned ones
+            - scheduler: IOScheduler that runs rclone through asyncio, for the --async mode
     Returns:
         List of found files, or success status if target_folder is provided
 
@@ -132,11 +278,16 @@ def process_files(source_dir, destination, **kwargs):
         return False
 
     target_dir = kwargs.get('target_dir')
+    inventory = kwargs.get('inventory')
+    if inventory is None:
+        inventory = load_inventory(source_dir)
     if destination == 'onedrive':
         rclone_path = kwargs.get('rclone_path')        
         rclone_remote = kwargs.get('rclone_remote')
         logger.info(f"{Colors.BRIGHT_GREEN}Uploading files to OneDrive : {target_dir}{Colors.RESET}")
-        return upload_to_onedrive(source_dir, target_dir, rclone_remote, rclone_path)
+        return upload_to_onedrive(source_dir, target_dir, rclone_remote, rclone_path, inventory, kwargs.get('exclude'),
+                                  kwargs.get('run_log', DEFAULT_RUN_LOG), kwargs.get('ledger'), kwargs.get('overrides'),
+                                  kwargs.get('scheduler'))
     
     if destination == 'pictures':
         operation = kwargs.get('operation')
@@ -147,52 +298,33 @@ def process_files(source_dir, destination, **kwargs):
         
         target_dir = os.path.join(os.path.expanduser('~\\Pictures'), target_dir)
         is_same_drive = os.path.splitdrive(os.path.abspath(source_dir))[0].lower() == os.path.splitdrive(os.path.abspath(target_dir))[0].lower()
-        success_count = 0
-        error_count = 0
-
-        for root, _, files in os.walk(source_dir):
-            for source_file in files:
-                source_file = os.path.join(root, source_file)
-                try:
-                    # source_abs_path = os.path.abspath(file)
-                    # src_rel_path = os.path.relpath(source_abs_path, src)
-                    # dest_rel_path = os.path.relpath(os.path.join(target, src_rel_path))
-                    # dest_abs_path = os.path.abspath(dest_rel_path)
+        exclude = kwargs.get('exclude') or set()
+        sources = [entry.path for entry in inventory.files(source_dir)]
+        pairs = [(source_file, os.path.join(target_dir, os.path.relpath(source_file, start=source_dir)))
+                 for source_file in sources if path_key(source_file) not in exclude]
+        if len(pairs) < len(sources):
+            logger.info(f"Leaving out {len(sources) - len(pairs)} duplicate files")
+        logger.info(f"{operation_verb.capitalize()} {len(pairs)} files with {kwargs.get('jobs', DEFAULT_TRANSFER_JOBS)} threads")
 
-                    dest_file = os.path.join(target_dir, os.path.relpath(source_file, start=source_dir))
-                    if os.path.exists(dest_file):
-                        logger.warning(f"{Colors.YELLOW}File already exists: {dest_file}. Skipping.{Colors.RESET}")
-                        continue
-                    logger.debug(f"{operation_verb.capitalize()} file: {source_file} to {dest_file}")
-
-                    os.makedirs(os.path.dirname(dest_file), exist_ok=True)
-                    if operation == 'copy':
-                        shutil.copy2(source_file, dest_file)
-                        logger.debug(f"Copied: {source_file} to {dest_file}")
-                    else:  # move operation
-                        if is_same_drive:
-                            # On same drive, use rename (efficient move operation)
-                            os.rename(source_file, dest_file)
-                            logger.debug(f"Moved: {source_file} to {dest_file}")
-                        else:
-                            # Cross-drive move requires copy then delete
-                            shutil.copy2(source_file, dest_file)
-                            os.remove(source_file)
-                            logger.debug(f"Cross-drive move: {source_file} to {dest_file}")
-            
-                    success_count += 1
-                
-                except Exception as e:
-                    logger.error(f"{Colors.RED}Failure {operation_verb} {source_file}: {str(e)}{Colors.RESET}")
-                    error_count += 1
+        stats = TransferStats()
+        for result in transfer_files(pairs, operation, kwargs.get('jobs', DEFAULT_TRANSFER_JOBS), is_same_drive, stats):
+            if result.status == 'skipped':
+                logger.warning(f"{Colors.YELLOW}File already exists: {result.destination}. Skipping.{Colors.RESET}")
+            elif result.status == 'failed':
+                logger.error(f"{Colors.RED}Failure {operation_verb} {result.source}: {result.error}{Colors.RESET}")
+            else:
+                if result.status == 'moved':
+                    inventory.discard(result.source)
+                logger.debug(f"{result.status.capitalize()} ({result.method}, {result.seconds:.3f}s): {result.source} to {result.destination}")
 
         # Log success and error counts
         past_tense = "moved" if operation == "move" else "copied"
-        if success_count > 0:
-            logger.info(f"{Colors.BRIGHT_GREEN}Successfully {past_tense} {success_count} files to {target_dir}{Colors.RESET}")
-        if error_count > 0:
-            logger.warning(f"{Colors.YELLOW}Failed to {past_tense} {error_count} files{Colors.RESET}")
-        return success_count > 0
+        if stats.transferred > 0:
+            logger.info(f"{Colors.BRIGHT_GREEN}Successfully {past_tense} {stats.transferred} files to {target_dir}{Colors.RESET}")
+        if stats.counts['failed'] > 0:
+            logger.warning(f"{Colors.YELLOW}Failed to {past_tense} {stats.counts['failed']} files{Colors.RESET}")
+        stats.log()
+        return stats.transferred > 0
     
     # # Try to determine a common base directory
     # try:
@@ -218,10 +350,31 @@ def main():
                         help="Rclone remote name (default: onedrive)")
     parser.add_argument("--target", "-t",
                         help="Target folder on OneDrive or in Pictures Library (leave empty for root folder)")
+    parser.add_argument("--jobs", "-j", type=int, default=DEFAULT_TRANSFER_JOBS,
+                        help=f"Number of parallel copy/move threads for the Pictures destination (default: {DEFAULT_TRANSFER_JOBS})")
+    parser.add_argument("--run-log", default=DEFAULT_RUN_LOG,
+                        help=f"JSON lines file a summary of every OneDrive upload is appended to (default: {DEFAULT_RUN_LOG})")
+    parser.add_argument("--incremental", "-i", action="store_true",
+                        help="OneDrive only: upload just the files that are new or changed since the last upload, according to the upload ledger")
+    parser.add_argument("--state-db", default=DEFAULT_STATE_DB,
+                        help=f"SQLite database holding the upload ledger (default: {DEFAULT_STATE_DB})")
+    parser.add_argument("--transfers", type=int,
+                        help="Number of parallel rclone transfers, instead of tuning it from file sizes and earlier runs")
+    parser.add_argument("--checkers", type=int,
+                        help="Number of parallel rclone checkers, instead of tuning it")
+    parser.add_argument("--chunk-size",
+                        help="OneDrive upload chunk size, a multiple of 320k (e.g. 10M), instead of tuning it")
+    parser.add_argument("--skip-duplicates", nargs="?", const=DEFAULT_DUPLICATE_REPORT,
+                        help=f"Leave out the duplicates listed in a dedup.py report (path defaults to {DEFAULT_DUPLICATE_REPORT})")
+    parser.add_argument("--inventory", nargs="?", const=DEFAULT_INVENTORY,
+                        help=f"Reuse the file inventory saved by an earlier stage and save it back, instead of scanning the whole tree (path defaults to {DEFAULT_INVENTORY})")
     parser.add_argument("--operation", "-o", choices=["move", "copy"], default='copy',
                         help="Choose whether to 'move' or 'copy' files when using Pictures destination (OneDrive is always copy)")
+    add_scheduler_arguments(parser)
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
+    setup_metrics(args, 'upload-files')
     source_dir = os.path.abspath(args.source)
     destination = args.destination.lower() if args.destination else None
     rclone_remote = args.remote # (default: onedrive)
@@ -282,7 +435,23 @@ def main():
                 logger.error(f"{Colors.BRIGHT_RED}Failed to run rclone config: {str(e)}{Colors.RESET}")
                 return 1
 
-    success = process_files(source_dir, destination, target_dir=target_dir, operation=operation, rclone_remote=rclone_remote, rclone_path=rclone_path)
+    inventory = load_inventory(source_dir, args.inventory)
+    exclude = read_report(args.skip_duplicates) if args.skip_duplicates else None
+    overrides = {name: value for name, value in (('transfers', args.transfers), ('checkers', args.checkers),
+                                                 ('chunk_size', args.chunk_size)) if value}
+    ledger = StateDB(args.state_db) if args.incremental and destination == 'onedrive' else None
+    scheduler = scheduler_from_args(args) if args.use_async else None
+    try:
+        success = process_files(source_dir, destination, target_dir=target_dir, operation=operation, rclone_remote=rclone_remote, rclone_path=rclone_path,
+                                inventory=inventory, jobs=args.jobs, exclude=exclude,
+                                run_log=args.run_log, ledger=ledger, overrides=overrides, scheduler=scheduler)
+    finally:
+        if ledger is not None:
+            ledger.close()
+        if scheduler is not None:
+            scheduler.close()
+    if args.inventory:
+        inventory.save(args.inventory)
     return success if success else 1
 
 if __name__ == "__main__":